@@ -1,5 +1,6 @@
 """
 ASGI config for core project.
+HTTP goes to Django as usual, websockets go to the ideas consumers (marker push stream).
 """
 
 import os
@@ -8,4 +9,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application() 
\ No newline at end of file
+# Set up Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from ideas.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': URLRouter(websocket_urlpatterns),
+})
@@ -19,6 +19,7 @@ ALLOWED_HOSTS = config('DJANGO_ALLOWED_HOSTS', default='localhost 127.0.0.1 [::1
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',  # must come before staticfiles so runserver serves ASGI (websockets)
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -28,6 +29,7 @@ INSTALLED_APPS = [
     
     # Third party apps
     'rest_framework',
+    'channels',
     
     # Local apps
     'ideas',
@@ -62,6 +64,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# Channel layer for the marker push stream (ws/markers/).
+# In-memory only fans out within one process, which is what runserver / a single daphne gives us
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': config('CHANNEL_LAYER_BACKEND', default='channels.layers.InMemoryChannelLayer'),
+    }
+}
 
 # Database
 DATABASES = {
@@ -75,6 +86,26 @@ DATABASES = {
     }
 }
 
+# Database connections. Under ASGI, DB_POOL=True uses psycopg's connection pool (Postgres only)
+# instead of a connection per request. Without it, DB_CONN_MAX_AGE keeps each thread's
+# connection open for that many seconds (WSGI / runserver). The two can't be combined
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10.0, cast=float),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=0, cast=int)
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Serve update-marker-positions, get-marker-positions and map-config with the async views
+# (ideas/async_views.py). Only useful under daphne / an ASGI server
+ASYNC_MARKER_VIEWS = config('ASYNC_MARKER_VIEWS', default=False, cast=bool)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -110,6 +141,82 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Marker position deltas (get-marker-positions/?since=<seq>)
+# Clients further behind than this many layout versions get a full snapshot instead
+MARKER_DELTA_MAX_AGE = config('MARKER_DELTA_MAX_AGE', default=10000, cast=int)
+
+# Live marker state (ideas/live.py): keep marker positions in memory and write them
+# to the db every LIVE_MARKER_FLUSH_INTERVAL seconds. Only safe with a single backend process
+LIVE_MARKER_STATE = config('LIVE_MARKER_STATE', default=False, cast=bool)
+LIVE_MARKER_FLUSH_INTERVAL = config('LIVE_MARKER_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# Marker update ordering (ideas/sequencing.py): capture timestamps further ahead of the server
+# clock than this many seconds are clamped, so one fast clock cannot shadow the other detectors
+MARKER_MAX_CLOCK_SKEW = config('MARKER_MAX_CLOCK_SKEW', default=2.0, cast=float)
+
+# Multi-camera fusion (ideas/fusion.py): observations of a marker from different detectors
+# within MARKER_FUSION_WINDOW_MS are combined (0 turns it off), and ones further apart than
+# MARKER_FUSION_CONFLICT_CM are treated as conflicting rather than averaged
+MARKER_FUSION_WINDOW_MS = config('MARKER_FUSION_WINDOW_MS', default=100.0, cast=float)
+MARKER_FUSION_CONFLICT_CM = config('MARKER_FUSION_CONFLICT_CM', default=2.0, cast=float)
+
+# Map config cache (ideas/mapconfig.py): how long a process serves its copy before re-checking
+# the map version, and optionally a CACHES alias to share the serialized config between processes
+MAP_CONFIG_CACHE_TTL = config('MAP_CONFIG_CACHE_TTL', default=2.0, cast=float)
+MAP_CONFIG_CACHE_ALIAS = config('MAP_CONFIG_CACHE_ALIAS', default='')
+
+# Marker position history (ideas/history.py): samples are buffered in memory, written in
+# batches every MARKER_HISTORY_FLUSH_INTERVAL seconds and downsampled every
+# MARKER_HISTORY_COMPACT_INTERVAL seconds (raw -> 1 s buckets -> 1 min buckets)
+MARKER_HISTORY = config('MARKER_HISTORY', default=True, cast=bool)
+MARKER_HISTORY_FLUSH_INTERVAL = config('MARKER_HISTORY_FLUSH_INTERVAL', default=1.0, cast=float)
+MARKER_HISTORY_BUFFER_SIZE = config('MARKER_HISTORY_BUFFER_SIZE', default=100000, cast=int)
+MARKER_HISTORY_COMPACT_INTERVAL = config('MARKER_HISTORY_COMPACT_INTERVAL', default=300.0, cast=float)
+MARKER_HISTORY_RAW_RETENTION = config('MARKER_HISTORY_RAW_RETENTION', default=3600, cast=int)
+MARKER_HISTORY_SECOND_RETENTION = config('MARKER_HISTORY_SECOND_RETENTION', default=86400, cast=int)
+
+# Spatial index (ideas/spatial.py): grid cell size in map cm (the ground-metre grid uses the same
+# cell measured on the ground), and the radius update_nearby_counts uses for nearby_assets_40_miles
+SPATIAL_GRID_CELL_CM = config('SPATIAL_GRID_CELL_CM', default=2.0, cast=float)
+NEARBY_RADIUS_MILES = config('NEARBY_RADIUS_MILES', default=40.0, cast=float)
+
+# Asset catalog (ideas/catalog.py): the SVG icons bundled by api/asset-catalog/icons/ and the
+# URL prefix they are served under by the frontend, how long a process serves its cached copy
+# before re-checking, and how long browsers may use an unversioned catalog before revalidating
+ASSET_ICON_DIR = config('ASSET_ICON_DIR', default=str(BASE_DIR.parent / 'frontend' / 'public' / 'asset-images'))
+ASSET_ICON_URL_PREFIX = config('ASSET_ICON_URL_PREFIX', default='/asset-images/')
+ASSET_CATALOG_CACHE_TTL = config('ASSET_CATALOG_CACHE_TTL', default=2.0, cast=float)
+ASSET_CATALOG_MAX_AGE = config('ASSET_CATALOG_MAX_AGE', default=300, cast=int)
+
+# Admission control for update-marker-positions (ideas/admission.py): per-source token bucket
+# (requests per second and burst, 0 turns it off), how many payloads are written at once, how
+# many can wait (one per source, newer ones from the same source are merged in) and for how long,
+# and how many reads in flight make writes go one at a time (0 turns read priority off)
+MARKER_RATE_LIMIT = config('MARKER_RATE_LIMIT', default=20.0, cast=float)
+MARKER_RATE_BURST = config('MARKER_RATE_BURST', default=40.0, cast=float)
+MARKER_INGEST_CONCURRENCY = config('MARKER_INGEST_CONCURRENCY', default=2, cast=int)
+MARKER_INGEST_QUEUE_SIZE = config('MARKER_INGEST_QUEUE_SIZE', default=8, cast=int)
+MARKER_INGEST_QUEUE_TIMEOUT = config('MARKER_INGEST_QUEUE_TIMEOUT', default=1.0, cast=float)
+MARKER_INGEST_READ_PRIORITY = config('MARKER_INGEST_READ_PRIORITY', default=8, cast=int)
+
+# Streaming get-marker-positions (ideas/streaming.py): rows read from the db cursor and encoded
+# per chunk, and the largest page a client can ask for with ?limit=
+POSITION_STREAM_CHUNK_SIZE = config('POSITION_STREAM_CHUNK_SIZE', default=500, cast=int)
+POSITION_STREAM_MAX_LIMIT = config('POSITION_STREAM_MAX_LIMIT', default=10000, cast=int)
+
+# Request metrics (ideas/metrics.py, ideas/middleware.py), exposed on api/metrics/.
+# Latency and response size are recorded for every request, DB query counts/time only for a
+# REQUEST_METRICS_SAMPLE_RATE fraction of them. Requests slower than REQUEST_METRICS_SLOW_MS
+# keep a stack trace in a ring buffer of REQUEST_METRICS_SLOW_BUFFER_SIZE entries (api/metrics/slow/)
+REQUEST_METRICS = config('REQUEST_METRICS', default=False, cast=bool)
+REQUEST_METRICS_SAMPLE_RATE = config('REQUEST_METRICS_SAMPLE_RATE', default=0.1, cast=float)
+REQUEST_METRICS_SLOW_MS = config('REQUEST_METRICS_SLOW_MS', default=250.0, cast=float)
+REQUEST_METRICS_SLOW_BUFFER_SIZE = config('REQUEST_METRICS_SLOW_BUFFER_SIZE', default=50, cast=int)
+
+if REQUEST_METRICS:
+    # First, so the timings include every other middleware
+    MIDDLEWARE.insert(0, 'ideas.middleware.RequestMetricsMiddleware')
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:4000",
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Asset, Map, AssetInMap, AssetBackground
+from .models import Asset, Map, AssetInMap, AssetBackground, LayoutSnapshot, ScenarioTypeCount
 
 
 @admin.register(Asset)
@@ -30,4 +30,17 @@ class AssetInMapAdmin(admin.ModelAdmin):
 class AssetBackgroundAdmin(admin.ModelAdmin):
     list_display = ("type_name", "icon_path", "cost", "size", "primary_user", "nearby_assets_40_miles", "has_context")
     list_filter = ("has_context",)
-    search_fields = ("type_name", "primary_user", "usage_patterns", "icon_path")
\ No newline at end of file
+    search_fields = ("type_name", "primary_user", "usage_patterns", "icon_path")
+
+
+@admin.register(LayoutSnapshot)
+class LayoutSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('name', 'map', 'asset_count', 'created_at')
+    search_fields = ('name',)
+    exclude = ('data',)
+
+
+@admin.register(ScenarioTypeCount)
+class ScenarioTypeCountAdmin(admin.ModelAdmin):
+    list_display = ('background', 'map', 'count', 'updated_at')
+    readonly_fields = ('map', 'background', 'count')
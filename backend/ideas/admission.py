@@ -0,0 +1,214 @@
+import contextlib
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .ingest import ingest_marker_updates
+from .sequencing import DEFAULT_SOURCE
+
+# Admission control for update-marker-positions, so a runaway detector (UPDATE_INTERVAL = 0,
+# several copies of the same loop) cannot starve the browsers polling for positions.
+#
+#   - every source gets a token bucket of MARKER_RATE_BURST requests refilled at MARKER_RATE_LIMIT
+#     per second; past that it gets a 429 with Retry-After (BackendSync waits that long)
+#   - at most MARKER_INGEST_CONCURRENCY payloads are written at a time, one while more than
+#     MARKER_INGEST_READ_PRIORITY reads are in flight, so reads get the db first when it is busy
+#   - payloads that cannot be written right away wait in a queue of MARKER_INGEST_QUEUE_SIZE,
+#     one entry per source: a newer payload from the same source is merged into the waiting one
+#     (its markers win) and the newer request waits for that write, answering coalesced once it
+#     is done. When the queue is full, or a payload waited MARKER_INGEST_QUEUE_TIMEOUT seconds,
+#     the request gets a 429, and so does every request merged into it
+#
+# Detector payloads are absolute positions, so merging and dropping lose nothing but
+# intermediate frames.
+
+
+class TokenBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # source -> (tokens, last refill)
+
+    def acquire(self, source, rate, burst, now=None):
+        """Take a token for source: 0 if there was one, else the seconds until there will be"""
+        if rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        burst = max(burst, 1.0)
+        with self._lock:
+            tokens, last = self._buckets.get(source, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1.0:
+                self._buckets[source] = (tokens - 1.0, now)
+                return 0.0
+            self._buckets[source] = (tokens, now)
+            if len(self._buckets) > 10000:
+                # Sources come from a header, do not let made up ones grow this forever
+                self._buckets = {source: self._buckets[source]}
+            return (1.0 - tokens) / rate
+
+
+class _Ticket:
+    def __init__(self, updates, batch):
+        self.updates = updates
+        self.batch = batch
+        self.state = 'waiting'  # -> 'running' -> 'done' or 'failed', or 'rejected'
+
+
+def merge_payloads(older_updates, older_batch, newer_updates, newer_batch):
+    """(updates, batch) of a newer payload with the markers only the older one had"""
+    updates = {**older_updates, **newer_updates}
+    batch = dict(newer_batch)
+    confidence = {**older_batch.get("confidence", {}), **newer_batch.get("confidence", {})}
+    if confidence:
+        batch["confidence"] = confidence
+    return updates, batch
+
+
+class IngestGate:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._writing = 0
+        self._reading = 0
+        self._waiting = {}  # source -> _Ticket, oldest first
+        self.stats = {"admitted": 0, "coalesced": 0, "rejected": 0}
+
+    def _write_limit(self):
+        limit = max(settings.MARKER_INGEST_CONCURRENCY, 1)
+        priority = settings.MARKER_INGEST_READ_PRIORITY
+        if priority > 0 and self._reading > priority:
+            return 1
+        return limit
+
+    def _hand_over(self):
+        # Give free write slots to the oldest waiting payloads
+        while self._waiting and self._writing < self._write_limit():
+            source = next(iter(self._waiting))
+            ticket = self._waiting.pop(source)
+            ticket.state = 'running'
+            self._writing += 1
+        self._cond.notify_all()
+
+    def submit(self, source, updates, batch, write):
+        """
+        Run write(updates, batch) once a write slot is free. Returns ("done", result),
+        ("coalesced", None) when it was merged into a payload from the same source already waiting
+        and that one was written, or ("rejected", retry after seconds) when the queue is full or
+        the wait timed out. Raises RuntimeError if the write it was merged into failed.
+        """
+        ticket = _Ticket(updates, batch)
+        with self._cond:
+            if not self._waiting and self._writing < self._write_limit():
+                ticket.state = 'running'
+                self._writing += 1
+            else:
+                waiting = self._waiting.get(source)
+                if waiting is not None:
+                    # The waiting request writes both, keeping its place in the queue. Only answer
+                    # once that write is done, a 429 or failure for it is one for these markers too
+                    waiting.updates, waiting.batch = merge_payloads(waiting.updates, waiting.batch, updates, batch)
+                    self.stats["coalesced"] += 1
+                    while waiting.state in ('waiting', 'running'):
+                        self._cond.wait()
+                    if waiting.state == 'rejected':
+                        return "rejected", settings.MARKER_INGEST_QUEUE_TIMEOUT
+                    if waiting.state == 'failed':
+                        raise RuntimeError("The marker update this one was merged into failed")
+                    return "coalesced", None
+                if len(self._waiting) >= settings.MARKER_INGEST_QUEUE_SIZE:
+                    self.stats["rejected"] += 1
+                    return "rejected", settings.MARKER_INGEST_QUEUE_TIMEOUT
+                self._waiting[source] = ticket
+                self._hand_over()
+
+                deadline = time.monotonic() + settings.MARKER_INGEST_QUEUE_TIMEOUT
+                while ticket.state == 'waiting':
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._waiting[source]
+                        ticket.state = 'rejected'
+                        self.stats["rejected"] += 1
+                        self._cond.notify_all()
+                        return "rejected", settings.MARKER_INGEST_QUEUE_TIMEOUT
+                    self._cond.wait(remaining)
+            self.stats["admitted"] += 1
+
+        outcome = 'failed'
+        try:
+            result = write(ticket.updates, ticket.batch)
+            outcome = 'done'
+            return "done", result
+        finally:
+            with self._cond:
+                ticket.state = outcome
+                self._writing -= 1
+                self._hand_over()
+
+    def read_started(self):
+        with self._cond:
+            self._reading += 1
+
+    def read_finished(self):
+        with self._cond:
+            self._reading -= 1
+            self._hand_over()
+
+
+rate_limits = TokenBuckets()
+ingest_gate = IngestGate()
+
+
+def check_rate(source):
+    """Seconds the source has to wait before its next update, 0 if it can send now"""
+    return rate_limits.acquire(source, settings.MARKER_RATE_LIMIT, settings.MARKER_RATE_BURST)
+
+
+def admission_key(batch, remote_addr):
+    """Whose bucket and queue entry a payload uses: its source, or the client address for detectors that send none"""
+    source = batch["source"]
+    return f"{source}@{remote_addr}" if source == DEFAULT_SOURCE else source
+
+
+def admit_marker_updates(updates, batch, remote_addr=None):
+    """
+    ingest_marker_updates behind the rate limit and the ingest gate.
+    Returns (result, None), or (None, seconds to wait) when the payload is turned away.
+    A payload merged into a waiting one counts all its markers as coalesced.
+    """
+    key = admission_key(batch, remote_addr)
+    retry_after = check_rate(key)
+    if retry_after:
+        return None, retry_after
+
+    outcome, value = ingest_gate.submit(key, updates, batch, ingest_marker_updates)
+    if outcome == "rejected":
+        return None, value
+    if outcome == "coalesced":
+        return {"matched": 0, "updated": 0, "moved": {}, "coalesced": len(updates)}, None
+    return value, None
+
+
+def retry_after_header(seconds):
+    # Retry-After only takes whole seconds
+    return str(max(1, math.ceil(seconds)))
+
+
+@contextlib.contextmanager
+def counted_read():
+    """Around a read the ingest gate should make room for"""
+    ingest_gate.read_started()
+    try:
+        yield
+    finally:
+        ingest_gate.read_finished()
+
+
+def counts_as_read(view):
+    """View decorator for the browser reads (get-marker-positions) that writes make room for"""
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        with counted_read():
+            return view(request, *args, **kwargs)
+    return wrapped
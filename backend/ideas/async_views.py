@@ -0,0 +1,142 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .geo import aadd_geo
+from .admission import admit_marker_updates, counted_read, retry_after_header
+from .ingest import ingest_summary, parse_marker_request
+from .live import get_live_state
+from .mapconfig import cached_map_config, get_map_config
+from .positions import amarker_positions, amarker_positions_since, json_response
+from .streaming import aiterate, parse_stream_params, stream_positions, wants_stream
+from .versioning import acurrent_layout_version, delta_available, layout_etag
+
+# Async versions of the hot endpoints, for running under ASGI (daphne).
+# Same URLs, request and response formats as the views in views.py; ASYNC_MARKER_VIEWS
+# switches urls.py over to these, and they are also always reachable under api/async/.
+#
+# Reads use the async ORM and stay on the event loop when the data is in memory (live state,
+# cached map config), so a waiting browser poll does not hold a worker thread. The marker write
+# needs a transaction, which Django only offers to sync code, so ingestion runs in a thread
+# after the body has been parsed on the loop.
+
+
+def _conditional(request, etag, last_modified):
+    """304/412 response if the client's copy is current, else None (what condition() does for sync views)"""
+    return get_conditional_response(
+        request,
+        etag=quote_etag(etag),
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def _with_validators(response, etag, last_modified):
+    response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _admit_in_worker(updates, batch, remote_addr):
+    # Runs on an executor thread, whose connection the end of the request does not look after
+    try:
+        return admit_marker_updates(updates, batch, remote_addr)
+    finally:
+        close_old_connections()
+
+
+@csrf_exempt
+@require_POST
+async def updateMarkerPositionsAsync(request):
+    """Async updateMarkerPositions, same payloads (JSON list or binary frame) and response"""
+    try:
+        updates, markers_processed, batch = parse_marker_request(
+            request.META.get('CONTENT_TYPE', ''), request.body, request.headers.get('X-Marker-Source'),
+        )
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+
+    try:
+        # Not thread_sensitive: a payload waiting for a write slot must not block the one sync thread
+        result, retry_after = await sync_to_async(_admit_in_worker, thread_sensitive=False)(
+            updates, batch, request.META.get('REMOTE_ADDR'),
+        )
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+    if result is None:
+        response = json_response(
+            {"error": "Too many marker updates, retry later", "retry_after": round(retry_after, 3)}, status=429,
+        )
+        response['Retry-After'] = retry_after_header(retry_after)
+        return response
+    return json_response(ingest_summary(result, markers_processed))
+
+
+@require_GET
+async def getMarkerPositionsAsync(request):
+    """Async getMarkerPositions: ETag revalidation, ?since= deltas, ?stream=1 and lat/lng, same as the sync view"""
+    # Counted so marker writes make room for it when the db is busy (admission.py)
+    with counted_read():
+        return await _marker_positions(request)
+
+
+async def _marker_positions(request):
+    live = get_live_state()
+    if live is not None and not live.loaded:
+        await sync_to_async(live.reload)()
+
+    version = live.version() if live is not None else await acurrent_layout_version()
+    # layout_etag reads the version cached on the request
+    request._layout_version = version
+    seq, updated_at = version
+    etag = layout_etag(request)
+    response = _conditional(request, etag, updated_at)
+    if response is not None:
+        return _with_validators(response, etag, updated_at)
+
+    if wants_stream(request.GET):
+        try:
+            bbox, limit, after = parse_stream_params(request.GET)
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=400)
+        # Each chunk is read in the sync thread, the loop only forwards the encoded pieces
+        pieces = aiterate(stream_positions(seq, bbox=bbox, limit=limit, after=after, live=live))
+        return _with_validators(StreamingHttpResponse(pieces, content_type='application/json'), etag, updated_at)
+
+    since = request.GET.get('since')
+    if since is None:
+        positions = live.snapshot() if live is not None else await amarker_positions()
+        return _with_validators(json_response(await aadd_geo(positions)), etag, updated_at)
+
+    try:
+        since = int(since)
+    except ValueError:
+        return json_response({"error": "since must be an integer"}, status=400)
+
+    if delta_available(since, seq):
+        changed, removed = live.since(since) if live is not None else await amarker_positions_since(since)
+        full = False
+    else:
+        changed, removed = (live.snapshot() if live is not None else await amarker_positions()), []
+        full = True
+
+    body = {"seq": seq, "full": full, "changed": await aadd_geo(changed), "removed": removed}
+    return _with_validators(json_response(body), etag, updated_at)
+
+
+@require_GET
+async def getMapConfigAsync(request):
+    """Async getMapConfig, served from the cached payload without leaving the event loop when it is fresh"""
+    entry = cached_map_config() or await sync_to_async(get_map_config)()
+    if entry is None:
+        return json_response({"error": "No map configuration found"}, status=404)
+
+    response = _conditional(request, entry["etag"], entry["last_modified"])
+    if response is None:
+        response = HttpResponse(entry["body"], content_type='application/json')
+    return _with_validators(response, entry["etag"], entry["last_modified"])
@@ -0,0 +1,45 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .geo import add_geo
+from .models import RemovedMarker
+from .positions import encode_json, marker_positions, placed_assets
+
+# Push side of the marker stream: every layout version bump sends one message to the
+# "markers" group once the write commits. The message is built and encoded once here,
+# so each connected viewer costs a channel send, not a DB query.
+
+logger = logging.getLogger(__name__)
+
+MARKER_GROUP = 'markers'
+
+
+def publish_layout_change(seq):
+    """Broadcast what changed at layout version seq after the current transaction commits"""
+    transaction.on_commit(lambda: send_layout_change(seq))
+
+
+def send_layout_change(seq):
+    """Load what changed at layout version seq from the db and broadcast it"""
+    send_delta(
+        seq,
+        marker_positions(placed_assets().filter(changed_seq=seq)),
+        list(RemovedMarker.objects.filter(seq=seq).values_list('marker_id', flat=True)),
+    )
+
+
+def send_delta(seq, changed, removed):
+    """Broadcast an already built delta (same shape as a get-marker-positions ?since=seq-1 response)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    text = encode_json({"seq": seq, "full": False, "changed": add_geo(changed), "removed": removed})
+    try:
+        async_to_sync(channel_layer.group_send)(MARKER_GROUP, {"type": "marker.update", "text": text})
+    except Exception:
+        # Viewers fall back to polling, a broken channel layer must not fail the write
+        logger.exception("Failed to broadcast layout version %s", seq)
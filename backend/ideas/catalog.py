@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from .models import AssetBackground
+from .positions import encode_json
+
+# Asset catalog: every AssetBackground (what the frontend needs to draw tokens and fill the
+# understand panel) in one response, plus an optional bundle of every icon SVG inlined, so a
+# cold page load makes two requests instead of one per icon.
+#
+# Both are built once and cached like the map config: within ASSET_CATALOG_CACHE_TTL the
+# local copy is served as is, after that one aggregate query (or a stat of the icon folder)
+# checks whether anything changed. ETags are content hashes, and a URL carrying the current
+# hash as ?v= is cacheable for a year since its content can never change.
+
+CATALOG_FIELDS = (
+    'id', 'type_name', 'icon_path', 'cost', 'size', 'carbon_emission', 'has_context', 'primary_user',
+    'usage_patterns', 'lighting_noise', 'drainage_maintenance', 'nearby_assets_40_miles',
+)
+DECIMAL_FIELDS = ('cost', 'carbon_emission')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_ICON = 'playground.svg'
+
+_lock = threading.Lock()
+_catalog = None       # {"key", "hash", "body"}
+_catalog_checked_at = 0.0
+_icons = None         # {"key", "hash", "body", "gzip", "names"}
+_icons_checked_at = 0.0
+
+
+def content_hash(body):
+    return hashlib.sha256(body.encode()).hexdigest()[:16]
+
+
+def _normalize(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+# Type names whose icon file is not simply the name (same table as migration 0015, keys normalized)
+ICON_ALIASES = {
+    'dogpark': 'dog_park.svg',
+    'baseballfield': 'baseball.svg',
+    'soccer': 'soccer_field.svg',
+    'tenniscourt': 'tennis.svg',
+    'tenniscourts': 'tennis.svg',
+    'picnic': 'picnic_shelter.svg',
+    'amphitheater': 'ampitheater.svg',
+}
+
+
+def resolve_icon_path(type_name, icon_names):
+    """
+    Icon for a background without an icon_path: the alias from ICON_ALIASES, else the icon file
+    whose name is the type name ("Dog Park" -> dog_park.svg), else the default.
+    Same result as the lookup table in migration 0015 for the types it knew about.
+    """
+    prefix = settings.ASSET_ICON_URL_PREFIX
+    wanted = _normalize(type_name or '')
+    alias = ICON_ALIASES.get(wanted)
+    if alias in icon_names:
+        return prefix + alias
+    if wanted:
+        for name in icon_names:
+            if _normalize(os.path.splitext(name)[0]) == wanted:
+                return prefix + name
+    return prefix + DEFAULT_ICON
+
+
+# Icon bundle
+
+def _icon_files():
+    """Sorted (name, mtime, size) of the SVGs in ASSET_ICON_DIR, empty if the folder is not there"""
+    try:
+        entries = list(os.scandir(settings.ASSET_ICON_DIR))
+    except OSError:
+        return ()
+    return tuple(sorted(
+        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in entries if entry.name.endswith('.svg') and entry.is_file()
+    ))
+
+
+def get_icon_bundle():
+    """
+    {"hash", "body" (JSON {"hash", "icons": {icon path: svg markup}}), "gzip" (the body compressed
+    once up front, SVG shrinks a lot), "names"}, or None without icons
+    """
+    global _icons, _icons_checked_at
+    now = time.monotonic()
+    entry = _icons
+    if entry is not None and now - _icons_checked_at < settings.ASSET_CATALOG_CACHE_TTL:
+        return entry
+
+    files = _icon_files()
+    if not files:
+        entry = None
+    elif entry is None or entry["key"] != files:
+        icons = {}
+        for name, _, _ in files:
+            with open(os.path.join(settings.ASSET_ICON_DIR, name), encoding='utf-8') as f:
+                icons[settings.ASSET_ICON_URL_PREFIX + name] = f.read()
+        bundle_hash = content_hash(encode_json(icons))
+        body = encode_json({"hash": bundle_hash, "icons": icons})
+        entry = {
+            "key": files,
+            "hash": bundle_hash,
+            "body": body,
+            "gzip": gzip.compress(body.encode(), compresslevel=9, mtime=0),
+            "names": [name for name, _, _ in files],
+        }
+
+    with _lock:
+        _icons = entry
+        _icons_checked_at = now
+    return entry
+
+
+# Catalog
+
+def _catalog_key():
+    row = AssetBackground.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+    return row["count"], row["updated"]
+
+
+def _build_catalog(key, icons):
+    icon_names = icons["names"] if icons else []
+    backgrounds = []
+    for row in AssetBackground.objects.order_by('type_name').values(*CATALOG_FIELDS):
+        for field in DECIMAL_FIELDS:
+            if row[field] is not None:
+                row[field] = float(row[field])
+        if not row['icon_path']:
+            row['icon_path'] = resolve_icon_path(row['type_name'], icon_names)
+        backgrounds.append(row)
+
+    data = {
+        "backgrounds": backgrounds,
+        "icon_bundle": {
+            "hash": icons["hash"],
+            "url": f"/api/asset-catalog/icons/?v={icons['hash']}",
+        } if icons else None,
+    }
+    catalog_hash = content_hash(encode_json(data))
+    return {"key": key, "hash": catalog_hash, "body": encode_json({"hash": catalog_hash, **data})}
+
+
+def get_asset_catalog():
+    """{"hash", "body" (encoded JSON)} of every AssetBackground, rebuilt when a background or icon changes"""
+    global _catalog, _catalog_checked_at
+    now = time.monotonic()
+    entry = _catalog
+    if entry is not None and now - _catalog_checked_at < settings.ASSET_CATALOG_CACHE_TTL:
+        return entry
+
+    icons = get_icon_bundle()
+    key = (*_catalog_key(), icons["hash"] if icons else None)
+    if entry is None or entry["key"] != key:
+        entry = _build_catalog(key, icons)
+
+    with _lock:
+        _catalog = entry
+        _catalog_checked_at = now
+    return entry
+
+
+def invalidate_asset_catalog():
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+def cached_response(request, entry, content_type='application/json'):
+    """
+    The entry's body, or a 304 if the client's ETag matches. Requested with ?v=<current hash>
+    it is cacheable for good, otherwise for ASSET_CATALOG_MAX_AGE seconds and then revalidated.
+    """
+    etag = quote_etag(entry["hash"])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if entry.get("gzip") and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(entry["gzip"], content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(entry["body"], content_type=content_type)
+    if entry.get("gzip"):
+        patch_vary_headers(response, ('Accept-Encoding',))
+    response['ETag'] = etag
+    if request.GET.get('v') == entry["hash"]:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.ASSET_CATALOG_MAX_AGE, must_revalidate=True)
+    return response
@@ -0,0 +1,21 @@
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .broadcast import MARKER_GROUP
+
+
+class MarkerConsumer(AsyncWebsocketConsumer):
+    """
+    ws/markers/ - pushes a delta (same format as get-marker-positions/?since=) every time
+    the layout version changes. Clients load the initial state over HTTP and then apply these.
+    """
+
+    async def connect(self):
+        await self.channel_layer.group_add(MARKER_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(MARKER_GROUP, self.channel_name)
+
+    async def marker_update(self, event):
+        # Already encoded once by the publisher
+        await self.send(text_data=event["text"])
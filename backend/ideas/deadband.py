@@ -0,0 +1,150 @@
+import logging
+import math
+import threading
+import time
+
+from django.db import connections
+
+from .mapconfig import get_map_config
+
+# Filtering of detector updates before they are written.
+#
+# Camera jitter makes a token that is lying still come back with slightly different
+# coordinates every frame. Each marker's update is compared with the last value that was let
+# through for it, and dropped when it moved less than the map's marker_deadband_cm and turned
+# less than marker_deadband_degrees. Comparing with the last accepted value (not the last
+# received one) means a slow drift still gets through once it adds up to the threshold.
+#
+# Updates for a marker that arrive within marker_coalesce_ms of its last write are held back
+# instead, and a newer one replaces the held value. Whatever is held when the window closes is
+# written, either with the next request or by a timer if the detector goes quiet, so a burst
+# turns into at most one write per window and the final position is never lost.
+#
+# A value only counts as accepted once record() is called after its write succeeded, so a failed
+# write does not make the next update for that marker look like jitter. forget() drops what was
+# accepted for markers whose position was changed some other way (restore, updateCoordinates).
+# Held updates carry the sequencer mark of the batch they came from, and the timer hands both to
+# flush_held, which skips markers a newer batch has been admitted for since (and may be writing).
+
+logger = logging.getLogger(__name__)
+
+
+def rotation_delta(a, b):
+    """Smallest angle between two rotations in degrees"""
+    return abs((a - b + 180.0) % 360.0 - 180.0)
+
+
+class MarkerUpdateFilter:
+    def __init__(self, flush_held):
+        self._lock = threading.Lock()
+        self._accepted = {}  # marker_id -> (x, y, rotation, monotonic time it was let through)
+        self._held = {}      # marker_id -> ((x, y, rotation), sequencer mark) waiting for the coalescing window to close
+        self._timer = None
+        # Called from the timer thread with {marker_id: (x, y, rotation)} and {marker_id: mark} when held
+        # updates fall due, returns the updates it wrote
+        self._flush_held = flush_held
+
+    def _within_deadband(self, previous, x_pos, y_pos, rotation, deadband_cm, deadband_degrees):
+        prev_x, prev_y, prev_rotation, _ = previous
+        moved = math.hypot(x_pos - prev_x, y_pos - prev_y)
+        if not math.isfinite(moved) or (moved and moved >= deadband_cm):
+            return False
+        if rotation is None or prev_rotation is None or rotation == prev_rotation:
+            return True
+        return rotation_delta(rotation, prev_rotation) < deadband_degrees
+
+    def filter(self, updates, thresholds, now=None, marks=None):
+        """
+        Split parsed updates ({marker_id: (x, y, rotation)}) into the ones to write now.
+        Returns (updates to write, {"dropped": n, "coalesced": n}). Held updates whose window has
+        closed are added to the result, unless this request has a newer value for that marker.
+        marks ({marker_id: sequencer mark}) are kept with held updates for the timer's flush.
+        Call record() with the updates once they are written.
+        """
+        deadband_cm, deadband_degrees, coalesce_ms = thresholds
+        window = coalesce_ms / 1000.0
+        if now is None:
+            now = time.monotonic()
+
+        accepted = {}
+        dropped = coalesced = 0
+        with self._lock:
+            for marker_id, (x_pos, y_pos, rotation) in updates.items():
+                previous = self._accepted.get(marker_id)
+                if previous is not None and self._within_deadband(
+                    previous, x_pos, y_pos, rotation, deadband_cm, deadband_degrees
+                ):
+                    # Back where it was written last, a held move is stale now
+                    self._held.pop(marker_id, None)
+                    dropped += 1
+                elif previous is not None and now - previous[3] < window:
+                    self._held[marker_id] = ((x_pos, y_pos, rotation), marks.get(marker_id) if marks else None)
+                    coalesced += 1
+                else:
+                    self._held.pop(marker_id, None)
+                    accepted[marker_id] = (x_pos, y_pos, rotation)
+
+            accepted.update((marker_id, update) for marker_id, (update, _) in self._take_due(now, window).items())
+            if self._held and self._timer is None:
+                self._schedule(window)
+
+        return accepted, {"dropped": dropped, "coalesced": coalesced}
+
+    def record(self, written, now=None):
+        """Remember updates that were written, as what later updates for those markers are compared with"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            for marker_id, (x_pos, y_pos, rotation) in written.items():
+                if rotation is None and marker_id in self._accepted:
+                    # The detector did not send one, the stored rotation stays
+                    rotation = self._accepted[marker_id][2]
+                self._accepted[marker_id] = (x_pos, y_pos, rotation, now)
+
+    def forget(self, marker_ids):
+        """Drop what was accepted (and held) for these markers, their next update is written as is"""
+        with self._lock:
+            for marker_id in marker_ids:
+                self._accepted.pop(marker_id, None)
+                self._held.pop(marker_id, None)
+
+    def _take_due(self, now, window):
+        """{marker_id: (update, mark)} of the held updates whose window has closed, no longer held"""
+        due = {
+            marker_id: update for marker_id, update in self._held.items()
+            if marker_id not in self._accepted or now - self._accepted[marker_id][3] >= window
+        }
+        for marker_id in due:
+            del self._held[marker_id]
+        return due
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._on_timer, args=(delay,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self, window):
+        now = time.monotonic()
+        with self._lock:
+            self._timer = None
+            due = self._take_due(now, window)
+            if self._held:
+                self._schedule(window)
+        if not due:
+            return
+        try:
+            written = self._flush_held(
+                {marker_id: update for marker_id, (update, _) in due.items()},
+                {marker_id: mark for marker_id, (_, mark) in due.items()},
+            )
+            self.record(written, now)
+        except Exception:
+            logger.exception("Writing coalesced marker updates failed")
+        finally:
+            connections.close_all()
+
+
+def marker_filter_thresholds():
+    """(deadband cm, deadband degrees, coalesce ms) of the current map, None when there is no map"""
+    entry = get_map_config()
+    return entry.get("marker_filter") if entry else None
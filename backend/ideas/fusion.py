@@ -0,0 +1,97 @@
+import math
+import threading
+
+# Multi-camera fusion of marker observations.
+#
+# Large tables are watched by more than one detector, so the same marker can be reported by
+# several sources a few milliseconds apart. Rather than letting whichever POST lands last win,
+# every source's latest observation of a marker is kept (in memory, nothing is read from the
+# db) and each new observation is combined with the other sources' observations from the last
+# MARKER_FUSION_WINDOW_MS into one position:
+#   - each observation is weighted by the confidence its detector reported (it drops towards
+#     the edge of the image and with the reprojection error), 1 when none was sent
+#   - observations that disagree by more than MARKER_FUSION_CONFLICT_CM cannot both be right
+#     (a misdetection, or one camera still seeing where the token was), so the group with the
+#     most total weight wins and the rest are left out. On a tie the group with the newest
+#     observation wins: the camera that saw the move first is not outvoted by an older view
+#   - positions are a weighted mean, rotations a weighted circular mean
+# With a single source every observation passes straight through.
+
+
+def weighted_pose(observations):
+    """Weighted mean of (timestamp, x, y, rotation, weight) observations, rotation None if none measured it"""
+    total = sum(obs[4] for obs in observations)
+    x_pos = sum(obs[1] * obs[4] for obs in observations) / total
+    y_pos = sum(obs[2] * obs[4] for obs in observations) / total
+
+    sin_sum = cos_sum = 0.0
+    for _, _, _, rotation, weight in observations:
+        if rotation is not None:
+            sin_sum += math.sin(math.radians(rotation)) * weight
+            cos_sum += math.cos(math.radians(rotation)) * weight
+    rotation = math.degrees(math.atan2(sin_sum, cos_sum)) if sin_sum or cos_sum else None
+    return x_pos, y_pos, rotation
+
+
+def consistent_group(observations, conflict_cm):
+    """The observations that agree with each other and carry the most weight between them, the newest on a tie"""
+    best = None
+    best_rank = None
+    for anchor in observations:
+        group = [obs for obs in observations if math.hypot(obs[1] - anchor[1], obs[2] - anchor[2]) <= conflict_cm]
+        rank = (sum(obs[4] for obs in group), max(obs[0] for obs in group))
+        if best_rank is None or rank > best_rank:
+            best, best_rank = group, rank
+    return best
+
+
+class MarkerFusion:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._observations = {}  # marker_id -> {source: (timestamp, x, y, rotation, weight)}
+
+    def fuse(self, updates, batch, window_ms, conflict_cm):
+        """
+        Combine a stamped batch ({marker_id: (x, y, rotation)}) with the other sources' recent
+        observations. Returns (fused updates, {marker_id: timestamp of the newest observation
+        used}, {"fused": markers seen by more than one source, "conflicts": markers where some
+        observations were left out, "stale": observations older than this source's last one}).
+        """
+        source, timestamp = batch["source"], batch["timestamp"]
+        confidence = batch["confidence"]
+        window = window_ms / 1000.0
+
+        fused = {}
+        timestamps = {}
+        stats = {"fused": 0, "conflicts": 0, "stale": 0}
+        with self._lock:
+            for marker_id, (x_pos, y_pos, rotation) in updates.items():
+                seen = self._observations.setdefault(marker_id, {})
+                previous = seen.get(source)
+                if previous is not None and previous[0] > timestamp:
+                    # This source already reported a later frame
+                    stats["stale"] += 1
+                    continue
+                # Confidence is 0-1, a zero weight would make a lone observation undefined
+                weight = min(max(confidence.get(marker_id, 1.0), 1e-6), 1.0)
+                seen[source] = (timestamp, x_pos, y_pos, rotation, weight)
+
+                newest = max(obs[0] for obs in seen.values())
+                for other in [other for other, obs in seen.items() if obs[0] < newest - window]:
+                    # Too old to fuse with anything from now on
+                    del seen[other]
+                if len(seen) == 1:
+                    # Only one camera sees it (possibly another one, if this observation came in too late)
+                    (only,) = seen.values()
+                    fused[marker_id] = only[1:4]
+                    timestamps[marker_id] = only[0]
+                    continue
+
+                observations = list(seen.values())
+                group = consistent_group(observations, conflict_cm)
+                stats["fused"] += 1
+                if len(group) < len(observations):
+                    stats["conflicts"] += 1
+                fused[marker_id] = weighted_pose(group)
+                timestamps[marker_id] = max(obs[0] for obs in group)
+        return fused, timestamps, stats
@@ -0,0 +1,144 @@
+import math
+import threading
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from .mapconfig import cached_map_config, get_map_config
+from .models import Map
+
+# Map centimetres -> geographic coordinates.
+# The four Map corner lat/lng fields define a projective transform (homography) from the map
+# rectangle onto the ground. It is fitted once per map version and then applied to all
+# positions of a response in one NumPy pass, so every client gets the same lat/lng without
+# loading map-config and converting marker by marker.
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_MILE = 1609.344
+
+
+class MapTransform:
+    """Homography from map cm (0,0 = top-left, y down) to (lat, lng), fitted to the four corners"""
+
+    def __init__(self, key, width, height, corners):
+        self.key = key
+        self.width = width
+        self.height = height
+        # corners: (lat, lng) of top-left, top-right, bottom-right, bottom-left
+        src = ((0.0, 0.0), (width, 0.0), (width, height), (0.0, height))
+        rows = []
+        rhs = []
+        for (x, y), (lat, lng) in zip(src, corners):
+            rows.append((x, y, 1, 0, 0, 0, -x * lat, -y * lat))
+            rows.append((0, 0, 0, x, y, 1, -x * lng, -y * lng))
+            rhs.extend((lat, lng))
+        h = np.linalg.solve(np.array(rows, dtype=np.float64), np.array(rhs, dtype=np.float64))
+        self.matrix = np.append(h, 1.0).reshape(3, 3)
+
+    @classmethod
+    def for_map(cls, key, map_obj):
+        """The transform for a Map, or None if its corners are unset or do not span an area"""
+        corners = (
+            (map_obj.top_left_lat, map_obj.top_left_lng),
+            (map_obj.top_right_lat, map_obj.top_right_lng),
+            (map_obj.bottom_right_lat, map_obj.bottom_right_lng),
+            (map_obj.bottom_left_lat, map_obj.bottom_left_lng),
+        )
+        if not map_obj.width or not map_obj.height or not any(any(corner) for corner in corners):
+            return None
+        try:
+            return cls(key, map_obj.width, map_obj.height, corners)
+        except np.linalg.LinAlgError:
+            return None
+
+    def to_geo(self, xs, ys):
+        """Arrays of map x/y in cm -> (lats, lngs). Positions off the map are clamped to its edge, like the frontend"""
+        xs = np.clip(np.asarray(xs, dtype=np.float64), 0.0, self.width)
+        ys = np.clip(np.asarray(ys, dtype=np.float64), 0.0, self.height)
+        m = self.matrix
+        w = m[2, 0] * xs + m[2, 1] * ys + m[2, 2]
+        lats = (m[0, 0] * xs + m[0, 1] * ys + m[0, 2]) / w
+        lngs = (m[1, 0] * xs + m[1, 1] * ys + m[1, 2]) / w
+        return lats, lngs
+
+    def point(self, x, y):
+        lats, lngs = self.to_geo((x,), (y,))
+        return float(lats[0]), float(lngs[0])
+
+    def add_geo(self, positions):
+        """Set "lat"/"lng" on a list of position dicts in place, returns the list"""
+        if positions:
+            count = len(positions)
+            xs = np.fromiter((position['x'] for position in positions), dtype=np.float64, count=count)
+            ys = np.fromiter((position['y'] for position in positions), dtype=np.float64, count=count)
+            lats, lngs = self.to_geo(xs, ys)
+            for position, lat, lng in zip(positions, lats.tolist(), lngs.tolist()):
+                position['lat'] = lat
+                position['lng'] = lng
+        return positions
+
+
+_lock = threading.Lock()
+_transform_key = None
+_transform = None
+
+
+def get_map_transform():
+    """
+    The MapTransform of the current map (cached per map version, same key as the map-config cache),
+    or None when there is no map or its corners are not set.
+    """
+    global _transform_key, _transform
+    map_config = get_map_config()
+    key = map_config["key"] if map_config else None
+    if key == _transform_key:
+        return _transform
+
+    map_obj = Map.objects.order_by('pk').first() if key else None
+    transform = MapTransform.for_map(key, map_obj) if map_obj is not None else None
+    with _lock:
+        _transform_key = key
+        _transform = transform
+    return transform
+
+
+async def aget_map_transform():
+    """get_map_transform() for async views, only leaves the event loop when the map version needs checking"""
+    entry = cached_map_config()
+    if entry is not None and entry["key"] == _transform_key:
+        return _transform
+    return await sync_to_async(get_map_transform)()
+
+
+def _apply_transform(transform, positions):
+    if transform is not None:
+        return transform.add_geo(positions)
+    for position in positions:
+        position['lat'] = position['lng'] = None
+    return positions
+
+
+def add_geo(positions):
+    """Add "lat"/"lng" to position dicts (null when the map has no geographic bounds), returns the list"""
+    return _apply_transform(get_map_transform(), positions)
+
+
+async def aadd_geo(positions):
+    return _apply_transform(await aget_map_transform(), positions)
+
+
+class LocalProjection:
+    """
+    Equirectangular projection around a reference point, (lat, lng) -> metres east/south of it.
+    Plenty accurate at city scale and lets distances be plain euclidean maths.
+    """
+
+    def __init__(self, origin_lat, origin_lng):
+        self.origin_lat = origin_lat
+        self.origin_lng = origin_lng
+        self._x_scale = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(origin_lat))
+        self._y_scale = math.radians(1) * EARTH_RADIUS_M
+
+    def to_meters(self, lat, lng):
+        # y grows southwards, same direction as map y
+        return (lng - self.origin_lng) * self._x_scale, (self.origin_lat - lat) * self._y_scale
@@ -0,0 +1,184 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Map, MarkerPositionSample
+
+# Marker position history.
+# The ingest path only appends (timestamp, marker_id, x, y, rotation) tuples to an in-memory
+# buffer; a background thread writes them with bulk_create every MARKER_HISTORY_FLUSH_INTERVAL
+# seconds, so recording history adds no db work to updateMarkerPositions.
+# The same thread periodically downsamples old rows so storage stays bounded:
+#   raw samples          kept for MARKER_HISTORY_RAW_RETENTION seconds (1 hour)
+#   1 second buckets     kept for MARKER_HISTORY_SECOND_RETENTION seconds (1 day)
+#   1 minute buckets     kept after that
+# Each bucket keeps the last sample of that marker inside it.
+
+logger = logging.getLogger(__name__)
+
+RAW = 0
+SECOND = 1
+MINUTE = 60
+
+# Rows are downsampled one window at a time so memory use does not depend on history size
+COMPACT_WINDOW = timedelta(hours=1)
+
+
+class HistoryWriter:
+    def __init__(self, max_buffer):
+        self._lock = threading.Lock()
+        # Oldest samples are dropped if the db cannot keep up, ingestion never blocks on history
+        self._buffer = collections.deque(maxlen=max_buffer)
+        self._map_id = None
+        self._map_checked_at = 0.0
+
+    def record(self, moved, timestamp=None):
+        """Queue {marker_id: (x, y, rotation)} for the next batch"""
+        if timestamp is None:
+            timestamp = timezone.now()
+        self._buffer.extend(
+            (timestamp, marker_id, x_pos, y_pos, rotation)
+            for marker_id, (x_pos, y_pos, rotation) in moved.items()
+        )
+
+    def _current_map_id(self):
+        # Single map for now, same as getMapConfig. Looked up here rather than at ingest time
+        now = time.monotonic()
+        if self._map_id is None or now - self._map_checked_at > 60:
+            self._map_id = Map.objects.order_by('pk').values_list('pk', flat=True).first()
+            self._map_checked_at = now
+        return self._map_id
+
+    def flush(self):
+        """Write everything buffered so far, returns the number of samples written"""
+        with self._lock:
+            samples = []
+            while self._buffer:
+                samples.append(self._buffer.popleft())
+            if not samples:
+                return 0
+
+            map_id = self._current_map_id()
+            MarkerPositionSample.objects.bulk_create([
+                MarkerPositionSample(
+                    map_id=map_id,
+                    timestamp=timestamp,
+                    marker_id=marker_id,
+                    x_pos=x_pos,
+                    y_pos=y_pos,
+                    rotation=rotation if rotation is not None else 0.0,
+                    resolution=RAW,
+                )
+                for timestamp, marker_id, x_pos, y_pos, rotation in samples
+            ], batch_size=1000)
+            return len(samples)
+
+
+def _floor_to(moment, seconds):
+    """Round a datetime down to a multiple of `seconds` since the epoch"""
+    epoch = moment.timestamp()
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def downsample(from_resolution, to_resolution, older_than, now=None):
+    """
+    Replace samples at from_resolution older than `older_than` with one sample per
+    (map, marker, to_resolution bucket). Returns (rows removed, rows written).
+    """
+    if now is None:
+        now = timezone.now()
+    # Only whole buckets, a bucket that straddles the cutoff waits for the next run
+    cutoff = _floor_to(now - older_than, to_resolution)
+    samples = MarkerPositionSample.objects.filter(resolution=from_resolution, timestamp__lt=cutoff)
+
+    oldest = samples.aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is None:
+        return 0, 0
+
+    removed = written = 0
+    window_start = _floor_to(oldest, to_resolution)
+    while window_start < cutoff:
+        window_end = min(window_start + COMPACT_WINDOW, cutoff)
+        window = samples.filter(timestamp__gte=window_start, timestamp__lt=window_end)
+
+        buckets = {}
+        for map_id, marker_id, timestamp, x_pos, y_pos, rotation in (
+            window.order_by('timestamp', 'id')
+            .values_list('map_id', 'marker_id', 'timestamp', 'x_pos', 'y_pos', 'rotation')
+            .iterator(chunk_size=5000)
+        ):
+            bucket = _floor_to(timestamp, to_resolution)
+            # Later samples overwrite earlier ones, so each bucket keeps its last position
+            buckets[(map_id, marker_id, bucket)] = (x_pos, y_pos, rotation)
+
+        if buckets:
+            with transaction.atomic():
+                removed += window.delete()[0]
+                MarkerPositionSample.objects.bulk_create([
+                    MarkerPositionSample(
+                        map_id=map_id, marker_id=marker_id, timestamp=bucket,
+                        x_pos=x_pos, y_pos=y_pos, rotation=rotation, resolution=to_resolution,
+                    )
+                    for (map_id, marker_id, bucket), (x_pos, y_pos, rotation) in buckets.items()
+                ], batch_size=1000)
+                written += len(buckets)
+        window_start = window_end
+
+    return removed, written
+
+
+def compact_history(now=None):
+    """Run both downsampling tiers, returns {tier: (rows removed, rows written)}"""
+    return {
+        "raw_to_second": downsample(
+            RAW, SECOND, timedelta(seconds=settings.MARKER_HISTORY_RAW_RETENTION), now=now,
+        ),
+        "second_to_minute": downsample(
+            SECOND, MINUTE, timedelta(seconds=settings.MARKER_HISTORY_SECOND_RETENTION), now=now,
+        ),
+    }
+
+
+_history_writer = None
+_history_writer_lock = threading.Lock()
+
+
+def _run_periodically(writer, flush_interval, compact_interval):
+    last_compact = time.monotonic()
+    while True:
+        time.sleep(flush_interval)
+        try:
+            close_old_connections()
+            writer.flush()
+            if time.monotonic() - last_compact >= compact_interval:
+                compact_history()
+                last_compact = time.monotonic()
+        except Exception:
+            logger.exception("Marker history flush failed")
+
+
+def get_history_writer():
+    """The process-wide HistoryWriter, or None when MARKER_HISTORY is off"""
+    global _history_writer
+    if not settings.MARKER_HISTORY:
+        return None
+    if _history_writer is None:
+        with _history_writer_lock:
+            if _history_writer is None:
+                writer = HistoryWriter(settings.MARKER_HISTORY_BUFFER_SIZE)
+                threading.Thread(
+                    target=_run_periodically,
+                    args=(writer, settings.MARKER_HISTORY_FLUSH_INTERVAL, settings.MARKER_HISTORY_COMPACT_INTERVAL),
+                    daemon=True,
+                ).start()
+                atexit.register(writer.flush)
+                _history_writer = writer
+    return _history_writer
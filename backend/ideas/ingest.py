@@ -0,0 +1,243 @@
+import json
+import math
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Asset
+from .broadcast import publish_layout_change
+from .deadband import MarkerUpdateFilter, marker_filter_thresholds
+from .fusion import MarkerFusion
+from .history import get_history_writer
+from .live import get_live_state
+from .sequencing import MarkerSequencer, batch_info, stamp_batch
+from .versioning import bump_layout_version
+from .wire import MARKER_FRAME_CONFIDENCE_CONTENT_TYPE, MARKER_FRAME_CONTENT_TYPE, decode_marker_frame
+
+# Bulk write path for marker updates coming from the ArUco detection system
+
+# Only these columns are touched by marker updates, everything else on the row is left alone
+MARKER_FIELDS = ['x_pos', 'y_pos', 'rotation']
+
+
+class MarkerValueError(ValueError):
+    pass
+
+
+def _finite(value):
+    # float() takes "nan", "inf" and "1e999", none of which can be stored or sent back as JSON
+    value = float(value)
+    if not math.isfinite(value):
+        raise MarkerValueError("x, y, rotation and confidence must be finite numbers")
+    return value
+
+
+def parse_marker_updates(data):
+    """
+    Turn a list of {"id", "x", "y", "rotation"} dicts into {marker_id: (x, y, rotation)}.
+    Entries without an id/x/y are skipped, and if a marker shows up twice the last one wins.
+    rotation is None when the payload does not include it.
+    Raises MarkerValueError for NaN or infinite values.
+    """
+    updates = {}
+    for marker_data in data:
+        marker_id = marker_data.get('id')
+        x_pos = marker_data.get('x')
+        y_pos = marker_data.get('y')
+        rotation = marker_data.get('rotation')
+
+        if marker_id is not None and x_pos is not None and y_pos is not None:
+            updates[int(marker_id)] = (
+                _finite(x_pos),
+                _finite(y_pos),
+                _finite(rotation) if rotation is not None else None,
+            )
+    return updates
+
+
+def parse_marker_request(content_type, body, source=None):
+    """
+    (updates, markers received, batch info) from an update-marker-positions body. Either
+      - a binary frame (see wire.py), seq and capture timestamp come from its header
+      - a JSON envelope {"source", "seq", "timestamp", "markers": [...]}
+      - a bare JSON list of markers (older detectors, ordered by arrival)
+    source is the X-Marker-Source header, the envelope's "source" wins over it.
+    Markers may carry a "confidence" (0-1) for fusion.py.
+    Raises ValueError with a message for the client.
+    """
+    media_type = content_type.split(';')[0].strip()
+    if media_type in (MARKER_FRAME_CONTENT_TYPE, MARKER_FRAME_CONFIDENCE_CONTENT_TYPE):
+        seq, timestamp, updates, confidence = decode_marker_frame(
+            body, confidence=media_type == MARKER_FRAME_CONFIDENCE_CONTENT_TYPE,
+        )
+        # Zero means the sender did not fill them in
+        return updates, len(updates), batch_info(source, seq or None, timestamp or None, confidence)
+
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON format")
+
+    seq = timestamp = None
+    if isinstance(data, dict):
+        source = data.get('source', source)
+        seq = data.get('seq')
+        timestamp = data.get('timestamp')
+        if source is not None and (not isinstance(source, str) or len(source) > 64):
+            raise ValueError("source must be a string of at most 64 characters")
+        if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool) or seq < 0):
+            raise ValueError("seq must be a non-negative integer")
+        if timestamp is not None and (
+            not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or not math.isfinite(timestamp)
+        ):
+            raise ValueError("timestamp must be epoch seconds")
+        data = data.get('markers')
+    if not isinstance(data, list):
+        raise ValueError("Expected list of marker positions")
+    try:
+        updates = parse_marker_updates(data)
+        confidence = {
+            int(marker['id']): _finite(marker['confidence'])
+            for marker in data if marker.get('confidence') is not None and marker.get('id') is not None
+        }
+    except MarkerValueError:
+        raise
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Each marker needs a numeric id, x and y")
+    return updates, len(data), batch_info(source, seq, timestamp, confidence)
+
+
+def ingest_summary(result, markers_processed):
+    """Response body for update-marker-positions"""
+    updated_count = result["updated"]
+    return {
+        "message": f"Updated {updated_count} assets",
+        "markers_processed": markers_processed,
+        "assets_matched": result["matched"],
+        "assets_updated": updated_count,
+        "assets_unchanged": result["matched"] - updated_count,
+        # Older than what was already applied for that marker (retries, a slower second detector)
+        "updates_stale": result.get("stale", 0),
+        # Markers combined with other cameras' observations, and how many of those disagreed
+        "updates_fused": result.get("fused", 0),
+        "fusion_conflicts": result.get("conflicts", 0),
+        # Updates filtered out before the write (jitter below the map's deadband, or merged into a later write)
+        "updates_dropped": result.get("dropped", 0),
+        "updates_coalesced": result.get("coalesced", 0),
+    }
+
+
+def apply_marker_updates(updates):
+    """
+    Write parsed marker updates to every asset carrying those marker ids.
+    All marker ids are resolved with one query and only rows whose position
+    or rotation actually changed are written, with a single bulk_update.
+    Returns a dict of counts (assets matched and assets written) plus "moved",
+    {marker_id: (x, y, rotation)} for the markers that actually changed.
+    """
+    if not updates:
+        return {"matched": 0, "updated": 0, "moved": {}}
+
+    with transaction.atomic():
+        assets = (
+            Asset.objects
+            .filter(marker_id__in=list(updates))
+            .only('id', 'marker_id', *MARKER_FIELDS)
+        )
+
+        changed = []
+        moved = {}
+        matched = 0
+        for asset in assets:
+            matched += 1
+            x_pos, y_pos, rotation = updates[asset.marker_id]
+            if rotation is None:
+                # Keep the stored rotation if the detector did not send one
+                rotation = asset.rotation
+
+            if asset.x_pos == x_pos and asset.y_pos == y_pos and asset.rotation == rotation:
+                continue
+
+            asset.x_pos = x_pos
+            asset.y_pos = y_pos
+            asset.rotation = rotation
+            changed.append(asset)
+            moved[asset.marker_id] = (x_pos, y_pos, rotation)
+
+        if changed:
+            # bulk_update does not send signals, so bump the version here and stamp the rows with it
+            seq = bump_layout_version()
+            for asset in changed:
+                asset.changed_seq = seq
+            Asset.objects.bulk_update(changed, MARKER_FIELDS + ['changed_seq'])
+            publish_layout_change(seq)
+
+    return {"matched": matched, "updated": len(changed), "moved": moved}
+
+
+def _write_updates(updates):
+    # The in-memory live state when LIVE_MARKER_STATE is on (written to the db later), the db otherwise
+    live = get_live_state()
+    if live is not None:
+        result = live.apply(updates)
+    else:
+        result = apply_marker_updates(updates)
+
+    history = get_history_writer()
+    if history is not None and result["moved"]:
+        history.record(result["moved"])
+    return result
+
+
+def _write_held(updates, marks):
+    # Coalesced updates written from the filter's timer thread, outside any request. Skip markers a
+    # newer batch was admitted for since they were held, its write must not be overwritten
+    current = marker_sequencer.marks(updates)
+    updates = {marker_id: update for marker_id, update in updates.items() if current.get(marker_id) == marks.get(marker_id)}
+    if updates:
+        _write_updates(updates)
+    return updates
+
+
+marker_sequencer = MarkerSequencer()
+marker_fusion = MarkerFusion()
+# Held back updates are written from its timer thread when their coalescing window closes
+marker_filter = MarkerUpdateFilter(flush_held=_write_held)
+
+
+def forget_marker_positions(marker_ids):
+    """For writes outside this pipeline (restore, updateCoordinates): the deadband compares the next update with the db again"""
+    marker_filter.forget(marker_ids)
+
+
+def ingest_marker_updates(updates, batch=None):
+    """
+    Entry point for detector updates. Observations from several cameras are fused into one
+    position per marker (fusion.py), updates older than the last one applied to their marker
+    are discarded (sequencing.py), jitter below the map's deadband is dropped and bursts are
+    coalesced (deadband.py), the rest is written and queued for the position history.
+    The result also has "stale", "fused", "conflicts", "dropped" and "coalesced" counts.
+    """
+    batch = batch or batch_info()
+    stamp_batch(batch)
+    if not marker_sequencer.is_new_batch(batch):
+        return {"matched": 0, "updated": 0, "moved": {}, "stale": len(updates)}
+
+    fusion = {"fused": 0, "conflicts": 0, "stale": 0}
+    timestamps = None
+    if settings.MARKER_FUSION_WINDOW_MS > 0:
+        updates, timestamps, fusion = marker_fusion.fuse(
+            updates, batch, settings.MARKER_FUSION_WINDOW_MS, settings.MARKER_FUSION_CONFLICT_CM,
+        )
+    updates, stale = marker_sequencer.admit(updates, batch, timestamps)
+
+    thresholds = marker_filter_thresholds()
+    filtered = {"dropped": 0, "coalesced": 0}
+    if thresholds is not None and updates:
+        updates, filtered = marker_filter.filter(updates, thresholds, marks=marker_sequencer.marks(updates))
+
+    result = _write_updates(updates)
+    if thresholds is not None:
+        marker_filter.record(updates)
+    result.update(filtered, stale=stale + fusion["stale"], fused=fusion["fused"], conflicts=fusion["conflicts"])
+    return result
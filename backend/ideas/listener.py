@@ -0,0 +1,209 @@
+import logging
+import selectors
+import socket
+import time
+
+from django.db import close_old_connections
+
+from .admission import admit_marker_updates, merge_payloads
+from .ingest import parse_marker_request
+from .wire import SOCKET_LENGTH_PREFIX, decode_socket_message
+
+# Socket listener for detectors on the same LAN (manage.py listen_markers).
+#
+# A detector posting every frame over HTTP pays for a connection, DRF and the middleware stack
+# per batch of a few markers. Here it sends the same bodies (JSON or binary frames, see wire.py
+# for the small wrapper carrying the kind and source) as UDP datagrams or over one TCP
+# connection. Everything that arrived since the last poll is read in one go, messages from the
+# same source are merged (newest marker values win) and each source's batch goes through the
+# same admission control and ingest pipeline as update-marker-positions.
+
+logger = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 65535
+MAX_TCP_MESSAGE = 1 << 20
+
+STAT_KEYS = (
+    "messages",      # messages received
+    "markers",       # markers in them
+    "invalid",       # messages that could not be parsed
+    "lost",          # gaps in a source's sequence numbers (datagrams lost on the way, or dropped by the kernel)
+    "merged",        # messages folded into a later one from the same source before writing
+    "rate_limited",  # messages turned away by admission control
+    "failed",        # messages whose write raised (db errors), logged and skipped
+    "updated",       # assets written
+    "stale",         # updates older than what was already applied
+    "dropped",       # updates below the map's deadband
+    "coalesced",     # updates held back by the coalescing window
+)
+
+
+class MarkerListener:
+    def __init__(self, host='0.0.0.0', udp_port=None, tcp_port=None, max_drain=1000):
+        self.max_drain = max_drain
+        self.selector = selectors.DefaultSelector()
+        self.addresses = []
+        self._buffers = {}   # tcp connection -> bytes received but not yet a full message
+        self._last_seq = {}  # (source, host) -> highest seq seen
+        self._reset_stats()
+
+        if udp_port is not None:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Room for a burst while a batch is being written
+            udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            udp.bind((host, udp_port))
+            udp.setblocking(False)
+            self.selector.register(udp, selectors.EVENT_READ, 'udp')
+            self.addresses.append(('udp',) + udp.getsockname())
+        if tcp_port is not None:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, tcp_port))
+            server.listen()
+            server.setblocking(False)
+            self.selector.register(server, selectors.EVENT_READ, 'accept')
+            self.addresses.append(('tcp',) + server.getsockname())
+
+    def _reset_stats(self):
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+        self.latencies = []          # ms from a message arriving to it being written
+        self.capture_latencies = []  # ms from the frame being captured to it being written
+
+    def take_stats(self):
+        """(counts, latencies, capture latencies) since the last call"""
+        taken = self.stats, self.latencies, self.capture_latencies
+        self._reset_stats()
+        return taken
+
+    # Receiving
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for messages and apply everything that arrived, returns how many"""
+        messages = []
+        for key, _ in self.selector.select(timeout):
+            if key.data == 'udp':
+                self._drain_udp(key.fileobj, messages)
+            elif key.data == 'accept':
+                self._accept(key.fileobj)
+            else:
+                self._read_tcp(key.fileobj, key.data, messages)
+        if messages:
+            self._apply(messages)
+            close_old_connections()
+        return len(messages)
+
+    def _drain_udp(self, udp, messages):
+        # Everything the kernel has queued, so a burst becomes one write per source
+        for _ in range(self.max_drain):
+            try:
+                data, address = udp.recvfrom(MAX_DATAGRAM)
+            except BlockingIOError:
+                return
+            messages.append((time.perf_counter(), address[0], data))
+
+    def _accept(self, server):
+        try:
+            conn, address = server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffers[conn] = bytearray()
+        self.selector.register(conn, selectors.EVENT_READ, address[0])
+
+    def _close(self, conn):
+        self.selector.unregister(conn)
+        self._buffers.pop(conn, None)
+        conn.close()
+
+    def _read_tcp(self, conn, host, messages):
+        try:
+            chunk = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._close(conn)
+            return
+
+        buffer = self._buffers[conn]
+        buffer += chunk
+        received_at = time.perf_counter()
+        prefix = SOCKET_LENGTH_PREFIX.size
+        while len(buffer) >= prefix:
+            (length,) = SOCKET_LENGTH_PREFIX.unpack_from(buffer)
+            if length > MAX_TCP_MESSAGE:
+                # Not speaking our framing, there is no way to find the next message
+                self.stats["invalid"] += 1
+                self._close(conn)
+                return
+            if len(buffer) < prefix + length:
+                return
+            messages.append((received_at, host, bytes(buffer[prefix:prefix + length])))
+            del buffer[:prefix + length]
+
+    # Applying
+
+    def _track_gaps(self, batch, host):
+        seq = batch["seq"]
+        if seq is None:
+            return
+        key = (batch["source"], host)
+        last = self._last_seq.get(key)
+        if last is not None and seq > last:
+            self.stats["lost"] += seq - last - 1
+        if last is None or seq > last or seq < last - 1000:
+            # A big jump back is a restarted detector
+            self._last_seq[key] = seq
+
+    def _apply(self, messages):
+        pending = {}  # (source, host) -> {"updates", "batch", "received", "captured"}
+        for received_at, host, message in messages:
+            self.stats["messages"] += 1
+            try:
+                content_type, source, body = decode_socket_message(message)
+                updates, markers, batch = parse_marker_request(content_type, body, source)
+            except ValueError:
+                self.stats["invalid"] += 1
+                continue
+            self.stats["markers"] += markers
+            self._track_gaps(batch, host)
+
+            key = (batch["source"], host)
+            entry = pending.get(key)
+            if entry is None:
+                pending[key] = {"updates": updates, "batch": batch, "received": [received_at], "captured": []}
+            else:
+                self.stats["merged"] += 1
+                if batch["seq"] is not None and entry["batch"]["seq"] is not None and batch["seq"] < entry["batch"]["seq"]:
+                    # Arrived out of order, what is already pending is newer
+                    entry["updates"], entry["batch"] = merge_payloads(updates, batch, entry["updates"], entry["batch"])
+                else:
+                    entry["updates"], entry["batch"] = merge_payloads(entry["updates"], entry["batch"], updates, batch)
+                entry["received"].append(received_at)
+            if batch["timestamp"] is not None:
+                pending[key]["captured"].append(batch["timestamp"])
+
+        for (_, host), entry in pending.items():
+            try:
+                result, _ = admit_marker_updates(entry["updates"], entry["batch"], host)
+            except Exception:
+                # One bad write must not take the listener (and every later datagram) down with it
+                logger.exception("Applying marker updates from %s failed", host)
+                self.stats["failed"] += len(entry["received"])
+                continue
+            if result is None:
+                self.stats["rate_limited"] += len(entry["received"])
+                continue
+            for key in ("updated", "stale", "dropped", "coalesced"):
+                self.stats[key] += result.get(key, 0)
+            done, wall_clock = time.perf_counter(), time.time()
+            self.latencies.extend((done - received_at) * 1000 for received_at in entry["received"])
+            self.capture_latencies.extend((wall_clock - captured) * 1000 for captured in entry["captured"])
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self.selector.close()
@@ -0,0 +1,264 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .broadcast import send_delta
+from .models import Asset, LayoutVersion, RemovedMarker
+from .positions import POSITION_FIELDS, placed_assets, position_row_to_dict
+from .versioning import LAYOUT_VERSION_PK, current_layout_version
+
+# Live marker state (LIVE_MARKER_STATE = True).
+# Detector updates are applied to an in-memory copy of every placed asset and written
+# back to Asset rows in the background (write-behind), so tracking rate no longer turns
+# into db write rate. Reads and the push stream are served from memory.
+# This only works with a single backend process, same as the in-memory channel layer.
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMarkerState:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._loaded = False
+
+        self._assets = {}         # asset id -> position dict (get-marker-positions shape)
+        self._changed_seq = {}    # asset id -> layout version of its last change
+        self._marker_assets = {}  # marker_id -> [asset ids], several assets can share a marker
+        self._removed = []        # (seq, marker_id) tombstones, loaded from RemovedMarker
+        self._dirty = set()       # asset ids with changes not written to the db yet
+
+        self.seq = 0
+        self.updated_at = None
+        self.flushed_seq = 0
+
+    # Loading
+
+    @property
+    def loaded(self):
+        """Whether the state has been loaded, after that reads never touch the db"""
+        return self._loaded
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.reload()
+
+    def reload(self):
+        """
+        (Re)load every placed asset from the db. Positions that have not been flushed yet
+        win over what is in the db, so a reload never loses detector updates.
+        """
+        seq, updated_at = current_layout_version()
+        rows = placed_assets().values_list('id', 'changed_seq', *POSITION_FIELDS)
+        removed = list(
+            RemovedMarker.objects
+            .filter(seq__gt=seq - settings.MARKER_DELTA_MAX_AGE)
+            .values_list('seq', 'marker_id')
+        )
+
+        with self._lock:
+            pending = {pk: (self._assets[pk], self._changed_seq[pk]) for pk in self._dirty if pk in self._assets}
+
+            self._assets = {}
+            self._changed_seq = {}
+            self._marker_assets = {}
+            for pk, changed_seq, *position_row in rows:
+                position = position_row_to_dict(position_row)
+                if pk in pending:
+                    live_position, live_changed_seq = pending[pk]
+                    changed_seq = max(changed_seq, live_changed_seq)
+                    for key in ('x', 'y', 'rotation'):
+                        position[key] = live_position[key]
+                self._assets[pk] = position
+                self._changed_seq[pk] = changed_seq
+                self._marker_assets.setdefault(position['id'], []).append(pk)
+
+            self._dirty = {pk for pk in pending if pk in self._assets}
+            self._removed = sorted(removed)
+            # Never go backwards, unflushed versions are ahead of the db
+            if seq >= self.seq:
+                self.seq = seq
+                self.updated_at = updated_at
+            self.flushed_seq = max(self.flushed_seq, seq)
+            self._loaded = True
+
+    # Reads
+
+    def version(self):
+        """(seq, updated_at), used for ETags the same way as the db layout version"""
+        with self._lock:
+            self._ensure_loaded()
+            return self.seq, self.updated_at
+
+    def snapshot(self):
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(position) for _, position in sorted(self._assets.items())]
+
+    def since(self, since):
+        """Same result as positions.marker_positions_since, without touching the db"""
+        with self._lock:
+            self._ensure_loaded()
+            changed = [
+                dict(position) for pk, position in sorted(self._assets.items())
+                if self._changed_seq[pk] > since
+            ]
+            changed_ids = {position['id'] for position in changed}
+            removed = sorted({marker_id for seq, marker_id in self._removed if seq > since} - changed_ids)
+            return changed, removed
+
+    def asset_snapshot(self):
+        """Same result as positions.asset_positions"""
+        with self._lock:
+            self._ensure_loaded()
+            return {pk: dict(position) for pk, position in self._assets.items()}
+
+    def asset_since(self, since):
+        """Same result as positions.asset_positions_since, without touching the db"""
+        with self._lock:
+            self._ensure_loaded()
+            changed = {pk: dict(position) for pk, position in self._assets.items() if self._changed_seq[pk] > since}
+            removed = {
+                marker_id: set(self._marker_assets.get(marker_id, ()))
+                for seq, marker_id in self._removed if seq > since
+            }
+            return changed, removed
+
+    def dirty_ids(self):
+        """Ids of the assets whose position in the db is behind, as of now"""
+        with self._lock:
+            return set(self._dirty)
+
+    def overlay(self, asset_ids, positions):
+        """Copy positions not flushed yet onto position dicts read from the db (asset_ids in the same order)"""
+        with self._lock:
+            for pk, position in zip(asset_ids, positions):
+                if pk in self._dirty:
+                    live_position = self._assets[pk]
+                    for key in ('x', 'y', 'rotation'):
+                        position[key] = live_position[key]
+        return positions
+
+    # Writes
+
+    def reserve_seq(self):
+        """Next layout version for a write that goes through the db (admin, signals) instead of apply()"""
+        with self._lock:
+            self._ensure_loaded()
+            self.seq += 1
+            self.updated_at = timezone.now()
+            return self.seq
+
+    def apply(self, updates):
+        """
+        Apply parsed marker updates ({marker_id: (x, y, rotation)}) in memory.
+        Same counts as ingest.apply_marker_updates, and broadcasts the change.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            changed = []
+            moved = {}
+            matched = 0
+            for marker_id, (x_pos, y_pos, new_rotation) in updates.items():
+                for pk in self._marker_assets.get(marker_id, ()):
+                    matched += 1
+                    position = self._assets[pk]
+                    # Keep the current rotation if the detector did not send one
+                    rotation = position['rotation'] if new_rotation is None else new_rotation
+                    if position['x'] == x_pos and position['y'] == y_pos and position['rotation'] == rotation:
+                        continue
+                    position['x'] = x_pos
+                    position['y'] = y_pos
+                    position['rotation'] = rotation
+                    changed.append(pk)
+                    moved[marker_id] = (x_pos, y_pos, rotation)
+
+            if not changed:
+                return {"matched": matched, "updated": 0, "moved": moved}
+
+            self.seq += 1
+            self.updated_at = timezone.now()
+            seq = self.seq
+            for pk in changed:
+                self._changed_seq[pk] = seq
+                self._dirty.add(pk)
+            delta = [dict(self._assets[pk]) for pk in changed]
+
+        send_delta(seq, delta, [])
+        return {"matched": matched, "updated": len(changed), "moved": moved}
+
+    def flush(self):
+        """Write pending positions and the layout version to the db. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._loaded or (not self._dirty and self.flushed_seq >= self.seq):
+                    return 0
+                dirty = self._dirty
+                self._dirty = set()
+                seq = self.seq
+                rows = [
+                    Asset(
+                        pk=pk,
+                        x_pos=self._assets[pk]['x'],
+                        y_pos=self._assets[pk]['y'],
+                        rotation=self._assets[pk]['rotation'],
+                        changed_seq=self._changed_seq[pk],
+                    )
+                    for pk in dirty if pk in self._assets
+                ]
+
+            try:
+                with transaction.atomic():
+                    Asset.objects.bulk_update(rows, ['x_pos', 'y_pos', 'rotation', 'changed_seq'], batch_size=500)
+                    LayoutVersion.objects.filter(pk=LAYOUT_VERSION_PK).update(
+                        version=Greatest(F('version'), seq), updated_at=timezone.now(),
+                    )
+            except Exception:
+                # Put them back so the next flush retries
+                with self._lock:
+                    self._dirty |= dirty
+                raise
+
+            with self._lock:
+                self.flushed_seq = max(self.flushed_seq, seq)
+            return len(rows)
+
+
+_live_state = None
+_live_state_lock = threading.Lock()
+
+
+def _flush_periodically(state, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            close_old_connections()
+            state.flush()
+        except Exception:
+            logger.exception("Live marker state flush failed")
+
+
+def get_live_state():
+    """The process-wide LiveMarkerState, or None when LIVE_MARKER_STATE is off"""
+    global _live_state
+    if not settings.LIVE_MARKER_STATE:
+        return None
+    if _live_state is None:
+        with _live_state_lock:
+            if _live_state is None:
+                state = LiveMarkerState()
+                threading.Thread(
+                    target=_flush_periodically,
+                    args=(state, settings.LIVE_MARKER_FLUSH_INTERVAL),
+                    daemon=True,
+                ).start()
+                atexit.register(state.flush)
+                _live_state = state
+    return _live_state
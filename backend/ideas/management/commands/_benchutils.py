@@ -0,0 +1,94 @@
+import random
+import statistics
+import time
+
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from ideas.models import Asset, AssetBackground
+
+# Shared helpers for the bench_* management commands.
+# Benchmarks seed their own rows inside a transaction and roll it back at the end,
+# so they can be pointed at a dev database without leaving anything behind.
+
+FIRST_BENCH_MARKER_ID = 100  # keep clear of the 0-3 corner markers
+
+
+def seed_assets(n_assets, n_backgrounds=5, map_width=35.0, map_height=23.0):
+    """Create n_backgrounds AssetBackgrounds and n_assets Assets with unique marker ids"""
+    backgrounds = AssetBackground.objects.bulk_create([
+        AssetBackground(type_name=f"bench_type_{i}", icon_path=f"/asset-images/bench_{i}.svg")
+        for i in range(n_backgrounds)
+    ])
+    # bulk_create does not return pks on every backend, so read them back
+    backgrounds = list(AssetBackground.objects.filter(type_name__startswith="bench_type_"))
+
+    Asset.objects.bulk_create([
+        Asset(
+            name=f"bench_asset_{i}",
+            type=backgrounds[i % len(backgrounds)],
+            marker_id=FIRST_BENCH_MARKER_ID + i,
+            x_pos=random.uniform(0, map_width),
+            y_pos=random.uniform(0, map_height),
+            rotation=random.uniform(-180, 180),
+            in_map=True,
+        )
+        for i in range(n_assets)
+    ], batch_size=1000)
+    return backgrounds
+
+
+def clear_seeded():
+    """Remove everything seed_assets created, so a benchmark can reseed at a different size"""
+    Asset.objects.filter(name__startswith="bench_asset_").delete()
+    AssetBackground.objects.filter(type_name__startswith="bench_type_").delete()
+
+
+def marker_payload(n_markers, map_width=35.0, map_height=23.0):
+    """A detector-style payload moving the first n_markers bench markers to random spots"""
+    return [
+        {
+            "id": FIRST_BENCH_MARKER_ID + i,
+            "x": random.uniform(0, map_width),
+            "y": random.uniform(0, map_height),
+            "rotation": random.uniform(-180, 180),
+        }
+        for i in range(n_markers)
+    ]
+
+
+def count_queries(fn):
+    """Run fn once and return how many queries it issued"""
+    # The query log is capped, a full one would make every count 0
+    reset_queries()
+    with CaptureQueriesContext(connection) as ctx:
+        fn()
+    return len(ctx.captured_queries)
+
+
+def time_runs(fn, repeat):
+    """Run fn repeat times and return the durations in milliseconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(durations):
+    """p50/p99/mean in milliseconds"""
+    return {
+        "p50_ms": round(percentile(durations, 50), 3),
+        "p99_ms": round(percentile(durations, 99), 3),
+        "mean_ms": round(statistics.mean(durations), 3) if durations else 0.0,
+    }
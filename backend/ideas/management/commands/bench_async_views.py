@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+# Runs the load test at increasing numbers of simulated browsers for each way of serving the
+# live-session endpoints and reports what each one sustains:
+#   threads      - one OS thread per client, sync views (runserver / WSGI style)
+#   asgi-sync    - clients as coroutines on the ASGI handler, sync views (daphne today)
+#   asgi-async   - clients as coroutines on the ASGI handler, the /api/async/ views
+
+MODES = {
+    'threads': {},
+    'asgi-sync': {'asgi': True},
+    'asgi-async': {'asgi': True, 'async_views': True},
+}
+
+
+class Command(BaseCommand):
+    help = "Compare sync views on threads, sync views under ASGI and async views under ASGI at several concurrency levels"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', default='4,16,64', help="Comma separated browser counts to try")
+        parser.add_argument('--writers', type=int, default=1, help="Simulated detectors in every run")
+        parser.add_argument('--writer-interval', type=float, default=0.1,
+                            help="Seconds between detector posts, under MARKER_RATE_LIMIT so 429s mean overload")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per run")
+        parser.add_argument('--reader-interval', type=float, default=0.05,
+                            help="Seconds between polls per browser, so more browsers means more offered load")
+        parser.add_argument('--modes', default=','.join(MODES), help="Comma separated subset of " + ', '.join(MODES))
+        parser.add_argument('--max-p99-ms', type=float, default=250.0,
+                            help="A level counts as sustained while get-marker-positions p99 stays under this "
+                                 "and every response is a 2xx or 304")
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['readers'].split(',')]
+        results = {}
+        for mode in options['modes'].split(','):
+            rows = []
+            for readers in levels:
+                with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                    path = f.name
+                try:
+                    with open(os.devnull, 'w') as devnull:
+                        call_command(
+                            'loadtest', readers=readers, writers=options['writers'], duration=options['duration'],
+                            reader_interval=options['reader_interval'], writer_interval=options['writer_interval'], delta=True, output=path,
+                            stdout=devnull, **MODES[mode],
+                        )
+                    with open(path) as f:
+                        report = json.load(f)
+                finally:
+                    os.unlink(path)
+
+                poll = report["endpoints"].get("get-marker-positions", {})
+                update = report["endpoints"].get("update-marker-positions", {})
+                rows.append({
+                    "readers": readers,
+                    "poll_rps": poll.get("throughput_rps", 0.0),
+                    "poll_p99_ms": poll.get("p99_ms"),
+                    "update_rps": update.get("throughput_rps", 0.0),
+                    "update_p99_ms": update.get("p99_ms"),
+                    "errors": sum(sum(e["errors"].values()) for e in report["endpoints"].values()),
+                    # 429s from admission control included: a level that needs them was not sustained
+                    "bad_statuses": sum(
+                        count
+                        for e in report["endpoints"].values()
+                        for status, count in e["statuses"].items()
+                        if not (status.startswith('2') or status == '304')
+                    ),
+                })
+                self.stderr.write(f"{mode} readers={readers}: {rows[-1]}")
+
+            sustained = [
+                row["readers"] for row in rows
+                if row["poll_p99_ms"] is not None and row["poll_p99_ms"] <= options['max_p99_ms']
+                and not row["errors"] and not row["bad_statuses"]
+            ]
+            results[mode] = {"runs": rows, "max_sustained_readers": max(sustained) if sustained else 0}
+
+        self.stdout.write(json.dumps(results, indent=2))
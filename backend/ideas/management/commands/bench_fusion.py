@@ -0,0 +1,91 @@
+import json
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ideas.fusion import MarkerFusion
+from ideas.sequencing import MarkerSequencer, batch_info, stamp_batch
+
+from ._benchutils import FIRST_BENCH_MARKER_ID, count_queries, summarize
+
+
+class Command(BaseCommand):
+    help = "Benchmark multi-camera fusion: several sources at a fixed frame rate all seeing the same markers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', type=int, default=4, help="Simulated cameras")
+        parser.add_argument('--markers', type=int, default=100, help="Markers every camera sees")
+        parser.add_argument('--fps', type=float, default=30.0, help="Frames per second per camera")
+        parser.add_argument('--seconds', type=float, default=5.0, help="Simulated seconds of traffic")
+        parser.add_argument('--window-ms', type=float, default=100.0, help="Fusion window")
+        parser.add_argument('--noise-cm', type=float, default=0.3, help="Per-camera measurement noise")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        n_sources = options['sources']
+        truth = {
+            FIRST_BENCH_MARKER_ID + i: (rng.uniform(0, 35), rng.uniform(0, 23), rng.uniform(-180, 180))
+            for i in range(options['markers'])
+        }
+
+        # Interleave the cameras' frames the way they would arrive, each a little jittered in time
+        frames = []
+        start = time.time()
+        for source in range(n_sources):
+            for frame in range(int(options['seconds'] * options['fps'])):
+                frames.append((start + frame / options['fps'] + rng.uniform(0, 0.01), f"camera-{source}", frame + 1))
+        frames.sort()
+
+        def batch(timestamp, source, seq):
+            updates = {
+                marker_id: (x + rng.gauss(0, options['noise_cm']), y + rng.gauss(0, options['noise_cm']), rotation + rng.gauss(0, 2))
+                for marker_id, (x, y, rotation) in truth.items()
+            }
+            confidence = {marker_id: rng.uniform(0.3, 1.0) for marker_id in truth}
+            return updates, batch_info(source, seq, timestamp, confidence)
+
+        batches = [batch(*frame) for frame in frames]
+        fusion = MarkerFusion()
+        sequencer = MarkerSequencer()
+        now = start + options['seconds']
+
+        def ingest(updates, info):
+            stamp_batch(info, now=now)
+            if not sequencer.is_new_batch(info):
+                return {}, 0
+            fused, timestamps, stats = fusion.fuse(updates, info, options['window_ms'], 2.0)
+            fresh, _ = sequencer.admit(fused, info, timestamps)
+            return fresh, stats["fused"]
+
+        durations = []
+        fused_markers = 0
+        errors = []
+        queries = count_queries(lambda: ingest(*batches[0]))
+        for updates, info in batches[1:]:
+            t0 = time.perf_counter()
+            fresh, fused = ingest(updates, info)
+            durations.append((time.perf_counter() - t0) * 1000)
+            fused_markers += fused
+            for marker_id, (x, y, _) in fresh.items():
+                errors.append(((x - truth[marker_id][0]) ** 2 + (y - truth[marker_id][1]) ** 2) ** 0.5)
+        if queries:
+            raise CommandError(f"Fusion issued {queries} queries")
+
+        observations_per_s = n_sources * options['fps'] * options['markers']
+        per_batch = summarize(durations)
+        self.stdout.write(json.dumps({
+            "sources": n_sources,
+            "markers": options['markers'],
+            "fps": options['fps'],
+            "batches": len(batches),
+            "queries_per_batch": queries,
+            "per_batch": per_batch,
+            "observations_per_s_needed": observations_per_s,
+            "cpu_share_at_that_rate": round(per_batch["mean_ms"] * n_sources * options['fps'] / 1000, 4),
+            "fused_fraction": round(fused_markers / (len(batches) * options['markers']), 3),
+            "mean_error_cm": round(sum(errors) / len(errors), 4) if errors else None,
+            # Mean distance error of one camera on its own (Rayleigh mean of the per-axis noise)
+            "single_camera_error_cm": round(options['noise_cm'] * math.sqrt(math.pi / 2), 4),
+        }, indent=2))
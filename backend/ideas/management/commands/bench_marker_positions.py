@@ -0,0 +1,119 @@
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from ideas.models import Asset
+from ideas.views import getMarkerPositions
+
+from ._benchutils import clear_seeded, count_queries, seed_assets, summarize, time_runs
+
+
+def legacy_marker_positions():
+    """The original getMarkerPositions body (full rows, lazy asset.type per asset), kept for comparison"""
+    assets = Asset.objects.filter(marker_id__isnull=False).exclude(marker_id=999)
+
+    marker_positions = []
+    for asset in assets:
+        marker_positions.append({
+            "id": asset.marker_id,
+            "x": asset.x_pos,
+            "y": asset.y_pos,
+            "rotation": asset.rotation,
+            "asset_name": asset.name,
+            "asset_type": asset.type.type_name if asset.type else None,
+            "icon_path": asset.type.icon_path if asset.type and asset.type.icon_path else None,
+            "physical_width": asset.physical_width,
+            "physical_height": asset.physical_height
+        })
+    response = Response(marker_positions)
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = 'application/json'
+    response.renderer_context = {}
+    return response.render()
+
+
+def measure_response(make_response):
+    """Time to the first body piece, total time and peak Python memory of building and consuming a response"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = make_response()
+    first_byte = None
+    size = 0
+    for piece in response:
+        if first_byte is None:
+            first_byte = time.perf_counter()
+        size += len(piece)
+    total = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_byte_ms": round((first_byte - start) * 1000, 3),
+        "total_ms": round((total - start) * 1000, 3),
+        "peak_kb": round(peak / 1024, 1),
+        "bytes": size,
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark getMarkerPositions: query count at two table sizes plus p50/p99 latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=10000, help="Assets to seed for the large run")
+        parser.add_argument('--small', type=int, default=100, help="Assets to seed for the query count baseline")
+        parser.add_argument('--repeat', type=int, default=50, help="Requests to time")
+        parser.add_argument('--legacy', action='store_true', help="Also time the old N+1 implementation")
+        parser.add_argument('--stream', action='store_true', help="Also compare time to first byte and peak memory of ?stream=1")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+
+        def request_view():
+            response = getMarkerPositions(factory.get('/api/get-marker-positions/'))
+            if response.status_code != 200:
+                raise CommandError(f"getMarkerPositions returned {response.status_code}")
+            return response
+
+        # The map transform for lat/lng is cached (see mapconfig.py), keep its periodic
+        # version check out of the per-request query counts
+        with override_settings(MAP_CONFIG_CACHE_TTL=3600), transaction.atomic():
+            seed_assets(options['small'])
+            request_view()
+            small_queries = count_queries(request_view)
+
+            clear_seeded()
+            seed_assets(options['assets'])
+
+            large_queries = count_queries(request_view)
+            payload_bytes = len(request_view().content)
+
+            results = {
+                "queries_at_small": small_queries,
+                "queries_at_large": large_queries,
+                "query_count_constant": small_queries == large_queries,
+                "payload_bytes": payload_bytes,
+                "projection": summarize(time_runs(request_view, options['repeat'])),
+            }
+
+            if options['stream']:
+                results["list_vs_stream"] = {
+                    "list": measure_response(request_view),
+                    "stream": measure_response(lambda: getMarkerPositions(factory.get('/api/get-marker-positions/?stream=1'))),
+                }
+
+            if options['legacy']:
+                results["legacy_queries"] = count_queries(legacy_marker_positions)
+                results["legacy"] = summarize(time_runs(legacy_marker_positions, max(1, options['repeat'] // 10)))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps({
+            "small_assets": options['small'],
+            "large_assets": options['assets'],
+            "results": results,
+        }, indent=2))
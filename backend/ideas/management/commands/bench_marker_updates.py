@@ -0,0 +1,75 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ideas.ingest import apply_marker_updates, parse_marker_updates
+from ideas.models import Asset
+
+from ._benchutils import count_queries, marker_payload, seed_assets, summarize, time_runs
+
+
+def legacy_update(data):
+    """The original per-marker loop from updateMarkerPositions, kept here for comparison"""
+    updated_count = 0
+    for marker_data in data:
+        marker_id = marker_data.get('id')
+        x_pos = marker_data.get('x')
+        y_pos = marker_data.get('y')
+        rotation = marker_data.get('rotation')
+
+        if marker_id is not None and x_pos is not None and y_pos is not None:
+            assets = Asset.objects.filter(marker_id=marker_id)
+            for asset in assets:
+                asset.x_pos = x_pos
+                asset.y_pos = y_pos
+                asset.rotation = rotation
+                asset.save()
+                updated_count += 1
+    return updated_count
+
+
+class Command(BaseCommand):
+    help = "Compare query counts and latency of the per-marker update loop against the bulk write path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=200, help="Assets to seed")
+        parser.add_argument('--markers', type=int, default=40, help="Markers per detector payload")
+        parser.add_argument('--repeat', type=int, default=50, help="Payloads to time per strategy")
+
+    def handle(self, *args, **options):
+        n_markers = min(options['markers'], options['assets'])
+
+        # Everything runs inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            seed_assets(options['assets'])
+
+            payloads = [marker_payload(n_markers) for _ in range(options['repeat'] + 1)]
+            loop_payloads = iter(payloads)
+            bulk_payloads = iter(payloads)
+
+            results = {
+                "legacy_loop": {
+                    "queries": count_queries(lambda: legacy_update(next(loop_payloads))),
+                    **summarize(time_runs(lambda: legacy_update(next(loop_payloads)), options['repeat'])),
+                },
+                "bulk_update": {
+                    "queries": count_queries(lambda: apply_marker_updates(parse_marker_updates(next(bulk_payloads)))),
+                    **summarize(time_runs(lambda: apply_marker_updates(parse_marker_updates(next(bulk_payloads))), options['repeat'])),
+                },
+            }
+
+            # Re-sending the same payload should not write anything
+            unchanged = parse_marker_updates(payloads[-1])
+            results["bulk_update_unchanged"] = {
+                "queries": count_queries(lambda: apply_marker_updates(unchanged)),
+                **summarize(time_runs(lambda: apply_marker_updates(unchanged), options['repeat'])),
+            }
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps({
+            "assets": options['assets'],
+            "markers_per_payload": n_markers,
+            "results": results,
+        }, indent=2))
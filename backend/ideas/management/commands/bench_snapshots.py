@@ -0,0 +1,83 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ideas.models import Asset
+from ideas.positions import encode_json
+from ideas.snapshots import IN_MAP, IN_UNDERSTAND, capture_snapshot, diff_layouts, layout_entries, restore_snapshot, unpack_layout
+
+from ._benchutils import count_queries, seed_assets, summarize, time_runs
+
+
+def per_row_restore(snapshot):
+    """What a restore looks like without bulk_update: one save() per asset"""
+    for pk, x, y, rotation, flags in unpack_layout(snapshot.data).tolist():
+        asset = Asset.objects.filter(pk=pk).first()
+        if asset is None:
+            continue
+        asset.x_pos, asset.y_pos, asset.rotation = x, y, rotation
+        asset.in_map, asset.in_understand = bool(flags & IN_MAP), bool(flags & IN_UNDERSTAND)
+        asset.save()
+
+
+class Command(BaseCommand):
+    help = "Benchmark capturing, restoring and diffing layout snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=1000, help="Assets to seed")
+        parser.add_argument('--repeat', type=int, default=10, help="Runs to time per operation")
+
+    def handle(self, *args, **options):
+        # Everything runs inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            seed_assets(options['assets'])
+            assets = list(Asset.objects.all())
+
+            def scramble():
+                # Move every asset somewhere else so each restore has the whole layout to write
+                for asset in assets:
+                    asset.x_pos = random.uniform(0, 35)
+                    asset.y_pos = random.uniform(0, 23)
+                Asset.objects.bulk_update(assets, ['x_pos', 'y_pos'], batch_size=500)
+
+            snapshot = capture_snapshot("bench")
+            records = unpack_layout(snapshot.data)
+            scramble()
+            other = capture_snapshot("bench other")
+            other_records = unpack_layout(other.data)
+
+            restores = []
+            per_row = []
+            for _ in range(options['repeat']):
+                scramble()
+                restores += time_runs(lambda: restore_snapshot(snapshot), 1)
+                scramble()
+                per_row += time_runs(lambda: per_row_restore(snapshot), 1)
+            scramble()
+            restore_queries = count_queries(lambda: restore_snapshot(snapshot))
+
+            results = {
+                "capture": {
+                    "queries": count_queries(lambda: capture_snapshot("bench")),
+                    **summarize(time_runs(lambda: capture_snapshot("bench"), options['repeat'])),
+                },
+                "restore_bulk": {"queries": restore_queries, **summarize(restores)},
+                "restore_per_row": {"queries": count_queries(lambda: per_row_restore(snapshot)), **summarize(per_row)},
+                # Already in place, nothing should be written
+                "restore_unchanged": {
+                    "queries": count_queries(lambda: restore_snapshot(snapshot)),
+                    **summarize(time_runs(lambda: restore_snapshot(snapshot), options['repeat'])),
+                },
+                "diff": summarize(time_runs(lambda: diff_layouts(records, other_records), options['repeat'])),
+            }
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps({
+            "assets": options['assets'],
+            "snapshot_bytes": len(snapshot.data),
+            "json_bytes": len(encode_json(layout_entries(records))),
+            "results": results,
+        }, indent=2))
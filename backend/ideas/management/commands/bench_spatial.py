@@ -0,0 +1,127 @@
+import json
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ideas.geo import METERS_PER_MILE
+from ideas.ingest import apply_marker_updates, parse_marker_updates
+from ideas.mapconfig import invalidate_map_config
+from ideas.models import Map
+from ideas.spatial import SpatialIndex, neighbour_counts
+
+from ._benchutils import FIRST_BENCH_MARKER_ID, marker_payload, seed_assets, summarize, time_runs
+
+# Tijuana bounds the frontend falls back to
+BENCH_CORNERS = dict(
+    top_left_lat=32.561065, top_left_lng=-117.083997,
+    top_right_lat=32.561065, top_right_lng=-117.075475,
+    bottom_right_lat=32.558361, bottom_right_lng=-117.075475,
+    bottom_left_lat=32.558361, bottom_left_lng=-117.083997,
+)
+
+
+def pairwise_counts(points, radius):
+    """The O(n^2) way: compare every pair"""
+    return {
+        key: sum(1 for other, ox, oy in points if other != key and math.hypot(ox - x, oy - y) <= radius)
+        for key, x, y in points
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark the spatial index: rebuild, incremental sync, radius/k-nearest queries and nearby counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=5000, help="Assets to seed")
+        parser.add_argument('--backgrounds', type=int, default=10, help="Asset types to spread them over")
+        parser.add_argument('--repeat', type=int, default=200, help="Queries to time")
+        parser.add_argument('--pairwise-limit', type=int, default=3000,
+                            help="Skip the O(n^2) comparison above this many assets")
+
+    def handle(self, *args, **options):
+        n_assets = options['assets']
+        repeat = options['repeat']
+        random.seed(0)
+
+        with transaction.atomic():
+            seed_assets(n_assets, n_backgrounds=options['backgrounds'])
+            map_obj = Map.objects.order_by('pk').first()
+            if map_obj is None:
+                Map.objects.create(name="bench_map", width=35, height=23, **BENCH_CORNERS)
+            elif not any((map_obj.top_left_lat, map_obj.top_left_lng, map_obj.bottom_right_lat, map_obj.bottom_right_lng)):
+                Map.objects.filter(pk=map_obj.pk).update(**BENCH_CORNERS)
+            invalidate_map_config()
+
+            index = SpatialIndex()
+            start = time.perf_counter()
+            index.sync()
+            rebuild_ms = (time.perf_counter() - start) * 1000
+            if len(index.entries) < n_assets:
+                raise CommandError("Seeded assets are missing from the index")
+
+            centers = [(random.uniform(0, 35), random.uniform(0, 23)) for _ in range(repeat)]
+            queries = iter(centers * 4)
+            entries = list(index.entries.values())
+
+            def brute_radius(x, y, radius):
+                return sorted((math.hypot(e['x'] - x, e['y'] - y), e['id']) for e in entries if math.hypot(e['x'] - x, e['y'] - y) <= radius)
+
+            def brute_nearest(x, y, k):
+                return sorted((math.hypot(e['x'] - x, e['y'] - y), e['id']) for e in entries)[:k]
+
+            # Same answers as a full scan
+            for x, y in centers[:20]:
+                grid_ids = [r['id'] for r in index.query(x, y, radius=3.0)]
+                if grid_ids != [key for _, key in brute_radius(x, y, 3.0)]:
+                    raise CommandError("Radius query disagrees with a full scan")
+                if [round(d, 9) for d, _ in brute_nearest(x, y, 10)] != [round(r['distance'], 9) for r in index.query(x, y, k=10)]:
+                    raise CommandError("k-nearest query disagrees with a full scan")
+
+            results = {
+                "rebuild_ms": round(rebuild_ms, 3),
+                "radius_3cm": {
+                    "grid": summarize(time_runs(lambda: index.query(*next(queries), radius=3.0), repeat)),
+                    "scan": summarize(time_runs(lambda: brute_radius(*next(queries), 3.0), repeat)),
+                },
+                "nearest_10": {
+                    "grid": summarize(time_runs(lambda: index.query(*next(queries), k=10), repeat)),
+                    "scan": summarize(time_runs(lambda: brute_nearest(*next(queries), 10), repeat)),
+                },
+            }
+
+            # Nearby counts per type, at 40 miles (everything) and at 50 m (a few neighbours each)
+            by_type = index.points_by_type('geo')
+            for label, radius in (("nearby_40_miles", 40 * METERS_PER_MILE), ("nearby_50_m", 50.0)):
+                start = time.perf_counter()
+                grid_counts = {t: neighbour_counts(points, radius) for t, points in by_type.items()}
+                entry = {"grid_ms": round((time.perf_counter() - start) * 1000, 3)}
+                if n_assets <= options['pairwise_limit']:
+                    start = time.perf_counter()
+                    pair_counts = {t: pairwise_counts(points, radius) for t, points in by_type.items()}
+                    entry["pairwise_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                    if pair_counts != grid_counts:
+                        raise CommandError(f"{label}: grid counts disagree with pairwise counts")
+                results[label] = entry
+
+            # A detector post moving 40 markers, then the index catching up
+            moves = iter([marker_payload(40) for _ in range(repeat)])
+
+            def move_and_sync():
+                apply_marker_updates(parse_marker_updates(next(moves)))
+                start = time.perf_counter()
+                index.sync()
+                return (time.perf_counter() - start) * 1000
+
+            sync_times = [move_and_sync() for _ in range(min(repeat, 50))]
+            results["incremental_sync_40_moved"] = summarize(sync_times)
+            moved_x, _ = index.position_of(FIRST_BENCH_MARKER_ID)
+            if not 0 <= moved_x <= 35:
+                raise CommandError("Index did not pick up moved markers")
+
+            transaction.set_rollback(True)
+        invalidate_map_config()
+
+        self.stdout.write(json.dumps({"assets": n_assets, "results": results}, indent=2))
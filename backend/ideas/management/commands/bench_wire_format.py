@@ -0,0 +1,80 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from ideas.ingest import parse_marker_updates
+from ideas.views import updateMarkerPositions
+from ideas.wire import MARKER_FRAME_CONTENT_TYPE, decode_marker_frame, encode_marker_frame
+
+from ._benchutils import marker_payload, seed_assets, summarize, time_runs
+
+
+def throughput(durations, n_markers):
+    """Markers per second at the median payload time"""
+    p50 = summarize(durations)["p50_ms"]
+    return round(n_markers / (p50 / 1000)) if p50 else None
+
+
+class Command(BaseCommand):
+    help = "Compare encode, decode and end-to-end cost of JSON and binary marker update payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--markers', type=int, default=200, help="Markers per detector payload")
+        parser.add_argument('--repeat', type=int, default=200, help="Payloads to time per step")
+
+    def handle(self, *args, **options):
+        n_markers = options['markers']
+        repeat = options['repeat']
+        payloads = [marker_payload(n_markers) for _ in range(repeat)]
+
+        formats = {
+            "json": {
+                "content_type": 'application/json',
+                "encode": lambda payload: json.dumps(payload).encode(),
+                "decode": lambda body: parse_marker_updates(json.loads(body)),
+            },
+            "binary": {
+                "content_type": MARKER_FRAME_CONTENT_TYPE,
+                "encode": lambda payload: encode_marker_frame(payload, seq=1, timestamp=time.time()),
+                "decode": lambda body: decode_marker_frame(body)[2],
+            },
+        }
+
+        factory = RequestFactory()
+        results = {}
+        # History is switched off so its background writer does not outlive the rolled back transaction
+        with override_settings(MARKER_HISTORY=False), transaction.atomic():
+            seed_assets(n_markers)
+
+            for name, fmt in formats.items():
+                bodies = [fmt["encode"](payload) for payload in payloads]
+                encode_payloads = iter(payloads)
+                decode_bodies = iter(bodies)
+                post_bodies = iter(bodies)
+
+                def post():
+                    request = factory.post(
+                        '/api/update-marker-positions/', data=next(post_bodies), content_type=fmt["content_type"],
+                    )
+                    response = updateMarkerPositions(request)
+                    assert response.status_code == 200, response.data
+
+                encode = time_runs(lambda: fmt["encode"](next(encode_payloads)), repeat)
+                decode = time_runs(lambda: fmt["decode"](next(decode_bodies)), repeat)
+                end_to_end = time_runs(post, repeat)
+                results[name] = {
+                    "payload_bytes": len(bodies[0]),
+                    "encode": {**summarize(encode), "markers_per_s": throughput(encode, n_markers)},
+                    "decode": {**summarize(decode), "markers_per_s": throughput(decode, n_markers)},
+                    "end_to_end": {**summarize(end_to_end), "markers_per_s": throughput(end_to_end, n_markers)},
+                }
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps({
+            "markers_per_payload": n_markers,
+            "results": results,
+        }, indent=2))
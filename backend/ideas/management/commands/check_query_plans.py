@@ -0,0 +1,96 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ideas.models import Asset, AssetInMap, Map
+from ideas.positions import POSITION_FIELDS, placed_assets
+
+from ._benchutils import seed_assets
+
+
+def full_scan(plan, table):
+    """Whether the plan reads every row of `table` (Postgres "Seq Scan on t", SQLite "SCAN t")"""
+    return bool(
+        re.search(rf'Seq Scan on {table}\b', plan)
+        or re.search(rf'\bSCAN {table}\b(?! USING)', plan)
+    )
+
+
+class Command(BaseCommand):
+    help = "Seed a large asset table, EXPLAIN the hot marker queries and fail if any of them does not use an index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=100000, help="Assets to seed")
+        parser.add_argument('--json', action='store_true', help="Print the plans as JSON instead of text")
+
+    def handle(self, *args, **options):
+        n_assets = options['assets']
+
+        # Everything runs inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            seed_assets(n_assets, n_backgrounds=10)
+            asset_ids = list(Asset.objects.filter(name__startswith="bench_asset_").values_list('id', flat=True))
+
+            # Ten maps with a tenth of the assets each, so per-map lookups are selective
+            in_maps = []
+            for i in range(10):
+                map_obj = Map.objects.create(name=f"bench_map_{i}", width=35, height=23)
+                in_map = AssetInMap.objects.create(map=map_obj)
+                in_map.assets.add(*asset_ids[i::10])
+                in_maps.append(in_map)
+            in_map = in_maps[0]
+
+            # Only a tenth of the assets have a token on the table, the rest are 999 (no marker)
+            placed_ids = asset_ids[::10]
+            Asset.objects.filter(id__in=asset_ids).exclude(id__in=placed_ids).update(marker_id=999)
+
+            # A handful of recently changed assets, like a delta poll would see
+            Asset.objects.filter(id__in=placed_ids[:20]).update(changed_seq=1_000_000)
+
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            placed_markers = list(Asset.objects.filter(id__in=placed_ids).values_list('marker_id', flat=True))
+            marker_ids = placed_markers[::max(1, len(placed_markers) // 40)][:40]
+            through = AssetInMap.assets.through._meta.db_table
+            # name: (query, table that must not be read in full)
+            queries = {
+                # updateMarkerPositions: resolve every marker in the payload
+                "ingest_marker_lookup": (
+                    Asset.objects.filter(marker_id__in=marker_ids).only('id', 'marker_id', 'x_pos', 'y_pos', 'rotation'),
+                    'ideas_asset',
+                ),
+                # single marker lookup (old per-marker loop, admin/debugging)
+                "single_marker_lookup": (Asset.objects.filter(marker_id=marker_ids[0]), 'ideas_asset'),
+                # get-marker-positions full read, placed assets only
+                "placed_positions": (placed_assets().values_list(*POSITION_FIELDS), 'ideas_asset'),
+                # get-marker-positions ?since= delta
+                "placed_delta": (placed_assets().filter(changed_seq__gt=999_999), 'ideas_asset'),
+                # is this asset in this map
+                "asset_in_map": (AssetInMap.objects.filter(map=in_map.map_id, assets=asset_ids[0]), through),
+                # which maps is this asset in
+                "maps_for_asset": (AssetInMap.objects.filter(assets=asset_ids[0]), through),
+                # every asset in one map
+                "map_assets": (Asset.objects.filter(assetinmap=in_map), through),
+            }
+
+            results = {}
+            for name, (queryset, table) in queries.items():
+                plan = queryset.explain()
+                results[name] = {"table": table, "uses_index": not full_scan(plan, table), "plan": plan}
+
+            transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps({"assets": n_assets, "vendor": connection.vendor, "queries": results}, indent=2))
+        else:
+            for name, result in results.items():
+                self.stdout.write(f"{'OK  ' if result['uses_index'] else 'FAIL'} {name}")
+                for line in result['plan'].splitlines():
+                    self.stdout.write(f"       {line}")
+
+        failed = [name for name, result in results.items() if not result['uses_index']]
+        if failed:
+            raise CommandError(f"No index scan for: {', '.join(failed)}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ideas.models import AssetBackground
+from ideas.totals import check_scenario_totals
+
+
+class Command(BaseCommand):
+    help = "Recount the placed assets per map and type from scratch and report any drift from the stored scenario totals"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Overwrite the stored counts with the recounted ones")
+
+    def handle(self, *args, **options):
+        result = check_scenario_totals(fix=options['fix'])
+        if not result["maps"]:
+            raise CommandError("No map, nothing to check")
+
+        names = dict(AssetBackground.objects.values_list('id', 'type_name'))
+        for row in result["drift"]:
+            self.stdout.write(
+                f"map {row['map']} {names.get(row['type'], row['type'])}: stored {row['stored']}, actual {row['actual']}"
+            )
+
+        if not result["drift"]:
+            self.stdout.write("Scenario totals are consistent")
+        elif result["fixed"]:
+            self.stdout.write(f"Fixed {len(result['drift'])} asset types")
+        else:
+            raise CommandError(f"{len(result['drift'])} asset types have drifted, run with --fix to correct them")
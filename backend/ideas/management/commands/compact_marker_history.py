@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ideas.history import compact_history
+
+
+class Command(BaseCommand):
+    help = "Downsample old marker position history (raw -> 1 s -> 1 min buckets). The backend also does this on its own every MARKER_HISTORY_COMPACT_INTERVAL seconds"
+
+    def handle(self, *args, **options):
+        for tier, (removed, written) in compact_history().items():
+            self.stdout.write(f"{tier}: {removed} samples -> {written}")
@@ -0,0 +1,96 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ideas.listener import MarkerListener
+
+from ._benchutils import summarize
+
+
+def process_local_channel_layer():
+    """Whether the channel layer only reaches consumers in this process (or there is none)"""
+    backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+    return not backend or backend.endswith('InMemoryChannelLayer')
+
+
+class Command(BaseCommand):
+    help = (
+        "Receive detector marker updates over UDP and/or TCP and apply them like update-marker-positions. "
+        "Runs in its own process: detectors must use either this or HTTP, not both"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help="Address to listen on")
+        parser.add_argument('--udp-port', type=int, default=9999, help="UDP port, 0 for none")
+        parser.add_argument('--tcp-port', type=int, default=0, help="TCP port for length-prefixed messages, 0 for none")
+        parser.add_argument(
+            '--batch-ms', type=float, default=50.0,
+            help="After a write, let messages collect this long so each source is written at most every batch-ms "
+                 "(keeps a detector streaming at frame rate under MARKER_RATE_LIMIT)",
+        )
+        parser.add_argument('--report-every', type=float, default=10.0, help="Seconds between stats lines, 0 for none")
+        parser.add_argument(
+            '--without-push', action='store_true',
+            help="Start with an in-process channel layer anyway, browsers then only see moves by polling",
+        )
+
+    def handle(self, *args, **options):
+        # Writes from here reach the web workers through the db, anything held in this process does not
+        if settings.LIVE_MARKER_STATE:
+            raise CommandError(
+                "LIVE_MARKER_STATE is on: positions would only live in this process until flushed, "
+                "turn it off for the listener"
+            )
+        if process_local_channel_layer():
+            if not options['without_push']:
+                raise CommandError(
+                    "The channel layer is in-memory, so moves from the listener never reach ws/markers/ clients "
+                    "in the web workers. Set CHANNEL_LAYER_BACKEND to a shared layer (e.g. channels_redis), "
+                    "or pass --without-push if browsers poll"
+                )
+            self.stderr.write(self.style.WARNING(
+                "In-memory channel layer: browsers will only see listener moves by polling get-marker-positions"
+            ))
+        self.stderr.write(self.style.WARNING(
+            "Sequencing, fusion and the deadband are per process: send each detector here or over HTTP, not both"
+        ))
+
+        try:
+            listener = MarkerListener(
+                host=options['host'],
+                udp_port=options['udp_port'] or None,
+                tcp_port=options['tcp_port'] or None,
+            )
+        except OSError as e:
+            raise CommandError(f"Cannot listen: {e}")
+        if not listener.addresses:
+            raise CommandError("Give a --udp-port and/or a --tcp-port")
+        for protocol, host, port in listener.addresses:
+            self.stdout.write(f"Listening for marker updates on {protocol}://{host}:{port}")
+
+        report_every = options['report_every']
+        next_report = time.monotonic() + report_every
+        try:
+            while True:
+                if listener.poll(0.5) and options['batch_ms'] > 0:
+                    time.sleep(options['batch_ms'] / 1000)
+                if report_every and time.monotonic() >= next_report:
+                    next_report += report_every
+                    self.report(listener)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.report(listener)
+            listener.close()
+
+    def report(self, listener):
+        """One JSON line: counts since the last report, plus latency percentiles"""
+        stats, latencies, capture_latencies = listener.take_stats()
+        line = dict(stats)
+        if latencies:
+            line["receive_to_write"] = summarize(latencies)
+        if capture_latencies:
+            line["capture_to_write"] = summarize(capture_latencies)
+        self.stdout.write(json.dumps(line))
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import platform
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.utils import timezone
+
+from ideas.middleware import QueryTimer
+from ideas.models import Map
+from ideas.wire import MARKER_FRAME_CONTENT_TYPE, encode_marker_frame
+
+from ._benchutils import FIRST_BENCH_MARKER_ID, clear_seeded, percentile, seed_assets, summarize
+
+# Load test for the live-session endpoints: simulated detectors post marker updates while
+# simulated browsers poll positions and the map config, all at the same time.
+#
+# By default requests go through Django's test Client in this process (real middleware and
+# views, one db connection per thread), which needs nothing but the database and also lets us
+# count queries per request. With --url the same traffic is sent over HTTP to a running server
+# instead (it has to be using the same database, since the seed data is written from here).
+#
+# --asgi runs the simulated clients as coroutines on one event loop talking to Django's ASGI
+# handler (AsyncClient), the way daphne serves them, and --async-views points them at the
+# /api/async/ versions of the endpoints. bench_async_views compares the combinations.
+
+UPDATE_PATH = '/update-marker-positions/'
+POSITIONS_PATH = '/get-marker-positions/'
+MAP_CONFIG_PATH = '/map-config/'
+API_PREFIX = '/api'
+ASYNC_PREFIX = '/api/async'
+
+
+def client_host():
+    """A Host header ALLOWED_HOSTS accepts, the test clients' default "testserver" usually is not"""
+    for host in settings.ALLOWED_HOSTS:
+        host = host.lstrip('.')
+        if host and host != '*':
+            return host
+    return 'localhost'
+
+
+class HostAsyncClient(AsyncClient):
+    """AsyncClient with client_host() as Host, its scope always starts with host: testserver"""
+
+    def request(self, **request):
+        host = client_host().encode()
+        request["headers"] = [(b"host", host) if name == b"host" else (name, value) for name, value in request["headers"]]
+        return super().request(**request)
+
+
+class InProcessTransport:
+    def __init__(self):
+        self.client = Client(headers={'Host': client_host()})
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            if method == 'POST':
+                response = self.client.post(path, data=body, content_type=content_type, headers=headers)
+            else:
+                response = self.client.get(path, headers=headers)
+        return response.status_code, response.content, response.headers, timer.queries
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=dict(headers or {}))
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, response.read(), response.headers, None
+        except urllib.error.HTTPError as e:
+            # 304 and 4xx/5xx land here, they are still answers
+            return e.code, e.read(), e.headers, None
+
+    def close(self):
+        pass
+
+
+class UnexpectedStatus(Exception):
+    pass
+
+
+class Recorder:
+    """Collects (latency ms, queries, status) per endpoint from every worker thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.failures = {}
+
+    def add(self, endpoint, duration_ms, queries, status_code):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((duration_ms, queries, status_code))
+
+    def fail(self, endpoint, error):
+        with self._lock:
+            failures = self.failures.setdefault(endpoint, {})
+            key = f"{type(error).__name__}: {error}"[:200]
+            failures[key] = failures.get(key, 0) + 1
+
+
+def check_status(recorder, endpoint, status_code, content, expected):
+    # A 400 (say a rejected Host) is as much a failure as a 500, its latency says nothing about the endpoint
+    if status_code not in expected:
+        recorder.fail(endpoint, UnexpectedStatus(f"{status_code} {content.decode(errors='replace')}"))
+
+
+def timed(recorder, transport, endpoint, expected, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        status_code, content, headers, queries = transport.request(*args, **kwargs)
+    except Exception as e:
+        recorder.fail(endpoint, e)
+        return None, None, None
+    recorder.add(endpoint, (time.perf_counter() - start) * 1000, queries, status_code)
+    check_status(recorder, endpoint, status_code, content, expected)
+    return status_code, content, headers
+
+
+class DetectorSim:
+    """A simulated detector: posts its own slice of markers over and over"""
+    endpoint = 'update-marker-positions'
+    # 429 is admission control asking for a backoff, which the sim honours
+    expected = (200, 429)
+
+    def __init__(self, index, options, prefix):
+        self.options = options
+        self.path = prefix + UPDATE_PATH
+        self.first = FIRST_BENCH_MARKER_ID + index * options['markers']
+        self.rng = random.Random(options['seed'] + index)
+        self.source = f'loadtest-{index}'
+        self.seq = 0
+
+    def next_request(self):
+        """(endpoint, method, path, body, content_type, headers, pause afterwards)"""
+        rng = self.rng
+        payload = [
+            {"id": self.first + i, "x": rng.uniform(0, 35), "y": rng.uniform(0, 23), "rotation": rng.uniform(-180, 180)}
+            for i in range(self.options['markers'])
+        ]
+        self.seq += 1
+        # Stamped like the detector does, each writer is its own source
+        if self.options['binary']:
+            body = encode_marker_frame(payload, seq=self.seq, timestamp=time.time())
+            content_type = MARKER_FRAME_CONTENT_TYPE
+        else:
+            body = json.dumps({"source": self.source, "seq": self.seq, "timestamp": time.time(), "markers": payload}).encode()
+            content_type = 'application/json'
+        headers = {'X-Marker-Source': self.source}
+        return self.endpoint, 'POST', self.path, body, content_type, headers, self.options['writer_interval']
+
+    def handle_response(self, status_code, content, headers):
+        # Back off when admission control turns the write away, like BackendSync does
+        if status_code == 429:
+            return float(headers.get('Retry-After', 1))
+        return None
+
+
+class BrowserSim:
+    """A simulated browser: polls marker positions, revalidates the map config every few polls"""
+    expected = (200, 304)
+
+    def __init__(self, index, options, prefix):
+        self.options = options
+        self.positions_path = prefix + POSITIONS_PATH
+        self.map_config_path = prefix + MAP_CONFIG_PATH
+        self.seq = 0
+        self.config_etag = None
+        self.polls = 0
+        self.config_due = False
+
+    def next_request(self):
+        if self.config_due:
+            headers = {'If-None-Match': self.config_etag} if self.config_etag else None
+            return 'map-config', 'GET', self.map_config_path, None, None, headers, self.options['reader_interval']
+        path = f'{self.positions_path}?since={self.seq}' if self.options['delta'] else self.positions_path
+        self.polls += 1
+        # Without a map-config request this round, wait before the next poll
+        pause = 0 if self.polls % self.options['config_every'] == 0 else self.options['reader_interval']
+        return 'get-marker-positions', 'GET', path, None, None, None, pause
+
+    def handle_response(self, status_code, content, headers):
+        if self.config_due:
+            self.config_due = False
+            if status_code == 200:
+                self.config_etag = headers.get('ETag')
+            return
+        if self.options['delta'] and status_code == 200:
+            self.seq = json.loads(content)["seq"]
+        self.config_due = self.polls % self.options['config_every'] == 0
+
+
+def run_worker(sim, make_transport, recorder, stop):
+    """Thread body: one connection, requests back to back until stop is set"""
+    transport = make_transport()
+    try:
+        while not stop.is_set():
+            endpoint, method, path, body, content_type, headers, pause = sim.next_request()
+            status_code, content, response_headers = timed(
+                recorder, transport, endpoint, sim.expected, method, path, body, content_type, headers
+            )
+            backoff = sim.handle_response(status_code, content, response_headers)
+            pause = max(pause or 0, backoff or 0)
+            if pause:
+                stop.wait(pause)
+    finally:
+        transport.close()
+
+
+async def run_async_worker(sim, recorder, deadline):
+    """
+    Task body for --asgi: same traffic through AsyncClient, so every simulated client is a
+    coroutine on one event loop and requests go through Django's ASGI handler like under daphne.
+    """
+    client = HostAsyncClient()
+    while time.perf_counter() < deadline:
+        endpoint, method, path, body, content_type, headers, pause = sim.next_request()
+        start = time.perf_counter()
+        try:
+            if method == 'POST':
+                response = await client.post(path, data=body, content_type=content_type, headers=headers)
+            else:
+                response = await client.get(path, headers=headers)
+        except Exception as e:
+            recorder.fail(endpoint, e)
+            sim.handle_response(None, None, None)
+        else:
+            # Queries run on sync_to_async threads, out of reach of a per-request QueryTimer
+            recorder.add(endpoint, (time.perf_counter() - start) * 1000, None, response.status_code)
+            check_status(recorder, endpoint, response.status_code, response.content, sim.expected)
+            backoff = sim.handle_response(response.status_code, response.content, response.headers)
+            pause = max(pause or 0, backoff or 0)
+        if pause:
+            await asyncio.sleep(pause)
+        else:
+            # Let the other clients in even when every request is answered from memory
+            await asyncio.sleep(0)
+
+
+async def run_async_workers(sims, recorder, duration):
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(run_async_worker(sim, recorder, deadline) for sim in sims))
+
+
+def report_endpoint(samples, failures, duration):
+    latencies = [latency for latency, _, _ in samples]
+    queries = [count for _, count, _ in samples if count is not None]
+    statuses = {}
+    for _, _, status_code in samples:
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / duration, 2),
+        **summarize(latencies),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "max_ms": round(max(latencies), 3) if latencies else 0.0,
+        "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+        "queries_max": max(queries) if queries else None,
+        "statuses": statuses,
+        "errors": failures,
+    }
+
+
+def compare(report, baseline):
+    """Percent change of throughput and latency per endpoint against an earlier report"""
+    changes = {}
+    for endpoint, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        changes[endpoint] = {
+            key: round((current[key] - previous[key]) / previous[key] * 100, 1) if previous[key] else None
+            for key in ("throughput_rps", "p50_ms", "p99_ms")
+        }
+    return changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed assets, then drive update-marker-positions, get-marker-positions and map-config "
+        "with concurrent simulated detectors and browsers and write a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=200, help="Assets to seed")
+        parser.add_argument('--backgrounds', type=int, default=5, help="AssetBackgrounds to seed")
+        parser.add_argument('--markers', type=int, default=40, help="Markers per detector payload (each writer gets its own)")
+        parser.add_argument('--writers', type=int, default=1, help="Concurrent simulated detectors")
+        parser.add_argument('--readers', type=int, default=8, help="Concurrent simulated browsers")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run")
+        parser.add_argument('--writer-interval', type=float, default=0.0, help="Seconds between detector posts (0 = flat out)")
+        parser.add_argument('--reader-interval', type=float, default=0.0, help="Seconds between browser polls (0 = flat out)")
+        parser.add_argument('--config-every', type=int, default=10, help="Browsers revalidate map-config every N polls")
+        parser.add_argument('--delta', action='store_true', help="Browsers poll with ?since= like the frontend hook")
+        parser.add_argument('--binary', action='store_true', help="Detectors send binary frames instead of JSON")
+        parser.add_argument('--asgi', action='store_true', help="Run the clients as asyncio tasks through the ASGI handler (in-process only)")
+        parser.add_argument('--async-views', action='store_true', help="Use the async views under /api/async/")
+        parser.add_argument('--url', help="Send requests to a running server (e.g. http://localhost:8000) instead of in-process")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for positions")
+        parser.add_argument('--output', help="Write the JSON report here (default: stdout)")
+        parser.add_argument('--baseline', help="Earlier report to compare against")
+        parser.add_argument('--max-regression', type=float, help="Fail if any p99 got worse by more than this many percent")
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded rows in the database")
+
+    def handle(self, *args, **options):
+        if options['writers'] * options['markers'] > options['assets']:
+            raise CommandError("--assets must cover --writers x --markers so every detector has its own markers")
+        if options['asgi'] and options['url']:
+            raise CommandError("--asgi drives the in-process ASGI handler, it cannot be combined with --url")
+
+        random.seed(options['seed'])
+        if options['url']:
+            make_transport = lambda: HttpTransport(options['url'])
+        else:
+            make_transport = InProcessTransport
+
+        # Seed data is committed (the workers use their own connections) and removed again at the end
+        clear_seeded()
+        seed_assets(options['assets'], n_backgrounds=options['backgrounds'])
+        bench_map = None
+        if not Map.objects.exists():
+            bench_map = Map.objects.create(name="bench_map", width=35, height=23)
+
+        prefix = ASYNC_PREFIX if options['async_views'] else API_PREFIX
+        sims = [DetectorSim(i, options, prefix) for i in range(options['writers'])]
+        sims += [BrowserSim(i, options, prefix) for i in range(options['readers'])]
+        recorder = Recorder()
+        stop = threading.Event()
+        threads = [threading.Thread(target=run_worker, args=(sim, make_transport, recorder, stop)) for sim in sims]
+
+        started_at = timezone.now()
+        start = time.perf_counter()
+        try:
+            if options['asgi']:
+                asyncio.run(run_async_workers(sims, recorder, options['duration']))
+            else:
+                for thread in threads:
+                    thread.start()
+                time.sleep(options['duration'])
+        finally:
+            stop.set()
+            for thread in threads:
+                if thread.is_alive():
+                    thread.join()
+            duration = time.perf_counter() - start
+
+            if not options['keep']:
+                clear_seeded()
+                if bench_map is not None:
+                    bench_map.delete()
+            connections.close_all()
+
+        report = {
+            "started_at": started_at.isoformat(),
+            "duration_s": round(duration, 3),
+            "target": options['url'] or ("in-process asgi" if options['asgi'] else "in-process"),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "config": {
+                key: options[key] for key in (
+                    'assets', 'backgrounds', 'markers', 'writers', 'readers', 'writer_interval',
+                    'reader_interval', 'config_every', 'delta', 'binary', 'asgi', 'async_views', 'seed',
+                )
+            },
+            "endpoints": {
+                endpoint: report_endpoint(samples, recorder.failures.get(endpoint, {}), duration)
+                for endpoint, samples in sorted(recorder.samples.items())
+            },
+        }
+        # Endpoints where every request failed still show up
+        for endpoint, failures in recorder.failures.items():
+            report["endpoints"].setdefault(endpoint, report_endpoint([], failures, duration))
+
+        regressions = []
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                report["vs_baseline_pct"] = compare(report, json.load(f))
+            if options['max_regression'] is not None:
+                regressions = [
+                    endpoint for endpoint, change in report["vs_baseline_pct"].items()
+                    if change["p99_ms"] is not None and change["p99_ms"] > options['max_regression']
+                ]
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if regressions:
+            raise CommandError(f"p99 regressed by more than {options['max_regression']}% on: {', '.join(regressions)}")
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ideas.geo import METERS_PER_MILE
+from ideas.spatial import recompute_nearby_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute AssetBackground.nearby_assets_40_miles from the placed assets, in one pass over the spatial index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--radius-miles', type=float, default=None,
+            help="Radius to count within (default NEARBY_RADIUS_MILES)",
+        )
+
+    def handle(self, *args, **options):
+        radius_miles = options['radius_miles'] if options['radius_miles'] is not None else settings.NEARBY_RADIUS_MILES
+        try:
+            changed = recompute_nearby_counts(radius_miles * METERS_PER_MILE)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for type_name, count in sorted(changed.items()):
+            self.stdout.write(f"{type_name}: {count}")
+        self.stdout.write(f"Updated {len(changed)} asset types")
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Map
+from .positions import encode_json
+from .serializers import MapConfigSerializer
+
+# Cached map-config payload. The detector and every converter on the frontend fetch it
+# over and over and it almost never changes, so it is serialized once per map version
+# (pk, config_version, updated_at) and reused:
+#   - within MAP_CONFIG_CACHE_TTL seconds the process-local copy is served with no query at all
+#   - after that, one tiny query checks the version and the copy is kept if it still matches
+#   - optionally the encoded payload is shared through Django's cache (MAP_CONFIG_CACHE_ALIAS)
+# Saving or deleting a Map drops the local copy straight away (see signals.py).
+
+_lock = threading.Lock()
+_entry = None       # dict with key, etag, last_modified, body
+_checked_at = 0.0   # time.monotonic() of the last version check
+
+
+def _version_key(row):
+    pk, config_version, updated_at = row
+    return f"map-{pk}-{config_version}-{updated_at.timestamp()}"
+
+
+def _shared_cache():
+    alias = settings.MAP_CONFIG_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _build_entry(key):
+    map_obj = Map.objects.order_by('pk').first()
+    if map_obj is None:
+        return None
+    return {
+        "key": key,
+        "etag": key,
+        "last_modified": map_obj.updated_at,
+        "body": encode_json(MapConfigSerializer(map_obj).data),
+        # Thresholds for deadband.py, cached along with the rest so ingestion does not query the Map
+        "marker_filter": (map_obj.marker_deadband_cm, map_obj.marker_deadband_degrees, map_obj.marker_coalesce_ms),
+    }
+
+
+def get_map_config():
+    """
+    The current map config as {"etag", "last_modified", "body" (encoded JSON), "marker_filter"},
+    or None when there is no Map.
+    """
+    global _entry, _checked_at
+
+    now = time.monotonic()
+    entry = _entry
+    if entry is not None and now - _checked_at < settings.MAP_CONFIG_CACHE_TTL:
+        return entry
+
+    row = Map.objects.order_by('pk').values_list('pk', 'config_version', 'updated_at').first()
+    if row is None:
+        with _lock:
+            _entry = None
+        return None
+
+    key = _version_key(row)
+    if entry is None or entry["key"] != key:
+        cache = _shared_cache()
+        entry = cache.get(f"ideas:{key}") if cache is not None else None
+        if entry is None:
+            entry = _build_entry(key)
+            if entry is not None and cache is not None:
+                cache.set(f"ideas:{key}", entry, None)
+
+    with _lock:
+        _entry = entry
+        _checked_at = now
+    return entry
+
+
+def cached_map_config():
+    """The local copy if it was checked within MAP_CONFIG_CACHE_TTL, else None. Never queries, so async code can call it"""
+    entry = _entry
+    if entry is not None and time.monotonic() - _checked_at < settings.MAP_CONFIG_CACHE_TTL:
+        return entry
+    return None
+
+
+def invalidate_map_config():
+    """Forget the local copy, the next request re-checks the version"""
+    global _entry
+    with _lock:
+        _entry = None
+
+
+def request_map_config(request):
+    """get_map_config() once per request"""
+    # condition() asks for the etag and last-modified separately, and the view needs the body too
+    if not hasattr(request, '_map_config'):
+        request._map_config = get_map_config()
+    return request._map_config
+
+
+def map_config_etag(request, *args, **kwargs):
+    entry = request_map_config(request)
+    return entry["etag"] if entry else None
+
+
+def map_config_last_modified(request, *args, **kwargs):
+    entry = request_map_config(request)
+    return entry["last_modified"] if entry else None
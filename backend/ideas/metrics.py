@@ -0,0 +1,189 @@
+import bisect
+import collections
+import itertools
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+# Per-view request metrics, filled in by middleware.RequestMetricsMiddleware and
+# rendered in the Prometheus text format by the metrics/ endpoint.
+#
+# Every request records its latency and response size (a couple of perf_counter calls and
+# a dict update). DB query counts and DB time need a hook around every query, so they are
+# only collected for a REQUEST_METRICS_SAMPLE_RATE fraction of requests.
+#
+# Requests slower than REQUEST_METRICS_SLOW_MS end up in a ring buffer (metrics/slow/)
+# together with the stack of the request thread (or task, for async views), grabbed by a watchdog
+# thread while the request was still running, so it shows where the time went rather than where it ended.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+METRIC_PREFIX = 'tangible'
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+def coroutine_stack(coro):
+    """Formatted stack of a coroutine, down the chain of awaits to where it is suspended"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is not None:
+            frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return ''.join(traceback.StackSummary.extract(frames).format())
+
+
+class RequestMetrics:
+    def __init__(self, slow_buffer_size):
+        self._lock = threading.Lock()
+        self.requests = collections.Counter()  # (view, method, status) -> count
+        self.latency = {}                      # view -> Histogram (seconds)
+        self.response_size = {}                # view -> Histogram (bytes)
+        self.db_queries = {}                   # view -> Histogram (queries per request, sampled)
+        self.db_time = {}                      # view -> Histogram (seconds per request, sampled)
+        self.slow_requests = collections.deque(maxlen=slow_buffer_size)
+        self._in_flight = {}                   # request number -> in-flight record, for the watchdog
+        self._request_numbers = itertools.count()
+
+    def _histogram(self, table, view, buckets):
+        histogram = table.get(view)
+        if histogram is None:
+            histogram = table[view] = Histogram(buckets)
+        return histogram
+
+    def observe(self, view, method, status_code, duration, size=None, queries=None, db_time=None):
+        with self._lock:
+            self.requests[(view, method, status_code)] += 1
+            self._histogram(self.latency, view, LATENCY_BUCKETS).observe(duration)
+            if size is not None:
+                self._histogram(self.response_size, view, SIZE_BUCKETS).observe(size)
+            if queries is not None:
+                self._histogram(self.db_queries, view, QUERY_BUCKETS).observe(queries)
+                self._histogram(self.db_time, view, LATENCY_BUCKETS).observe(db_time)
+
+    # Slow request tracking
+
+    def request_started(self, record):
+        """
+        Track a running request: record has its "start" time and either the "thread" or the
+        asyncio "task" running it. Returns the token to pass to request_finished.
+        """
+        token = next(self._request_numbers)
+        self._in_flight[token] = record
+        return token
+
+    def request_finished(self, token):
+        return self._in_flight.pop(token, None)
+
+    def capture_slow_stacks(self, threshold):
+        """Called by the watchdog: grab the stack of every request running longer than threshold seconds"""
+        now = time.perf_counter()
+        frames = None
+        for record in list(self._in_flight.values()):
+            if record.get("stack") is None and now - record["start"] >= threshold:
+                task = record.get("task")
+                if task is not None:
+                    record["stack"] = coroutine_stack(task.get_coro())
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(record["thread"])
+                if frame is not None:
+                    record["stack"] = ''.join(traceback.format_stack(frame))
+
+    def add_slow_request(self, entry):
+        self.slow_requests.append(entry)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                f'# HELP {METRIC_PREFIX}_requests_total Requests handled, by view, method and status',
+                f'# TYPE {METRIC_PREFIX}_requests_total counter',
+            ]
+            for (view, method, status_code), count in sorted(self.requests.items()):
+                lines.append(
+                    f'{METRIC_PREFIX}_requests_total{{view="{view}",method="{method}",status="{status_code}"}} {count}'
+                )
+
+            for table, name, help_text in (
+                (self.latency, 'request_duration_seconds', 'Request latency'),
+                (self.response_size, 'response_size_bytes', 'Response body size (streaming responses are skipped)'),
+                (self.db_queries, 'request_db_queries', 'DB queries per request (sampled requests only)'),
+                (self.db_time, 'request_db_seconds', 'Time spent in DB queries per request (sampled requests only)'),
+            ):
+                lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+                lines.append(f'# TYPE {METRIC_PREFIX}_{name} histogram')
+                for view, histogram in sorted(table.items()):
+                    lines.extend(histogram.render(f'{METRIC_PREFIX}_{name}', f'view="{view}"'))
+
+            lines.append(f'# HELP {METRIC_PREFIX}_slow_requests_buffered Slow requests currently in the ring buffer')
+            lines.append(f'# TYPE {METRIC_PREFIX}_slow_requests_buffered gauge')
+            lines.append(f'{METRIC_PREFIX}_slow_requests_buffered {len(self.slow_requests)}')
+            lines.append(f'# HELP {METRIC_PREFIX}_requests_in_flight Requests being handled right now')
+            lines.append(f'# TYPE {METRIC_PREFIX}_requests_in_flight gauge')
+            lines.append(f'{METRIC_PREFIX}_requests_in_flight {len(self._in_flight)}')
+        return '\n'.join(lines) + '\n'
+
+
+_request_metrics = None
+_request_metrics_lock = threading.Lock()
+
+
+def _watch_slow_requests(metrics, threshold):
+    # Check twice per threshold so a stack is taken at most half a threshold late
+    interval = max(threshold / 2, 0.01)
+    while True:
+        time.sleep(interval)
+        try:
+            metrics.capture_slow_stacks(threshold)
+        except Exception:
+            logger.exception("Slow request watchdog failed")
+
+
+def get_request_metrics():
+    """The process-wide RequestMetrics (created on first use, with its slow request watchdog)"""
+    global _request_metrics
+    if _request_metrics is None:
+        with _request_metrics_lock:
+            if _request_metrics is None:
+                metrics = RequestMetrics(settings.REQUEST_METRICS_SLOW_BUFFER_SIZE)
+                threading.Thread(
+                    target=_watch_slow_requests,
+                    args=(metrics, settings.REQUEST_METRICS_SLOW_MS / 1000),
+                    daemon=True,
+                ).start()
+                _request_metrics = metrics
+    return _request_metrics
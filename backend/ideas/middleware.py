@@ -0,0 +1,101 @@
+import asyncio
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .metrics import get_request_metrics
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.queries += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per-view latency, response size and (for sampled requests) DB query count and time.
+    Enabled with REQUEST_METRICS=True, see metrics.py for what ends up where.
+    Works both ways round so async views stay async under ASGI. Their queries run in a shared
+    sync thread where a per-request hook cannot tell requests apart, so they are not sampled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.metrics = get_request_metrics()
+        self.sample_rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        self.slow_threshold = settings.REQUEST_METRICS_SLOW_MS / 1000
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        timer = QueryTimer() if sampled else None
+        record = {"start": time.perf_counter(), "stack": None, "thread": threading.get_ident()}
+        token = self.metrics.request_started(record)
+        try:
+            if timer is not None:
+                with connection.execute_wrapper(timer):
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            self.metrics.request_finished(token)
+        return self.finish(request, response, record, timer)
+
+    async def __acall__(self, request):
+        record = {"start": time.perf_counter(), "stack": None, "task": asyncio.current_task()}
+        token = self.metrics.request_started(record)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.metrics.request_finished(token)
+        return self.finish(request, response, record, None)
+
+    def finish(self, request, response, record, timer):
+        duration = time.perf_counter() - record["start"]
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        self.metrics.observe(
+            view, request.method, response.status_code, duration, size,
+            queries=timer.queries if timer else None,
+            db_time=timer.duration if timer else None,
+        )
+
+        if duration >= self.slow_threshold:
+            self.metrics.add_slow_request({
+                "at": timezone.now().isoformat(),
+                "view": view,
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 3),
+                "queries": timer.queries if timer else None,
+                "db_ms": round(timer.duration * 1000, 3) if timer else None,
+                # None if the request finished before the watchdog got to it
+                "stack": record["stack"],
+            })
+        return response
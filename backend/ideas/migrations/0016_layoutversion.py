@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:26
+
+from django.db import migrations, models
+
+
+def create_layout_version(apps, schema_editor):
+    """
+    Create the single LayoutVersion row so writers can always bump it with an UPDATE
+    """
+    LayoutVersion = apps.get_model('ideas', 'LayoutVersion')
+    LayoutVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0015_populate_icon_paths'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_layout_version, migrations.RunPython.noop),
+    ]
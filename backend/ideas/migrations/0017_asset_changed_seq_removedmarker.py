@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0016_layoutversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemovedMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marker_id', models.IntegerField()),
+                ('seq', models.PositiveBigIntegerField(db_index=True)),
+                ('removed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='changed_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0017_asset_changed_seq_removedmarker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarkerPositionSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('marker_id', models.IntegerField()),
+                ('x_pos', models.FloatField()),
+                ('y_pos', models.FloatField()),
+                ('rotation', models.FloatField(default=0.0)),
+                ('resolution', models.PositiveIntegerField(default=0)),
+                ('map', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='position_samples', to='ideas.map')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['map', 'timestamp'], name='ideas_sample_map_time_idx'), models.Index(fields=['resolution', 'timestamp'], name='ideas_sample_res_time_idx')],
+            },
+        ),
+    ]
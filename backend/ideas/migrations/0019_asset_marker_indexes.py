@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0018_markerpositionsample'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['marker_id'], name='ideas_asset_marker_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(condition=models.Q(('marker_id', 999), _negated=True), fields=['changed_seq'], name='ideas_asset_placed_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(condition=models.Q(('marker_id', 999), _negated=True), fields=['marker_id'], name='ideas_asset_placed_marker_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0019_asset_marker_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='map',
+            name='marker_coalesce_ms',
+            field=models.FloatField(default=200.0, help_text='Updates to a marker within this many ms of its last write are merged into one write, 0 to turn off'),
+        ),
+        migrations.AddField(
+            model_name='map',
+            name='marker_deadband_cm',
+            field=models.FloatField(default=0.1, help_text='Marker moves smaller than this (cm) are ignored, 0 to keep every move'),
+        ),
+        migrations.AddField(
+            model_name='map',
+            name='marker_deadband_degrees',
+            field=models.FloatField(default=2.0, help_text='Rotation changes smaller than this (degrees) are ignored, 0 to keep every change'),
+        ),
+    ]
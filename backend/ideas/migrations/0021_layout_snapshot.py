@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0020_map_marker_filter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('data', models.BinaryField()),
+                ('asset_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('map', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='ideas.map')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
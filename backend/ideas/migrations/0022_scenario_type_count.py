@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_placed_assets(apps, schema_editor):
+    """
+    Fill in the counts for the assets that are already placed, from then on the Asset signals keep them up to date
+    """
+    Map = apps.get_model('ideas', 'Map')
+    Asset = apps.get_model('ideas', 'Asset')
+    ScenarioTypeCount = apps.get_model('ideas', 'ScenarioTypeCount')
+
+    map_obj = Map.objects.order_by('pk').first()
+    if map_obj is None:
+        return
+    counts = (
+        Asset.objects.filter(marker_id__isnull=False).exclude(marker_id=999)
+        .values('type').annotate(count=models.Count('id'))
+    )
+    ScenarioTypeCount.objects.bulk_create([
+        ScenarioTypeCount(map=map_obj, background_id=row['type'], count=row['count']) for row in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0021_layout_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScenarioTypeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('background', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scenario_counts', to='ideas.assetbackground')),
+                ('map', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='type_counts', to='ideas.map')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('map', 'background'), name='ideas_scenario_type_count_unique')],
+            },
+        ),
+        migrations.RunPython(count_placed_assets, migrations.RunPython.noop),
+    ]
@@ -20,9 +20,21 @@ class Asset(models.Model):
     in_map = models.BooleanField(default=False)
 
     info = models.JSONField(default=dict, blank=True, null=True) # where basic information is stored, can make into fields later after we know what we need
+
+    changed_seq = models.PositiveBigIntegerField(default=0, editable=False) # layout version of the last change to this asset, for ?since= deltas
     
     # Do we need other fields?
 
+    class Meta:
+        indexes = [
+            # updateMarkerPositions looks assets up by marker_id on every detector post
+            models.Index(fields=['marker_id'], name='ideas_asset_marker_idx'),
+            # Full get-marker-positions reads only want placed assets (999 = no marker), usually a small part of the table
+            models.Index(fields=['marker_id'], name='ideas_asset_placed_marker_idx', condition=~models.Q(marker_id=999)),
+            # get-marker-positions ?since= deltas only ever look at placed assets
+            models.Index(fields=['changed_seq'], name='ideas_asset_placed_seq_idx', condition=~models.Q(marker_id=999)),
+        ]
+
     def __str__(self):
         return f"{self.type.type_name}_{self.marker_id}"
 
@@ -43,6 +55,11 @@ class Map(models.Model):
     bottom_left_lat = models.FloatField(default=0.0, help_text="Bottom-left corner latitude")
     bottom_left_lng = models.FloatField(default=0.0, help_text="Bottom-left corner longitude")
     
+    # Filtering of detector updates (see deadband.py)
+    marker_deadband_cm = models.FloatField(default=0.1, help_text="Marker moves smaller than this (cm) are ignored, 0 to keep every move")
+    marker_deadband_degrees = models.FloatField(default=2.0, help_text="Rotation changes smaller than this (degrees) are ignored, 0 to keep every change")
+    marker_coalesce_ms = models.FloatField(default=200.0, help_text="Updates to a marker within this many ms of its last write are merged into one write, 0 to turn off")
+
     config_version = models.CharField(max_length=50, default="1.0", help_text="Version identifier for configuration changes")
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -90,4 +107,81 @@ class AssetBackground(models.Model):
     def __str__(self):
         #return f"Background for {self.asset}"
         return self.type_name
-    
\ No newline at end of file
+    
+
+# Single row counter that goes up every time something the marker endpoints return changes.
+# Used as the ETag for get-marker-positions so polling clients can get a 304 without reading Asset
+class LayoutVersion(models.Model):
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"layout v{self.version}"
+
+
+# Marker ids that disappeared from get-marker-positions (asset deleted or marker unassigned),
+# so ?since= deltas can tell clients to drop them. Old rows are pruned, see MARKER_DELTA_MAX_AGE
+class RemovedMarker(models.Model):
+    marker_id = models.IntegerField()
+    seq = models.PositiveBigIntegerField(db_index=True)
+    removed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"marker {self.marker_id} removed at v{self.seq}"
+
+
+# Append-only history of marker positions, written in batches by ideas/history.py.
+# resolution is the bucket size in seconds: 0 = raw detector samples, older rows get
+# downsampled to 1 s and then 60 s buckets (one row per marker per bucket)
+class MarkerPositionSample(models.Model):
+    map = models.ForeignKey(Map, on_delete=models.CASCADE, null=True, blank=True, related_name='position_samples')
+    timestamp = models.DateTimeField()
+    marker_id = models.IntegerField()
+    x_pos = models.FloatField()
+    y_pos = models.FloatField()
+    rotation = models.FloatField(default=0.0)
+    resolution = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['map', 'timestamp'], name='ideas_sample_map_time_idx'),
+            models.Index(fields=['resolution', 'timestamp'], name='ideas_sample_res_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"marker {self.marker_id} at {self.timestamp}"
+
+
+# A saved layout ("scenario A") of every asset on a map, see ideas/snapshots.py.
+# The positions live in one packed blob (asset id, x, y, rotation, flags per asset) so saving
+# and restoring a scenario is one row read or written, whatever the number of assets
+class LayoutSnapshot(models.Model):
+    map = models.ForeignKey(Map, on_delete=models.CASCADE, null=True, blank=True, related_name='snapshots')
+    name = models.CharField(max_length=200)
+    data = models.BinaryField()
+    asset_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
+
+
+# How many placed assets of each type a map has, kept up to date by the Asset signals (ideas/totals.py)
+# so the scenario totals are a read over a handful of type rows instead of a join over every Asset.
+# Cost and carbon are not stored here: count * the background's current value, so editing a cost needs no update
+class ScenarioTypeCount(models.Model):
+    map = models.ForeignKey(Map, on_delete=models.CASCADE, related_name='type_counts')
+    background = models.ForeignKey(AssetBackground, on_delete=models.CASCADE, related_name='scenario_counts')
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['map', 'background'], name='ideas_scenario_type_count_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.background} x{self.count}"
@@ -0,0 +1,114 @@
+import json
+
+from django.http import HttpResponse
+
+from .models import Asset, RemovedMarker
+
+# Read path for marker positions: a single joined projection plus a plain JSON encoder,
+# so the polling endpoint never instantiates Asset/AssetBackground objects
+
+# (column, key in the response) - the join to AssetBackground happens through type__*
+POSITION_COLUMNS = (
+    ('marker_id', 'id'),
+    ('x_pos', 'x'),
+    ('y_pos', 'y'),
+    ('rotation', 'rotation'),
+    ('name', 'asset_name'),
+    ('type__type_name', 'asset_type'),
+    ('type__icon_path', 'icon_path'),
+    ('physical_width', 'physical_width'),
+    ('physical_height', 'physical_height'),
+)
+POSITION_FIELDS = tuple(column for column, _ in POSITION_COLUMNS)
+POSITION_KEYS = tuple(key for _, key in POSITION_COLUMNS)
+
+# Built once and reused, compact separators and no circular reference checks
+# since the payload is only ever lists of flat dicts
+_encoder = json.JSONEncoder(separators=(',', ':'), check_circular=False, ensure_ascii=False)
+
+
+UNASSIGNED_MARKER_ID = 999  # Asset.marker_id default, means "no marker"
+
+
+def is_placed_marker(marker_id):
+    return marker_id is not None and marker_id != UNASSIGNED_MARKER_ID
+
+
+def placed_assets():
+    """Assets that have a real marker attached (999 is the 'no marker' default)"""
+    return Asset.objects.filter(marker_id__isnull=False).exclude(marker_id=UNASSIGNED_MARKER_ID)
+
+
+def position_row_to_dict(row):
+    """Turn one values_list row into the dict shape the frontend expects"""
+    position = dict(zip(POSITION_KEYS, row))
+    # Empty icon paths are reported as null, same as before
+    position['icon_path'] = position['icon_path'] or None
+    return position
+
+
+def marker_positions(queryset=None):
+    """List of marker position dicts, loaded with one query"""
+    if queryset is None:
+        queryset = placed_assets()
+    return [position_row_to_dict(row) for row in queryset.values_list(*POSITION_FIELDS)]
+
+
+def marker_positions_since(since):
+    """
+    Positions of assets changed after layout version `since`, plus the marker ids that
+    left the layout since then (and did not come back).
+    """
+    changed = marker_positions(placed_assets().filter(changed_seq__gt=since))
+    changed_ids = {position['id'] for position in changed}
+    removed = sorted(
+        set(RemovedMarker.objects.filter(seq__gt=since).values_list('marker_id', flat=True))
+        - changed_ids
+    )
+    return changed, removed
+
+
+def asset_positions(queryset=None):
+    """{asset id: position dict}, for callers that need to tell apart assets sharing a marker"""
+    if queryset is None:
+        queryset = placed_assets()
+    return {pk: position_row_to_dict(row) for pk, *row in queryset.values_list('id', *POSITION_FIELDS)}
+
+
+def asset_positions_since(since):
+    """
+    asset_positions() of the assets changed after layout version `since`, plus {marker_id: {asset ids
+    still placed with it}} for the marker ids that left the layout since then (another asset can still carry one)
+    """
+    changed = asset_positions(placed_assets().filter(changed_seq__gt=since))
+    removed = {marker_id: set() for marker_id in RemovedMarker.objects.filter(seq__gt=since).values_list('marker_id', flat=True)}
+    if removed:
+        for marker_id, pk in placed_assets().filter(marker_id__in=list(removed)).values_list('marker_id', 'id'):
+            removed[marker_id].add(pk)
+    return changed, removed
+
+
+async def amarker_positions(queryset=None):
+    """marker_positions() with the async ORM"""
+    if queryset is None:
+        queryset = placed_assets()
+    return [position_row_to_dict(row) async for row in queryset.values_list(*POSITION_FIELDS)]
+
+
+async def amarker_positions_since(since):
+    """marker_positions_since() with the async ORM"""
+    changed = await amarker_positions(placed_assets().filter(changed_seq__gt=since))
+    changed_ids = {position['id'] for position in changed}
+    removed_ids = {
+        marker_id async for marker_id in RemovedMarker.objects.filter(seq__gt=since).values_list('marker_id', flat=True)
+    }
+    return changed, sorted(removed_ids - changed_ids)
+
+
+def encode_json(data):
+    return _encoder.encode(data)
+
+
+def json_response(data, status=200):
+    """HttpResponse with pre-encoded JSON, skipping DRF's renderer negotiation"""
+    return HttpResponse(encode_json(data), content_type='application/json', status=status)
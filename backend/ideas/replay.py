@@ -0,0 +1,135 @@
+import math
+import time
+
+from django.db.models import Max
+
+from .models import MarkerPositionSample
+from .positions import encode_json
+
+# Session replay: turns MarkerPositionSample rows into a stream of NDJSON frames.
+# Rows come off a server-side cursor (QuerySet.iterator) and frames are yielded as they
+# are built, so replaying hours of history never holds more than one chunk in memory.
+#
+# Each line is one frame: {"t": epoch seconds, "offset": seconds since start, "markers": [{id, x, y, rotation}]}
+# A frame only lists the markers that moved during it, clients keep the last known position of the rest.
+# So a replay starting mid-session has something to keep, the first line is a keyframe
+# ({"keyframe": true, offset 0}) with every marker's last recorded position before start.
+
+CURSOR_CHUNK_SIZE = 2000
+UNPACED_FLUSH_BYTES = 64 * 1024  # when not pacing, send lines in chunks of roughly this size
+
+
+def replay_samples(start, end, map_id=None):
+    samples = MarkerPositionSample.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if map_id is not None:
+        samples = samples.filter(map_id=map_id)
+    return (
+        samples.order_by('timestamp', 'id')
+        .values_list('timestamp', 'marker_id', 'x_pos', 'y_pos', 'rotation')
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+
+
+def replay_keyframe(start, map_id=None):
+    """{marker_id: (x, y, rotation)} as of start: each marker's latest sample before it"""
+    before = MarkerPositionSample.objects.filter(timestamp__lt=start)
+    if map_id is not None:
+        before = before.filter(map_id=map_id)
+    latest = dict(before.values('marker_id').annotate(latest=Max('timestamp')).values_list('marker_id', 'latest'))
+    if not latest:
+        return {}
+
+    # One grouped query for the times, one for the rows; other markers' rows at the same times are skipped
+    rows = (
+        before.filter(marker_id__in=list(latest), timestamp__in=set(latest.values()))
+        .order_by('timestamp', 'id')
+        .values_list('timestamp', 'marker_id', 'x_pos', 'y_pos', 'rotation')
+    )
+    keyframe = {}
+    for timestamp, marker_id, x_pos, y_pos, rotation in rows:
+        if latest[marker_id] == timestamp:
+            keyframe[marker_id] = (x_pos, y_pos, rotation)
+    return dict(sorted(keyframe.items()))
+
+
+def replay_frames(rows, start, fps=None):
+    """
+    Group (timestamp, marker_id, x, y, rotation) rows into frames.
+    With fps, rows are bucketed into 1/fps second frames and each marker keeps its last
+    position in the frame (so 10 fps of a 30 fps recording drops two of every three samples).
+    Without fps every distinct timestamp is a frame.
+    Yields (frame time as epoch seconds, {marker_id: (x, y, rotation)}).
+    """
+    start_epoch = start.timestamp()
+    frame_length = 1.0 / fps if fps else None
+
+    frame_key = None
+    frame_time = None
+    markers = {}
+    for timestamp, marker_id, x_pos, y_pos, rotation in rows:
+        epoch = timestamp.timestamp()
+        if frame_length:
+            # Nudge by a microsecond so samples sitting exactly on a frame boundary don't fall back a frame
+            key = math.floor((epoch - start_epoch + 1e-6) / frame_length)
+        else:
+            key = epoch
+
+        if key != frame_key:
+            if markers:
+                yield frame_time, markers
+            frame_key = key
+            frame_time = start_epoch + key * frame_length if frame_length else epoch
+            markers = {}
+        markers[marker_id] = (x_pos, y_pos, rotation)
+
+    if markers:
+        yield frame_time, markers
+
+
+def replay_stream(start, end, map_id=None, fps=None, speed=None):
+    """
+    NDJSON lines for a replay. With speed (e.g. 1.0 = real time, 4.0 = four times faster)
+    frames are paced by sleeping between them; without it they are sent as fast as possible.
+    """
+    start_epoch = start.timestamp()
+    keyframe = replay_keyframe(start, map_id)
+    frames = replay_frames(replay_samples(start, end, map_id), start, fps)
+
+    if speed:
+        if keyframe:
+            yield _encode_frame(start_epoch, 0.0, keyframe, keyframe=True)
+        wall_start = time.monotonic()
+        for frame_time, markers in frames:
+            offset = frame_time - start_epoch
+            delay = offset / speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+            yield _encode_frame(frame_time, offset, markers)
+        return
+
+    pending = [_encode_frame(start_epoch, 0.0, keyframe, keyframe=True)] if keyframe else []
+    pending_bytes = sum(len(line) for line in pending)
+    for frame_time, markers in frames:
+        line = _encode_frame(frame_time, frame_time - start_epoch, markers)
+        pending.append(line)
+        pending_bytes += len(line)
+        if pending_bytes >= UNPACED_FLUSH_BYTES:
+            yield ''.join(pending)
+            pending = []
+            pending_bytes = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def _encode_frame(frame_time, offset, markers, keyframe=False):
+    frame = {
+        "t": round(frame_time, 3),
+        "offset": round(offset, 3),
+        "markers": [
+            {"id": marker_id, "x": x_pos, "y": y_pos, "rotation": rotation}
+            for marker_id, (x_pos, y_pos, rotation) in markers.items()
+        ],
+    }
+    if keyframe:
+        frame["keyframe"] = True
+    return encode_json(frame) + '\n'
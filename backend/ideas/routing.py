@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import MarkerConsumer
+
+websocket_urlpatterns = [
+    path('ws/markers/', MarkerConsumer.as_asgi(), name='marker-stream'),
+]
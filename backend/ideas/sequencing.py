@@ -0,0 +1,96 @@
+import threading
+import time
+
+from django.conf import settings
+
+# Ordering of marker updates from several senders.
+# Every batch carries a source id, the capture timestamp of its camera frame and a per-source
+# sequence number (JSON envelope or binary frame header, see ingest.parse_marker_request).
+# For each marker we remember the batch that last moved it, in memory, and drop updates that
+# are older than that, so a retried request or a slower second detector can never put a
+# marker back where it was. Like the live state this assumes a single backend process.
+#
+# Across sources the capture timestamp decides (the detectors' clocks need to be in sync to
+# within a frame or so); within a source the sequence number breaks ties. A source whose
+# sequence number goes down while its timestamps go up has restarted and is accepted again.
+# Batches without a capture time (binary frames with timestamp 0, bare lists) are stamped with
+# their arrival time, which a retry always has newer, so for those the sequence number alone
+# decides: the same or a lower seq is a retry, unless the source has been quiet for
+# UNSTAMPED_RESTART_SECONDS, which is a restarted detector counting from 1 again.
+
+DEFAULT_SOURCE = 'default'
+UNSTAMPED_RESTART_SECONDS = 10.0
+
+
+def batch_info(source=None, seq=None, timestamp=None, confidence=None):
+    """
+    The {"source", "seq", "timestamp", "confidence"} dict that travels with a batch of parsed
+    updates. confidence is {marker_id: 0-1} for detectors that rate their observations (fusion.py).
+    """
+    return {"source": source or DEFAULT_SOURCE, "seq": seq, "timestamp": timestamp, "confidence": confidence or {}}
+
+
+def stamp_batch(batch, now=None):
+    """
+    The timestamp to order a batch by, also stored back on it: its capture time, clamped so a
+    clock running ahead cannot shadow every other sender. Unstamped batches get the arrival time,
+    with batch["captured"] False so sequencing does not trust it.
+    """
+    if now is None:
+        now = time.time()
+    batch["captured"] = bool(batch["timestamp"])
+    timestamp = batch["timestamp"] or now
+    batch["timestamp"] = min(timestamp, now + settings.MARKER_MAX_CLOCK_SKEW)
+    return batch["timestamp"]
+
+
+class MarkerSequencer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._marks = {}    # marker_id -> (timestamp, source, seq) of the batch that last updated it
+        self._sources = {}  # source -> (seq, timestamp) of its newest batch
+
+    def is_new_batch(self, batch):
+        """False for a retry or a batch overtaken by a later one from the same source, nothing in those can be newer"""
+        source, seq, timestamp = batch["source"], batch["seq"], batch["timestamp"]
+        if seq is None:
+            return True
+        with self._lock:
+            last = self._sources.get(source)
+            if last is not None and seq <= last[0]:
+                if batch.get("captured", True):
+                    if timestamp <= last[1]:
+                        return False
+                elif timestamp - last[1] < UNSTAMPED_RESTART_SECONDS:
+                    # The timestamp is only when it arrived, a retry of an old seq always looks newer
+                    return False
+            self._sources[source] = (seq, timestamp)
+        return True
+
+    def marks(self, marker_ids):
+        """{marker_id: (timestamp, source, seq)} of the batch that last updated each marker, for the ones that have one"""
+        with self._lock:
+            return {marker_id: self._marks[marker_id] for marker_id in marker_ids if marker_id in self._marks}
+
+    def admit(self, updates, batch, timestamps=None):
+        """
+        Split {marker_id: (x, y, rotation)} from a stamped batch into the updates that are newer
+        than what was already applied for each marker. timestamps overrides the batch timestamp
+        per marker (fused positions are as new as their newest observation).
+        Returns (fresh updates, number of stale ones dropped).
+        """
+        source, seq = batch["source"], batch["seq"]
+        fresh = {}
+        with self._lock:
+            marks = self._marks
+            for marker_id, update in updates.items():
+                timestamp = timestamps.get(marker_id, batch["timestamp"]) if timestamps else batch["timestamp"]
+                mark = marks.get(marker_id)
+                if mark is not None and (
+                    timestamp < mark[0]
+                    or (timestamp == mark[0] and source == mark[1] and seq is not None and mark[2] is not None and seq <= mark[2])
+                ):
+                    continue
+                fresh[marker_id] = update
+                marks[marker_id] = (timestamp, source, seq)
+        return fresh, len(updates) - len(fresh)
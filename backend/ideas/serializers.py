@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Asset, Map, AssetInMap
+from .models import Asset, Map, AssetInMap, LayoutSnapshot
 
 
 class AssetSerializer(serializers.ModelSerializer):
@@ -30,4 +30,11 @@ class AssetInMapSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = AssetInMap
-        fields = '__all__' 
\ No newline at end of file
+        fields = '__all__'
+
+
+class LayoutSnapshotSerializer(serializers.ModelSerializer):
+    """Snapshot without its packed data"""
+    class Meta:
+        model = LayoutSnapshot
+        fields = ['id', 'name', 'map', 'asset_count', 'created_at']
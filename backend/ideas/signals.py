@@ -0,0 +1,147 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .broadcast import publish_layout_change
+from .catalog import invalidate_asset_catalog
+from .ingest import forget_marker_positions
+from .mapconfig import invalidate_map_config
+from .models import Asset, AssetBackground, AssetInMap, Map
+from .positions import is_placed_marker, placed_assets
+from .totals import asset_maps, asset_placements, check_scenario_totals, move_placements, placement
+from .versioning import bump_layout_version, record_removed_marker, refresh_live_state
+
+# Anything that goes through save()/delete() (admin edits, updateCoordinates, shell)
+# bumps the layout version, stamps what changed and publishes it. Bulk writes skip signals and do it themselves.
+
+
+@receiver(pre_save, sender=Asset)
+def asset_changing(sender, instance, **kwargs):
+    seq = bump_layout_version()
+    instance.changed_seq = seq
+
+    # Which (map, type) counts the asset added to before this save, for the scenario totals
+    instance._placement_before = frozenset()
+    if instance.pk is None:
+        return
+    old = Asset.objects.filter(pk=instance.pk).values_list('marker_id', 'type_id').first()
+    if old is None:
+        return
+    old_marker_id, old_type_id = old
+    instance._placement_before = placement(old_marker_id, old_type_id, asset_maps([instance.pk])[instance.pk])
+    # If the marker id changed, the old one is gone from get-marker-positions
+    if is_placed_marker(old_marker_id) and old_marker_id != instance.marker_id:
+        record_removed_marker(old_marker_id, seq)
+
+
+@receiver(post_save, sender=Asset)
+def asset_saved(sender, instance, **kwargs):
+    after = placement(instance.marker_id, instance.type_id, asset_maps([instance.pk])[instance.pk])
+    move_placements({instance.pk: getattr(instance, '_placement_before', frozenset())}, {instance.pk: after})
+    if instance.marker_id is not None:
+        # Moved by hand, the detector's next report of the token is not jitter around the old spot
+        forget_marker_positions([instance.marker_id])
+    publish_layout_change(instance.changed_seq)
+    refresh_live_state()
+
+
+@receiver(pre_delete, sender=Asset)
+def asset_deleting(sender, instance, **kwargs):
+    # Its AssetInMap rows are gone by post_delete, so read the maps it counted towards now
+    instance._placement_before = asset_placements([instance.pk]).get(instance.pk, frozenset())
+
+
+@receiver(post_delete, sender=Asset)
+def asset_deleted(sender, instance, **kwargs):
+    seq = bump_layout_version()
+    if is_placed_marker(instance.marker_id):
+        record_removed_marker(instance.marker_id, seq)
+    move_placements({instance.pk: getattr(instance, '_placement_before', frozenset())}, {})
+    publish_layout_change(seq)
+    refresh_live_state()
+
+
+@receiver(post_save, sender=AssetBackground)
+def background_saved(sender, instance, **kwargs):
+    invalidate_asset_catalog()
+    # type_name / icon_path are part of every asset's position entry
+    seq = bump_layout_version()
+    instance.assets.update(changed_seq=seq)
+    publish_layout_change(seq)
+    refresh_live_state()
+
+
+@receiver(post_delete, sender=AssetBackground)
+def background_deleted(sender, **kwargs):
+    invalidate_asset_catalog()
+    bump_layout_version()
+
+
+@receiver(post_save, sender=Map)
+@receiver(post_delete, sender=Map)
+def map_changed(sender, **kwargs):
+    invalidate_map_config()
+    # Positions carry lat/lng from the map corners, so every placed asset changed
+    seq = bump_layout_version()
+    placed_assets().update(changed_seq=seq)
+    publish_layout_change(seq)
+    refresh_live_state()
+
+
+@receiver(post_save, sender=Map)
+def map_created(sender, instance, created, **kwargs):
+    # The first map gets the counts of the assets already placed
+    if created:
+        check_scenario_totals(fix=True)
+
+
+@receiver(post_delete, sender=Map)
+def map_deleted(sender, **kwargs):
+    # Its counts went with it, and if it was the first map the unmapped assets count towards another one now
+    check_scenario_totals(fix=True)
+
+
+@receiver(m2m_changed, sender=AssetInMap.assets.through)
+def asset_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Putting an asset in a map or taking it out moves its scenario counts, the Asset signals never see it
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        if reverse:
+            asset_ids = [instance.pk]
+        elif pk_set is None:
+            asset_ids = list(instance.assets.values_list('pk', flat=True))
+        else:
+            asset_ids = list(pk_set)
+        instance._placements_before = asset_placements(asset_ids)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        before = getattr(instance, '_placements_before', {})
+        move_placements(before, asset_placements(before))
+
+
+@receiver(pre_save, sender=AssetInMap)
+def asset_in_map_changing(sender, instance, **kwargs):
+    instance._placements_before = None
+    if instance.pk is not None:
+        old_map_id = AssetInMap.objects.filter(pk=instance.pk).values_list('map_id', flat=True).first()
+        if old_map_id is not None and old_map_id != instance.map_id:
+            instance._placements_before = asset_placements(instance.assets.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=AssetInMap)
+def asset_in_map_saved(sender, instance, **kwargs):
+    # Moved to another map: its assets' counts go with it
+    before = getattr(instance, '_placements_before', None)
+    if before:
+        move_placements(before, asset_placements(before))
+
+
+@receiver(pre_delete, sender=AssetInMap)
+def asset_in_map_deleting(sender, instance, **kwargs):
+    instance._placements_before = asset_placements(instance.assets.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=AssetInMap)
+def asset_in_map_deleted(sender, instance, **kwargs):
+    # Deleted along with its map: map_deleted recounts everything
+    if not Map.objects.filter(pk=instance.map_id).exists():
+        return
+    before = getattr(instance, '_placements_before', {})
+    move_placements(before, asset_placements(before))
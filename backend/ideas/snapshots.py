@@ -0,0 +1,165 @@
+import zlib
+
+import numpy as np
+from django.db import transaction
+
+from .broadcast import publish_layout_change
+from .history import get_history_writer
+from .ingest import forget_marker_positions
+from .live import get_live_state
+from .models import Asset, LayoutSnapshot, Map
+from .versioning import bump_layout_version, refresh_live_state
+
+# Layout snapshots: save every asset's position, rotation and in_map/in_understand flags as one
+# packed blob, restore it with one bulk_update, diff two layouts with a few NumPy ops.
+#
+# Blob: one format byte, then zlib of a little-endian record array sorted by asset id
+#   uint32 asset id | float64 x | float64 y | float64 rotation | uint8 flags (1 = in_map, 2 = in_understand)
+# Positions are kept as float64 so a restore puts assets back exactly where they were.
+
+FORMAT_VERSION = 1
+SNAPSHOT_DTYPE = np.dtype([('id', '<u4'), ('x', '<f8'), ('y', '<f8'), ('rotation', '<f8'), ('flags', 'u1')])
+IN_MAP = 1
+IN_UNDERSTAND = 2
+
+POSITION_FIELDS = ['x_pos', 'y_pos', 'rotation']
+FLAG_FIELDS = ['in_map', 'in_understand']
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def pack_layout(records):
+    return bytes([FORMAT_VERSION]) + zlib.compress(records.tobytes())
+
+
+def unpack_layout(blob):
+    blob = bytes(blob)
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise SnapshotFormatError("Unknown snapshot format")
+    raw = zlib.decompress(blob[1:])
+    if len(raw) % SNAPSHOT_DTYPE.itemsize:
+        raise SnapshotFormatError("Snapshot data is truncated")
+    return np.frombuffer(raw, dtype=SNAPSHOT_DTYPE)
+
+
+def current_layout():
+    """(records, {asset id: marker_id}) of every asset as it is in the db now, sorted by id"""
+    rows = list(
+        Asset.objects.order_by('id')
+        .values_list('id', 'x_pos', 'y_pos', 'rotation', 'in_map', 'in_understand', 'marker_id')
+    )
+    records = np.array(
+        [(pk, x, y, rotation, (IN_MAP if in_map else 0) | (IN_UNDERSTAND if in_understand else 0))
+         for pk, x, y, rotation, in_map, in_understand, _ in rows],
+        dtype=SNAPSHOT_DTYPE,
+    )
+    return records, {row[0]: row[6] for row in rows}
+
+
+def _flush_live_state():
+    # Positions the live state has not written yet would win over what we read or restore
+    live = get_live_state()
+    if live is not None:
+        live.flush()
+
+
+def layout_now():
+    """Records of the current layout, including positions the live state has not written yet"""
+    _flush_live_state()
+    return current_layout()[0]
+
+
+def capture_snapshot(name, map_obj=None):
+    if map_obj is None:
+        # Single map for now, same as getMapConfig
+        map_obj = Map.objects.order_by('pk').first()
+    records = layout_now()
+    return LayoutSnapshot.objects.create(map=map_obj, name=name, data=pack_layout(records), asset_count=len(records))
+
+
+def diff_layouts(old, new):
+    """
+    What changes going from layout old to layout new (record arrays sorted by id):
+    {"moved": ids with a different position or rotation, "flags_changed": ids whose in_map or
+    in_understand differ, "added": ids only in new, "removed": ids only in old}
+    """
+    _, old_index, new_index = np.intersect1d(old['id'], new['id'], assume_unique=True, return_indices=True)
+    before = old[old_index]
+    after = new[new_index]
+    moved = (before['x'] != after['x']) | (before['y'] != after['y']) | (before['rotation'] != after['rotation'])
+    flags_changed = before['flags'] != after['flags']
+    return {
+        "moved": after['id'][moved].tolist(),
+        "flags_changed": after['id'][flags_changed].tolist(),
+        "added": np.setdiff1d(new['id'], old['id'], assume_unique=True).tolist(),
+        "removed": np.setdiff1d(old['id'], new['id'], assume_unique=True).tolist(),
+    }
+
+
+def layout_entries(records):
+    """Records as a list of dicts for the API"""
+    return [
+        {
+            "asset": pk, "x": x, "y": y, "rotation": rotation,
+            "in_map": bool(flags & IN_MAP), "in_understand": bool(flags & IN_UNDERSTAND),
+        }
+        for pk, x, y, rotation, flags in records.tolist()
+    ]
+
+
+def restore_snapshot(snapshot):
+    """
+    Put every asset that still exists back where the snapshot has it, with one bulk_update of
+    only the rows that differ. Assets created after the snapshot are left alone.
+    Returns {"restored", "unchanged", "missing" (assets deleted since), "seq"}.
+    """
+    target = unpack_layout(snapshot.data)
+    _flush_live_state()
+
+    with transaction.atomic():
+        current, marker_ids = current_layout()
+        _, target_index, current_index = np.intersect1d(
+            target['id'], current['id'], assume_unique=True, return_indices=True,
+        )
+        wanted = target[target_index]
+        now = current[current_index]
+        repositioned = (wanted['x'] != now['x']) | (wanted['y'] != now['y']) | (wanted['rotation'] != now['rotation'])
+        flags_changed = wanted['flags'] != now['flags']
+        changed = wanted[repositioned | flags_changed]
+        # Every field is one CASE over the batch in bulk_update's SQL, so only send the ones that changed
+        fields = (POSITION_FIELDS if repositioned.any() else []) + (FLAG_FIELDS if flags_changed.any() else [])
+
+        seq = None
+        if len(changed):
+            # bulk_update does not send signals, so bump the version and stamp the rows like ingest does
+            seq = bump_layout_version()
+            rows = [
+                Asset(
+                    pk=pk, x_pos=x, y_pos=y, rotation=rotation, changed_seq=seq,
+                    in_map=bool(flags & IN_MAP), in_understand=bool(flags & IN_UNDERSTAND),
+                )
+                for pk, x, y, rotation, flags in changed.tolist()
+            ]
+            Asset.objects.bulk_update(rows, fields + ['changed_seq'], batch_size=500)
+            publish_layout_change(seq)
+            refresh_live_state()
+            # The detector re-sending where the tokens physically are has to get through the deadband
+            forget_marker_positions(marker_ids[row.pk] for row in rows if marker_ids[row.pk] is not None)
+
+            history = get_history_writer()
+            if history is not None:
+                moved = {
+                    marker_ids[row.pk]: (row.x_pos, row.y_pos, row.rotation)
+                    for row in rows if marker_ids[row.pk] is not None
+                }
+                if moved:
+                    history.record(moved)
+
+    return {
+        "restored": int(len(changed)),
+        "unchanged": int(len(wanted) - len(changed)),
+        "missing": int(len(target) - len(wanted)),
+        "seq": seq,
+    }
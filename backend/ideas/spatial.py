@@ -0,0 +1,379 @@
+import heapq
+import math
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .catalog import invalidate_asset_catalog
+from .geo import LocalProjection, get_map_transform
+from .live import get_live_state
+from .models import AssetBackground
+from .positions import asset_positions, asset_positions_since
+from .versioning import current_layout_version, delta_available
+
+# Spatial index over placed assets, for "what is near this token" queries and nearby counts.
+#
+# Positions are kept in two uniform grids: one in map centimetres, one in metres on the ground
+# (map position -> lat/lng through geo.MapTransform -> local projection). A grid fits this data well: tokens are spread
+# over a bounded table, inserts and moves are O(1), and a radius query only looks at the cells
+# the circle touches.
+#
+# The index follows the layout version. Each query first catches up: a ?since= style delta
+# when the index is only a little behind, a full rebuild when it is too far behind or the map
+# (and with it the geo transform) changed. So it costs one version query when nothing moved.
+
+
+class GridIndex:
+    """Points on a uniform grid of cell_size squares, keyed by any hashable"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._points = {}  # key -> (x, y)
+        self._cells = {}   # (cx, cy) -> set of keys
+
+    def __len__(self):
+        return len(self._points)
+
+    def point(self, key):
+        return self._points.get(key)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def insert(self, key, x, y):
+        """Add a point, or move it if the key is already there"""
+        old = self._points.get(key)
+        cell = self._cell(x, y)
+        if old is not None:
+            old_cell = self._cell(*old)
+            if old_cell != cell:
+                self._discard(key, old_cell)
+                self._cells.setdefault(cell, set()).add(key)
+        else:
+            self._cells.setdefault(cell, set()).add(key)
+        self._points[key] = (x, y)
+
+    def remove(self, key):
+        old = self._points.pop(key, None)
+        if old is not None:
+            self._discard(key, self._cell(*old))
+
+    def _discard(self, key, cell):
+        keys = self._cells.get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+
+    def _cells_in_range(self, x, y, radius):
+        """[((cx, cy), keys)] for the occupied cells overlapping the square around the circle"""
+        min_cx, min_cy = self._cell(x - radius, y - radius)
+        max_cx, max_cy = self._cell(x + radius, y + radius)
+        cells = self._cells
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+            # Huge radius compared to how spread out the points are, walk the occupied cells instead
+            return [
+                ((cx, cy), keys) for (cx, cy), keys in cells.items()
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy
+            ]
+        return [
+            ((cx, cy), cells[(cx, cy)])
+            for cx in range(min_cx, max_cx + 1)
+            for cy in range(min_cy, max_cy + 1)
+            if (cx, cy) in cells
+        ]
+
+    def within(self, x, y, radius, predicate=None):
+        """[(distance, key)] for every point within radius of (x, y), closest first"""
+        points = self._points
+        found = []
+        for _, keys in self._cells_in_range(x, y, radius):
+            for key in keys:
+                if predicate is not None and not predicate(key):
+                    continue
+                px, py = points[key]
+                distance = math.hypot(px - x, py - y)
+                if distance <= radius:
+                    found.append((distance, key))
+        found.sort()
+        return found
+
+    def count_within(self, x, y, radius):
+        """
+        How many points are within radius of (x, y).
+        Cells entirely inside the circle are counted without looking at their points.
+        """
+        size = self.cell_size
+        points = self._points
+        count = 0
+        for (cx, cy), keys in self._cells_in_range(x, y, radius):
+            left, top = cx * size, cy * size
+            # Closest and farthest corner/edge of the cell from (x, y)
+            near = math.hypot(max(left - x, 0.0, x - left - size), max(top - y, 0.0, y - top - size))
+            if near > radius:
+                continue
+            far = math.hypot(max(abs(x - left), abs(x - left - size)), max(abs(y - top), abs(y - top - size)))
+            if far <= radius:
+                count += len(keys)
+                continue
+            for key in keys:
+                px, py = points[key]
+                if math.hypot(px - x, py - y) <= radius:
+                    count += 1
+        return count
+
+    def nearest(self, x, y, k, max_distance=None, predicate=None):
+        """[(distance, key)] for the k closest points (optionally no further than max_distance)"""
+        if k <= 0 or not self._points:
+            return []
+        points = self._points
+        cx, cy = self._cell(x, y)
+        candidates = []
+        ring = 0
+        while True:
+            # Every cell at Chebyshev distance `ring` from the centre cell
+            if ring == 0:
+                ring_cells = [(cx, cy)]
+            else:
+                ring_cells = [(cx + dx, cy - ring) for dx in range(-ring, ring + 1)]
+                ring_cells += [(cx + dx, cy + ring) for dx in range(-ring, ring + 1)]
+                ring_cells += [(cx - ring, cy + dy) for dy in range(-ring + 1, ring)]
+                ring_cells += [(cx + ring, cy + dy) for dy in range(-ring + 1, ring)]
+
+            if len(ring_cells) > len(self._cells):
+                # The rings got bigger than the whole grid, finish with one pass over what is left
+                seen = {key for _, key in candidates}
+                candidates.extend(
+                    (math.hypot(px - x, py - y), key) for key, (px, py) in points.items()
+                    if key not in seen and (predicate is None or predicate(key))
+                )
+                break
+
+            for cell in ring_cells:
+                for key in self._cells.get(cell, ()):
+                    if predicate is not None and not predicate(key):
+                        continue
+                    px, py = points[key]
+                    candidates.append((math.hypot(px - x, py - y), key))
+
+            # Anything not seen yet is at least this far away
+            covered = ring * self.cell_size
+            if len(candidates) >= k and heapq.nsmallest(k, candidates)[-1][0] <= covered:
+                break
+            if max_distance is not None and covered >= max_distance:
+                break
+            ring += 1
+
+        if max_distance is not None:
+            candidates = [candidate for candidate in candidates if candidate[0] <= max_distance]
+        return heapq.nsmallest(k, candidates)
+
+
+def neighbour_counts(points, radius):
+    """
+    {key: number of other points within radius} for [(key, x, y)], in one pass.
+    With cells half the radius every point looks at no more than a 5x5 block of cells, and
+    cells that sit completely inside its circle are counted whole, so a radius much larger
+    than the layout (40 miles vs. one neighbourhood) costs about as much as a tiny one.
+    """
+    grid = GridIndex(radius / 2 if radius > 0 else 1.0)
+    for key, x, y in points:
+        grid.insert(key, x, y)
+    return {key: grid.count_within(x, y, radius) - 1 for key, x, y in points}
+
+
+class SpatialIndex:
+    """Placed assets by asset id, in map cm (map_grid) and ground metres (geo_grid)"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.seq = None
+        self.map_key = None
+        self.map_grid = None
+        self.geo_grid = None
+        self.entries = {}  # asset id -> position dict, with lat/lng
+        self._marker_assets = {}  # marker id -> {asset ids}, several assets can share a marker
+        self.transform = None
+        self.projection = None
+
+    def _set_map(self, transform):
+        self.map_grid = GridIndex(settings.SPATIAL_GRID_CELL_CM)
+        self.transform = transform
+        if transform is not None:
+            self.projection = LocalProjection(*transform.point(transform.width / 2, transform.height / 2))
+            # Same cell size as the map grid, measured on the ground
+            metres_per_cm = self._map_scale()
+            self.geo_grid = GridIndex(settings.SPATIAL_GRID_CELL_CM * metres_per_cm if metres_per_cm else 1.0)
+        else:
+            self.projection = None
+            self.geo_grid = None
+
+    def _map_scale(self):
+        """Ground metres per map cm along the top edge of the map"""
+        left = self.projection.to_meters(*self.transform.point(0.0, 0.0))
+        right = self.projection.to_meters(*self.transform.point(self.transform.width, 0.0))
+        return math.hypot(right[0] - left[0], right[1] - left[1]) / self.transform.width
+
+    def _put_all(self, positions):
+        """positions: {asset id: position dict}"""
+        if self.transform is not None:
+            # One vectorized pass for the whole batch
+            self.transform.add_geo(list(positions.values()))
+        for pk, position in positions.items():
+            old = self.entries.get(pk)
+            if old is not None and old['id'] != position['id']:
+                self._forget_marker(old['id'], pk)
+            self.map_grid.insert(pk, position['x'], position['y'])
+            if self.transform is not None:
+                self.geo_grid.insert(pk, *self.projection.to_meters(position['lat'], position['lng']))
+            else:
+                position['lat'] = position['lng'] = None
+            self.entries[pk] = position
+            self._marker_assets.setdefault(position['id'], set()).add(pk)
+
+    def _forget_marker(self, marker_id, pk):
+        pks = self._marker_assets.get(marker_id)
+        if pks is not None:
+            pks.discard(pk)
+            if not pks:
+                del self._marker_assets[marker_id]
+
+    def _drop(self, pk):
+        entry = self.entries.pop(pk, None)
+        if entry is not None:
+            self._forget_marker(entry['id'], pk)
+        self.map_grid.remove(pk)
+        if self.geo_grid is not None:
+            self.geo_grid.remove(pk)
+
+    def sync(self):
+        """Catch up with the current layout version, returns it"""
+        live = get_live_state()
+        seq, _ = live.version() if live is not None else current_layout_version()
+        transform = get_map_transform()
+        map_key = transform.key if transform is not None else None
+
+        with self._lock:
+            if map_key != self.map_key or self.seq is None or not delta_available(self.seq, seq):
+                if self.seq == seq and map_key == self.map_key:
+                    return seq
+                # Full rebuild
+                self._set_map(transform)
+                self.entries = {}
+                self._marker_assets = {}
+                self._put_all(live.asset_snapshot() if live is not None else asset_positions())
+                self.map_key = map_key
+            elif self.seq != seq:
+                changed, removed = live.asset_since(self.seq) if live is not None else asset_positions_since(self.seq)
+                for marker_id, still_placed in removed.items():
+                    # Only the assets that let go of the marker, not others still carrying it
+                    for pk in list(self._marker_assets.get(marker_id, ())):
+                        if pk not in still_placed and pk not in changed:
+                            self._drop(pk)
+                self._put_all(changed)
+            self.seq = seq
+            return seq
+
+    def _type_filter(self, asset_type):
+        if asset_type is None:
+            return None
+        entries = self.entries
+        return lambda pk: entries[pk]['asset_type'] == asset_type
+
+    def query(self, x, y, space='map', radius=None, k=None, asset_type=None, exclude=None):
+        """
+        Assets around (x, y), closest first, as position dicts with a "distance".
+        space 'map': x/y and distances in map cm. space 'geo': x/y are lat/lng and distances in metres.
+        radius and/or k limit the result (k alone = k nearest, radius alone = everything within it).
+        exclude leaves out every asset carrying that marker id.
+        """
+        with self._lock:
+            if space == 'geo':
+                if self.geo_grid is None:
+                    raise ValueError("No map with geographic bounds configured")
+                grid = self.geo_grid
+                x, y = self.projection.to_meters(x, y)
+            else:
+                grid = self.map_grid
+
+            type_filter = self._type_filter(asset_type)
+            if exclude is not None:
+                entries = self.entries
+                predicate = lambda pk: entries[pk]['id'] != exclude and (type_filter is None or type_filter(pk))
+            else:
+                predicate = type_filter
+
+            if k is not None:
+                found = grid.nearest(x, y, k, max_distance=radius, predicate=predicate)
+            else:
+                found = grid.within(x, y, radius, predicate=predicate)
+            return [{**self.entries[pk], "distance": distance} for distance, pk in found]
+
+    def position_of(self, marker_id, space='map'):
+        """Where a placed marker is, in the coordinates query() takes for that space"""
+        with self._lock:
+            pks = self._marker_assets.get(marker_id)
+            if not pks:
+                return None
+            # Assets sharing a marker sit on the same token, take the oldest one
+            entry = self.entries[min(pks)]
+            if space == 'geo':
+                return entry.get('lat'), entry.get('lng')
+            return entry['x'], entry['y']
+
+    def points_by_type(self, space='geo'):
+        """{asset_type: [(asset id, x, y)]} in map cm or ground metres"""
+        with self._lock:
+            grid = self.geo_grid if space == 'geo' else self.map_grid
+            grouped = {}
+            for pk, entry in self.entries.items():
+                x, y = grid.point(pk)
+                grouped.setdefault(entry['asset_type'], []).append((pk, x, y))
+            return grouped
+
+
+_spatial_index = None
+_spatial_index_lock = threading.Lock()
+
+
+def get_spatial_index():
+    """The process-wide SpatialIndex, synced to the current layout"""
+    global _spatial_index
+    if _spatial_index is None:
+        with _spatial_index_lock:
+            if _spatial_index is None:
+                _spatial_index = SpatialIndex()
+    _spatial_index.sync()
+    return _spatial_index
+
+
+def recompute_nearby_counts(radius_m):
+    """
+    Set AssetBackground.nearby_assets_40_miles from the layout: for each type, the most other
+    assets of that type any one of its placed assets has within radius_m metres (0 when none placed).
+    Returns {type_name: count} for the types whose count changed.
+    """
+    index = get_spatial_index()
+    if index.geo_grid is None:
+        raise ValueError("No map with geographic bounds configured")
+
+    counts = {}
+    for asset_type, points in index.points_by_type('geo').items():
+        neighbours = neighbour_counts(points, radius_m)
+        counts[asset_type] = max(neighbours.values(), default=0)
+
+    changed = []
+    now = timezone.now()
+    for background in AssetBackground.objects.only('id', 'type_name', 'nearby_assets_40_miles'):
+        count = counts.get(background.type_name, 0)
+        if background.nearby_assets_40_miles != count:
+            background.nearby_assets_40_miles = count
+            background.updated_at = now
+            changed.append(background)
+    # bulk_update skips the post_save signal (nearby counts are not part of the marker layout) and
+    # auto_now, so set updated_at by hand: the asset catalog keys its cache on it in every process
+    AssetBackground.objects.bulk_update(changed, ['nearby_assets_40_miles', 'updated_at'], batch_size=500)
+    if changed:
+        invalidate_asset_catalog()
+    return {background.type_name: background.nearby_assets_40_miles for background in changed}
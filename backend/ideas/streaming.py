@@ -0,0 +1,136 @@
+import base64
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from .geo import add_geo
+from .positions import POSITION_FIELDS, encode_json, placed_assets, position_row_to_dict
+
+# Streaming mode of get-marker-positions (?stream=1, implied by bbox/limit/cursor).
+#
+# Instead of building a list of every position and encoding it in one go, rows are read from a
+# db cursor (QuerySet.iterator) POSITION_STREAM_CHUNK_SIZE at a time, each chunk gets its lat/lng
+# and is encoded and sent before the next one is read. Memory stays at one chunk and the first
+# bytes go out after the first chunk, whatever the number of assets.
+#
+# Response: {"seq", "results": [positions], "next": cursor or null}. Assets come in id order;
+# with limit, "next" is set when there are more and is passed back as ?cursor= for the next page.
+# bbox=x_min,y_min,x_max,y_max (map cm) only returns assets inside the box. With the live state
+# the box is checked on the overlaid positions, the sql filter also lets through unflushed assets.
+
+STREAM_PARAMS = ('stream', 'bbox', 'limit', 'cursor')
+
+
+def wants_stream(params):
+    return any(param in params for param in STREAM_PARAMS)
+
+
+def encode_cursor(asset_id):
+    return base64.urlsafe_b64encode(f"a{asset_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        if raw.startswith('a'):
+            return int(raw[1:])
+    except ValueError:
+        pass
+    raise ValueError("Invalid cursor")
+
+
+def parse_bbox(value):
+    try:
+        x_min, y_min, x_max, y_max = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValueError("bbox must be x_min,y_min,x_max,y_max in map cm")
+    if x_min > x_max or y_min > y_max:
+        raise ValueError("bbox minimums must not be larger than its maximums")
+    return x_min, y_min, x_max, y_max
+
+
+def parse_stream_params(params):
+    """(bbox or None, limit or None, after asset id or None) from the query string, ValueError if invalid"""
+    bbox = parse_bbox(params['bbox']) if params.get('bbox') else None
+    limit = None
+    if params.get('limit'):
+        try:
+            limit = int(params['limit'])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.POSITION_STREAM_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {settings.POSITION_STREAM_MAX_LIMIT}")
+    after = decode_cursor(params['cursor']) if params.get('cursor') else None
+    return bbox, limit, after
+
+
+def _in_bbox(position, bbox):
+    x_min, y_min, x_max, y_max = bbox
+    return x_min <= position['x'] <= x_max and y_min <= position['y'] <= y_max
+
+
+def stream_positions(seq, bbox=None, limit=None, after=None, live=None, chunk_size=None):
+    """Generator of the JSON response body in pieces, reading at most chunk_size rows at a time"""
+    chunk_size = chunk_size or settings.POSITION_STREAM_CHUNK_SIZE
+    queryset = placed_assets()
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    if bbox is not None:
+        x_min, y_min, x_max, y_max = bbox
+        in_bbox = Q(x_pos__range=(x_min, x_max), y_pos__range=(y_min, y_max))
+        dirty = live.dirty_ids() if live is not None else ()
+        if not dirty:
+            queryset = queryset.filter(in_bbox)
+        elif len(dirty) <= chunk_size:
+            # Their db position is behind, they may have moved into the box. Checked again after the overlay
+            queryset = queryset.filter(in_bbox | Q(pk__in=dirty))
+        # else too many for one IN list: every row is read and only filtered after the overlay
+    rows = queryset.order_by('pk').values_list('pk', *POSITION_FIELDS)
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        rows = rows[:limit + 1]
+    rows = rows.iterator(chunk_size=chunk_size)
+
+    yield f'{{"seq":{seq},"results":['
+    sent = 0
+    last_id = None
+    more = False
+    separator = ''
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        if limit is not None and sent + len(chunk) > limit:
+            chunk = chunk[:limit - sent]
+            more = True
+        sent += len(chunk)
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+
+        positions = [position_row_to_dict(row[1:]) for row in chunk]
+        if live is not None:
+            # Detector moves the live state has not written yet
+            live.overlay([row[0] for row in chunk], positions)
+            if bbox is not None:
+                positions = [position for position in positions if _in_bbox(position, bbox)]
+        if positions:
+            yield separator + encode_json(add_geo(positions))[1:-1]
+            separator = ','
+        if more:
+            break
+
+    yield f'],"next":{encode_json(encode_cursor(last_id) if more else None)}}}'
+
+
+async def aiterate(iterator):
+    """Async iterator over a sync one, each step in the sync thread so db access stays allowed"""
+    done = object()
+    step = sync_to_async(next, thread_sensitive=True)
+    while True:
+        piece = await step(iterator, done)
+        if piece is done:
+            return
+        yield piece
@@ -0,0 +1,183 @@
+import json
+import socket
+import threading
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import SimpleTestCase, override_settings
+
+from .admission import IngestGate
+from .deadband import MarkerUpdateFilter
+from .fusion import MarkerFusion
+from .ingest import _write_held, marker_sequencer
+from .listener import MarkerListener
+from .sequencing import MarkerSequencer, batch_info, stamp_batch
+from .wire import encode_socket_message
+
+
+class MarkerFusionTests(SimpleTestCase):
+    def fuse(self, fusion, source, timestamp, x_pos, y_pos, confidence=None):
+        batch = batch_info(source, timestamp=timestamp, confidence=confidence)
+        return fusion.fuse({12: (x_pos, y_pos, None)}, batch, window_ms=100, conflict_cm=2)
+
+    def test_newest_camera_wins_a_tie(self):
+        # Camera A still sees the token where it was, camera B has already seen it move
+        fusion = MarkerFusion()
+        self.fuse(fusion, None, 1000.000, 9, 9)
+        fused, timestamps, stats = self.fuse(fusion, 's2', 1000.008, 5, 5)
+        self.assertEqual(fused[12][:2], (5, 5))
+        self.assertEqual(timestamps[12], 1000.008)
+        self.assertEqual(stats["conflicts"], 1)
+
+    def test_heavier_group_wins_over_newer(self):
+        fusion = MarkerFusion()
+        self.fuse(fusion, 'a', 1000.000, 9, 9, {12: 0.9})
+        fused, _, stats = self.fuse(fusion, 'b', 1000.008, 5, 5, {12: 0.3})
+        self.assertEqual(fused[12][:2], (9, 9))
+        self.assertEqual(stats["conflicts"], 1)
+
+    def test_agreeing_cameras_are_averaged(self):
+        fusion = MarkerFusion()
+        self.fuse(fusion, 'a', 1000.000, 10, 10)
+        fused, _, stats = self.fuse(fusion, 'b', 1000.008, 11, 10)
+        self.assertEqual(fused[12][:2], (10.5, 10))
+        self.assertEqual(stats, {"fused": 1, "conflicts": 0, "stale": 0})
+
+
+@override_settings(MARKER_INGEST_CONCURRENCY=1, MARKER_INGEST_QUEUE_SIZE=8, MARKER_INGEST_READ_PRIORITY=0)
+class IngestGateTests(SimpleTestCase):
+    def submit_in_thread(self, gate, source, updates, write, outcomes):
+        thread = threading.Thread(target=lambda: outcomes.append(gate.submit(source, updates, {}, write)))
+        thread.start()
+        return thread
+
+    def queue_behind_a_slow_write(self, gate, release):
+        written = []
+
+        def write(updates, batch):
+            release.wait(5)
+            written.append(updates)
+            return updates
+
+        blocker = self.submit_in_thread(gate, 'other', {1: (0, 0, None)}, write, [])
+        while gate._writing == 0:
+            pass
+        waiting, merged = [], []
+        first = self.submit_in_thread(gate, 'cam', {2: (1, 1, None)}, write, waiting)
+        while 'cam' not in gate._waiting:
+            pass
+        second = self.submit_in_thread(gate, 'cam', {3: (2, 2, None)}, write, merged)
+        return written, (blocker, first, second), waiting, merged
+
+    def test_coalesced_request_answers_once_written(self):
+        gate, release = IngestGate(), threading.Event()
+        with override_settings(MARKER_INGEST_QUEUE_TIMEOUT=5.0):
+            written, threads, waiting, merged = self.queue_behind_a_slow_write(gate, release)
+            while gate.stats["coalesced"] == 0:
+                pass
+            self.assertEqual(merged, [])
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(written[1], {2: (1, 1, None), 3: (2, 2, None)})
+        self.assertEqual(waiting[0][0], "done")
+        self.assertEqual(merged, [("coalesced", None)])
+
+    def test_coalesced_request_rejected_with_its_ticket(self):
+        gate, release = IngestGate(), threading.Event()
+        with override_settings(MARKER_INGEST_QUEUE_TIMEOUT=0.2):
+            written, threads, waiting, merged = self.queue_behind_a_slow_write(gate, release)
+            threads[1].join(5)
+            threads[2].join(5)
+            release.set()
+            threads[0].join(5)
+        self.assertEqual(waiting[0][0], "rejected")
+        self.assertEqual(merged[0][0], "rejected")
+        self.assertEqual(written, [{1: (0, 0, None)}])
+
+
+class MarkerListenerTests(SimpleTestCase):
+    def setUp(self):
+        self.listener = MarkerListener(host='127.0.0.1', udp_port=0)
+        self.addCleanup(self.listener.close)
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(self.sender.close)
+
+    def send(self, seq, markers):
+        body = json.dumps({"seq": seq, "markers": markers}).encode()
+        _, host, port = self.listener.addresses[0]
+        self.sender.sendto(encode_socket_message(body, 'application/json', 'cam'), (host, port))
+        self.assertEqual(self.listener.poll(2), 1)
+
+    def test_failing_write_does_not_stop_the_listener(self):
+        written = {"matched": 1, "updated": 1, "moved": {}}
+        with mock.patch('ideas.listener.admit_marker_updates', side_effect=[OperationalError("locked"), (written, None)]) as admit, \
+                self.assertLogs('ideas.listener', 'ERROR'):
+            self.send(1, [{"id": 7, "x": 1, "y": 2}])
+            self.send(2, [{"id": 7, "x": 3, "y": 4}])
+        self.assertEqual(admit.call_count, 2)
+        self.assertEqual(admit.call_args.args[0], {7: (3.0, 4.0, None)})
+        stats, _, _ = self.listener.take_stats()
+        self.assertEqual((stats["failed"], stats["updated"]), (1, 1))
+
+
+@override_settings(MARKER_MAX_CLOCK_SKEW=1.0)
+class MarkerSequencerTests(SimpleTestCase):
+    def is_new(self, sequencer, seq, timestamp, now):
+        batch = batch_info('cam', seq=seq, timestamp=timestamp)
+        stamp_batch(batch, now=now)
+        return sequencer.is_new_batch(batch)
+
+    def test_retry_without_capture_time_is_dropped(self):
+        sequencer = MarkerSequencer()
+        self.assertTrue(self.is_new(sequencer, 5, None, now=1000.0))
+        # Same frame retried a second later: arrival time is newer, the seq is not
+        self.assertFalse(self.is_new(sequencer, 5, None, now=1001.0))
+        self.assertFalse(self.is_new(sequencer, 4, None, now=1001.5))
+        self.assertTrue(self.is_new(sequencer, 6, None, now=1002.0))
+
+    def test_restarted_unstamped_source_is_accepted_after_a_pause(self):
+        sequencer = MarkerSequencer()
+        self.assertTrue(self.is_new(sequencer, 500, None, now=1000.0))
+        self.assertTrue(self.is_new(sequencer, 1, None, now=1030.0))
+
+    def test_captured_restart_is_accepted(self):
+        sequencer = MarkerSequencer()
+        self.assertTrue(self.is_new(sequencer, 500, 999.0, now=1000.0))
+        self.assertFalse(self.is_new(sequencer, 500, 999.0, now=1001.0))
+        self.assertTrue(self.is_new(sequencer, 1, 1000.5, now=1001.0))
+
+
+class HeldUpdateFlushTests(SimpleTestCase):
+    def admit(self, marker_id, timestamp):
+        batch = batch_info('cam', timestamp=timestamp)
+        marker_sequencer.admit({marker_id: (0, 0, None)}, batch)
+        return marker_sequencer.marks([marker_id])
+
+    def test_timer_hands_over_the_held_mark(self):
+        flushed = threading.Event()
+        calls = []
+
+        def flush(updates, marks):
+            calls.append((updates, marks))
+            flushed.set()
+            return updates
+
+        marker_filter = MarkerUpdateFilter(flush_held=flush)
+        marker_filter.record({5: (0, 0, 0)})
+        marker_filter.filter({5: (10, 0, 0)}, (0.1, 2.0, 20.0), marks={5: 'mark'})
+        self.assertTrue(flushed.wait(2))
+        self.assertEqual(calls, [({5: (10, 0, 0)}, {5: 'mark'})])
+
+    def test_held_update_superseded_since_is_not_written(self):
+        held_marks = self.admit(90001, 1000.0)
+        self.admit(90001, 1000.5)
+        with mock.patch('ideas.ingest._write_updates') as write:
+            self.assertEqual(_write_held({90001: (1, 1, None)}, held_marks), {})
+        write.assert_not_called()
+
+    def test_held_update_still_newest_is_written(self):
+        held_marks = self.admit(90002, 1000.0)
+        with mock.patch('ideas.ingest._write_updates') as write:
+            self.assertEqual(_write_held({90002: (1, 1, None)}, held_marks), {90002: (1, 1, None)})
+        write.assert_called_once_with({90002: (1, 1, None)})
@@ -0,0 +1,163 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Asset, AssetInMap, Map, ScenarioTypeCount
+from .positions import is_placed_marker, placed_assets
+
+# Scenario totals: what the placed assets add up to (count, cost, carbon, count per type).
+#
+# Rather than joining every Asset to its AssetBackground on each request, a ScenarioTypeCount row
+# per (map, type) is moved up or down by one whenever an asset is placed, removed, changes type or
+# joins/leaves a map (the Asset and AssetInMap signals call move_placements).
+# Reading the totals is one query over those rows and their backgrounds, however many assets there
+# are, and a cost edit is picked up without any update.
+# An asset counts towards every map an AssetInMap puts it in, assets in none towards the first map.
+# The bulk writes (marker updates, live state flush, snapshot restore) only touch positions and the
+# in_map/in_understand flags, which none of this depends on. Any bulk write that changes marker_id,
+# type or AssetInMap rows has to call move_placements in its transaction, or run
+# check_scenario_totals --fix after it.
+
+
+def scenario_map_id():
+    # The map assets that are in no AssetInMap count towards, same as getMapConfig
+    return Map.objects.order_by('pk').values_list('pk', flat=True).first()
+
+
+def asset_maps(asset_ids):
+    """{asset_id: {map ids}} the assets are in, the first map for assets that are in no AssetInMap"""
+    asset_ids = list(asset_ids)
+    maps = defaultdict(set)
+    rows = AssetInMap.assets.through.objects.filter(asset_id__in=asset_ids).values_list('asset_id', 'assetinmap__map_id')
+    for asset_id, map_id in rows:
+        maps[asset_id].add(map_id)
+    unmapped = [asset_id for asset_id in asset_ids if asset_id not in maps]
+    if unmapped:
+        default = scenario_map_id()
+        for asset_id in unmapped:
+            maps[asset_id] = {default} if default is not None else set()
+    return maps
+
+
+def placement(marker_id, type_id, map_ids):
+    """The (map, type) counts an asset adds one to, empty if it is not placed"""
+    if not is_placed_marker(marker_id) or type_id is None:
+        return frozenset()
+    return frozenset((map_id, type_id) for map_id in map_ids)
+
+
+def asset_placements(asset_ids):
+    """{asset_id: placement} for assets as they are in the db now"""
+    rows = list(Asset.objects.filter(pk__in=list(asset_ids)).values_list('pk', 'marker_id', 'type_id'))
+    maps = asset_maps(pk for pk, _, _ in rows)
+    return {pk: placement(marker_id, type_id, maps[pk]) for pk, marker_id, type_id in rows}
+
+
+def adjust_type_count(background_id, delta, map_id=None):
+    """Add delta to a type's count, a single UPDATE unless the row does not exist yet"""
+    if map_id is None:
+        map_id = scenario_map_id()
+    if map_id is None or background_id is None or not delta:
+        return
+    rows = ScenarioTypeCount.objects.filter(map_id=map_id, background_id=background_id)
+    if not rows.update(count=F('count') + delta):
+        ScenarioTypeCount.objects.get_or_create(map_id=map_id, background_id=background_id)
+        rows.update(count=F('count') + delta)
+
+
+def move_placements(before, after):
+    """
+    Apply the difference between two {asset_id: placement} dicts to the stored counts, one UPDATE per
+    (map, type) that changed. Assets missing from after (deleted) are taken out.
+    """
+    deltas = Counter()
+    for asset_id, keys in before.items():
+        deltas.subtract(keys - after.get(asset_id, frozenset()))
+    for asset_id, keys in after.items():
+        deltas.update(keys - before.get(asset_id, frozenset()))
+    if not any(deltas.values()):
+        return
+    with transaction.atomic():
+        for (map_id, background_id), delta in sorted(deltas.items()):
+            adjust_type_count(background_id, delta, map_id)
+
+
+def scenario_totals(map_id=None):
+    """
+    {"map", "asset_count", "total_cost", "total_carbon_emission", "assets_without_cost",
+    "assets_without_carbon", "by_type": [{"type", "type_name", "count", "cost", "carbon_emission"}]}
+    where each type's cost and carbon_emission are count * the background's value
+    """
+    if map_id is None:
+        map_id = scenario_map_id()
+    rows = (
+        ScenarioTypeCount.objects.filter(map_id=map_id, count__gt=0)
+        .order_by('background__type_name')
+        .values_list('background_id', 'background__type_name', 'count', 'background__cost', 'background__carbon_emission')
+    )
+
+    totals = {
+        "map": map_id,
+        "asset_count": 0,
+        "total_cost": 0.0,
+        "total_carbon_emission": 0.0,
+        # Backgrounds without a cost or carbon figure count as 0 in the totals, these say how many
+        "assets_without_cost": 0,
+        "assets_without_carbon": 0,
+        "by_type": [],
+    }
+    for background_id, type_name, count, cost, carbon in rows:
+        cost = float(cost) * count if cost is not None else None
+        carbon = float(carbon) * count if carbon is not None else None
+        totals["asset_count"] += count
+        totals["total_cost"] += cost or 0.0
+        totals["total_carbon_emission"] += carbon or 0.0
+        if cost is None:
+            totals["assets_without_cost"] += count
+        if carbon is None:
+            totals["assets_without_carbon"] += count
+        totals["by_type"].append({
+            "type": background_id, "type_name": type_name, "count": count,
+            "cost": cost, "carbon_emission": carbon,
+        })
+    totals["total_cost"] = round(totals["total_cost"], 2)
+    totals["total_carbon_emission"] = round(totals["total_carbon_emission"], 2)
+    return totals
+
+
+def check_scenario_totals(fix=False):
+    """
+    Count the placed assets per map and type from scratch and compare with the stored counts.
+    Returns {"maps", "drift": [{"map", "type", "stored", "actual"}], "fixed"}; with fix the stored counts are corrected.
+    """
+    map_ids = list(Map.objects.order_by('pk').values_list('pk', flat=True))
+    if not map_ids:
+        return {"maps": [], "drift": [], "fixed": False}
+
+    with transaction.atomic():
+        stored = {
+            (map_id, background_id): count
+            for map_id, background_id, count in
+            ScenarioTypeCount.objects.select_for_update().values_list('map_id', 'background_id', 'count')
+        }
+        actual = {
+            (map_id, background_id): count
+            for map_id, background_id, count in
+            placed_assets().filter(assetinmap__isnull=False)
+            .values_list('assetinmap__map_id', 'type').annotate(count=Count('id', distinct=True)).order_by()
+        }
+        for background_id, count in placed_assets().filter(assetinmap__isnull=True).values_list('type').annotate(count=Count('id')).order_by():
+            actual[(map_ids[0], background_id)] = count
+        drift = [
+            {"map": map_id, "type": background_id, "stored": stored.get((map_id, background_id), 0),
+             "actual": actual.get((map_id, background_id), 0)}
+            for map_id, background_id in sorted(set(stored) | set(actual))
+            if stored.get((map_id, background_id), 0) != actual.get((map_id, background_id), 0)
+        ]
+        if fix:
+            for row in drift:
+                ScenarioTypeCount.objects.update_or_create(
+                    map_id=row["map"], background_id=row["type"], defaults={"count": row["actual"]},
+                )
+    return {"maps": map_ids, "drift": drift, "fixed": bool(fix and drift)}
@@ -1,6 +1,19 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter    
-from .views import updateCoordinates, updateMarkerPositions, getMarkerPositions, getMapConfig
+from .views import updateCoordinates, updateMarkerPositions, getMarkerPositions, getMapConfig, flushMarkerState, replayMarkerHistory, getMetrics, getSlowRequests, nearbyAssets, getAssetCatalog, getAssetIcons, layoutSnapshots, layoutSnapshot, restoreLayoutSnapshot, diffLayoutSnapshot, getScenarioTotals
+
+from .async_views import updateMarkerPositionsAsync, getMarkerPositionsAsync, getMapConfigAsync
+
+# With ASYNC_MARKER_VIEWS the hot endpoints are served by the async views (run under daphne / ASGI)
+if settings.ASYNC_MARKER_VIEWS:
+    updateMarkerPositionsView, getMarkerPositionsView, getMapConfigView = (
+        updateMarkerPositionsAsync, getMarkerPositionsAsync, getMapConfigAsync
+    )
+else:
+    updateMarkerPositionsView, getMarkerPositionsView, getMapConfigView = (
+        updateMarkerPositions, getMarkerPositions, getMapConfig
+    )
 
 # router = DefaultRouter()
 # router.register(r'ideas', IdeaViewSet)
@@ -9,7 +22,24 @@ urlpatterns = [
     # path('', include(router.urls)),
 
     path('update-coordinates/', updateCoordinates, name='update-coordinates'),
-    path('update-marker-positions/', updateMarkerPositions, name='update-marker-positions'),
-    path('get-marker-positions/', getMarkerPositions, name='get-marker-positions'),
-    path('map-config/', getMapConfig, name='map-config'),
+    path('update-marker-positions/', updateMarkerPositionsView, name='update-marker-positions'),
+    path('get-marker-positions/', getMarkerPositionsView, name='get-marker-positions'),
+    path('map-config/', getMapConfigView, name='map-config'),
+    path('flush-marker-state/', flushMarkerState, name='flush-marker-state'),
+    path('replay/', replayMarkerHistory, name='replay'),
+    path('nearby/', nearbyAssets, name='nearby'),
+    path('asset-catalog/', getAssetCatalog, name='asset-catalog'),
+    path('asset-catalog/icons/', getAssetIcons, name='asset-catalog-icons'),
+    path('scenario-totals/', getScenarioTotals, name='scenario-totals'),
+    path('snapshots/', layoutSnapshots, name='snapshots'),
+    path('snapshots/<int:pk>/', layoutSnapshot, name='snapshot'),
+    path('snapshots/<int:pk>/restore/', restoreLayoutSnapshot, name='snapshot-restore'),
+    path('snapshots/<int:pk>/diff/', diffLayoutSnapshot, name='snapshot-diff'),
+    path('metrics/', getMetrics, name='metrics'),
+    path('metrics/slow/', getSlowRequests, name='metrics-slow'),
+
+    # The async views are always reachable here too, so both can be load tested side by side
+    path('async/update-marker-positions/', updateMarkerPositionsAsync, name='async-update-marker-positions'),
+    path('async/get-marker-positions/', getMarkerPositionsAsync, name='async-get-marker-positions'),
+    path('async/map-config/', getMapConfigAsync, name='async-map-config'),
 ] 
\ No newline at end of file
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import LayoutVersion, RemovedMarker
+
+# Layout version bookkeeping and the ETag / Last-Modified callbacks used with
+# django.views.decorators.http.condition on the polling endpoints
+
+LAYOUT_VERSION_PK = 1
+
+
+def bump_layout_version():
+    """
+    Increment the layout version. Call this from every write path that changes what
+    get-marker-positions returns (signals cover save()/delete(), bulk writes call it directly).
+    Returns the new version; callers publish it with broadcast.publish_layout_change once the rows are written.
+    """
+    from .live import get_live_state
+
+    live = get_live_state()
+    if live is not None:
+        # The live state hands out versions, it may be ahead of the db with ones it has not flushed yet
+        next_version = Greatest(F('version'), live.reserve_seq())
+    else:
+        next_version = F('version') + 1
+
+    now = timezone.now()
+    updated = LayoutVersion.objects.filter(pk=LAYOUT_VERSION_PK).update(version=next_version, updated_at=now)
+    if not updated:
+        # Row is created by migration 0016, this only happens if someone deleted it
+        LayoutVersion.objects.get_or_create(pk=LAYOUT_VERSION_PK)
+        LayoutVersion.objects.filter(pk=LAYOUT_VERSION_PK).update(version=next_version, updated_at=now)
+    return current_layout_version()[0]
+
+
+def refresh_live_state():
+    """After a write that went through the db, have the live state (if on) reload once it commits"""
+    from .live import get_live_state
+
+    live = get_live_state()
+    if live is not None:
+        transaction.on_commit(live.reload)
+
+
+def current_layout_version():
+    """(version, updated_at) of the marker layout, (0, None) if the row is missing"""
+    row = LayoutVersion.objects.filter(pk=LAYOUT_VERSION_PK).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+async def acurrent_layout_version():
+    """current_layout_version() with the async ORM"""
+    row = await LayoutVersion.objects.filter(pk=LAYOUT_VERSION_PK).values_list('version', 'updated_at').afirst()
+    return row or (0, None)
+
+
+def record_removed_marker(marker_id, seq):
+    """Remember that marker_id left the layout at version seq, and drop tombstones nobody can ask for anymore"""
+    RemovedMarker.objects.create(marker_id=marker_id, seq=seq)
+    RemovedMarker.objects.filter(seq__lte=seq - settings.MARKER_DELTA_MAX_AGE).delete()
+
+
+def delta_available(since, current):
+    """
+    Whether a client at layout version `since` can be brought up to `current` with a delta.
+    Too old (tombstones may be pruned) or ahead of us (db was reset) means send a full snapshot,
+    and so does 0, which is what a client that has not loaded anything yet sends.
+    """
+    return since > 0 and current - settings.MARKER_DELTA_MAX_AGE < since <= current
+
+
+def request_layout_version(request):
+    """
+    Layout version as seen at the start of the request. Read before any asset data,
+    so anything written afterwards has a higher seq and shows up in the client's next delta.
+    """
+    from .live import get_live_state
+
+    # condition() asks for the etag and last-modified separately, only hit the DB once
+    if not hasattr(request, '_layout_version'):
+        live = get_live_state()
+        request._layout_version = live.version() if live is not None else current_layout_version()
+    return request._layout_version
+
+
+def layout_etag(request, *args, **kwargs):
+    version, _ = request_layout_version(request)
+    return f"layout-{version}"
+
+
+def layout_last_modified(request, *args, **kwargs):
+    _, updated_at = request_layout_version(request)
+    return updated_at
+
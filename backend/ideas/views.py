@@ -2,11 +2,32 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 import json
 
 from .models import *
 from .serializers import *
+from .ingest import parse_marker_request, ingest_summary
+from .admission import admit_marker_updates, counts_as_read, retry_after_header
+from .live import get_live_state
+from .positions import marker_positions, marker_positions_since, json_response
+from .versioning import delta_available, request_layout_version, layout_etag, layout_last_modified
+from .mapconfig import request_map_config, map_config_etag, map_config_last_modified
+from .replay import replay_stream
+from .metrics import get_request_metrics
+from .spatial import get_spatial_index
+from .geo import add_geo
+from .catalog import cached_response, get_asset_catalog, get_icon_bundle
+from .totals import scenario_totals
+from .streaming import parse_stream_params, stream_positions, wants_stream
+from .snapshots import capture_snapshot, diff_layouts, layout_now, layout_entries, restore_snapshot, unpack_layout
 
 # Where we define methods to interact with the database
 
@@ -30,11 +51,13 @@ def updateCoordinates(request):
         rotation = data.get('rotation')
 
         
-        asset = Asset.objects.get(id=asset_id)
-        asset.x_pos = x_pos
-        asset.y_pos = y_pos
-        asset.rotation = rotation
-        asset.save()
+        # Atomic so the layout version bump and the stamped row become visible together
+        with transaction.atomic():
+            asset = Asset.objects.get(id=asset_id)
+            asset.x_pos = x_pos
+            asset.y_pos = y_pos
+            asset.rotation = rotation
+            asset.save()
 
     return Response(status=status.HTTP_200_OK)
 
@@ -46,44 +69,30 @@ def updateMarkerPositions(request):
     """
     Update marker positions from ArUco detection system
     Expected format: [{"id": marker_id, "x": x_pos, "y": y_pos, "rotation": rotation_degrees}, ...]
+    or a packed binary frame with Content-Type application/vnd.tangible.markers (see wire.py).
+    The list can be wrapped as {"source", "seq", "timestamp", "markers": [...]} so updates from
+    several detectors and retries are applied in capture order (see sequencing.py)
     """
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
-            
-            if not isinstance(data, list):
+            updates, markers_processed, batch = parse_marker_request(
+                request.META.get('CONTENT_TYPE', ''), request.body, request.headers.get('X-Marker-Source'),
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Rate limited per source and queued behind a few concurrent writes (admission.py), then
+            # every marker is resolved in one query (or in memory with the live state) and only rows that moved are written
+            result, retry_after = admit_marker_updates(updates, batch, request.META.get('REMOTE_ADDR'))
+            if result is None:
                 return Response(
-                    {"error": "Expected list of marker positions"}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                    {"error": "Too many marker updates, retry later", "retry_after": round(retry_after, 3)},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': retry_after_header(retry_after)},
                 )
+            return Response(ingest_summary(result, markers_processed), status=status.HTTP_200_OK)
             
-            updated_count = 0
-            for marker_data in data:
-                marker_id = marker_data.get('id')
-                x_pos = marker_data.get('x')
-                y_pos = marker_data.get('y')
-                rotation = marker_data.get('rotation')
-                
-                if marker_id is not None and x_pos is not None and y_pos is not None:
-                    # Find assets with this marker_id and update their positions
-                    assets = Asset.objects.filter(marker_id=marker_id)
-                    for asset in assets:
-                        asset.x_pos = x_pos
-                        asset.y_pos = y_pos
-                        asset.rotation = rotation
-                        asset.save()
-                        updated_count += 1
-            
-            return Response({
-                "message": f"Updated {updated_count} assets",
-                "markers_processed": len(data)
-            }, status=status.HTTP_200_OK)
-            
-        except json.JSONDecodeError:
-            return Response(
-                {"error": "Invalid JSON format"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
         except Exception as e:
             return Response(
                 {"error": str(e)}, 
@@ -94,52 +103,309 @@ def updateMarkerPositions(request):
 
 
 @csrf_exempt
+@cache_control(no_cache=True)
+@condition(etag_func=layout_etag, last_modified_func=layout_last_modified)
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@counts_as_read
 def getMarkerPositions(request):
     """
     Get current marker positions for all assets
+    Sends an ETag of the layout version, If-None-Match gets a 304 without reading Asset
+
+    With ?since=<seq> (the "seq" from a previous response) only assets that changed after
+    that version are returned: {"seq", "full", "changed": [...], "removed": [marker ids]}.
+    If seq is too old to build a delta from, "full" is true and "changed" has every asset.
+    Every position also has "lat"/"lng" from the map's corner transform (null if the map has no bounds).
+
+    ?stream=1 streams {"seq", "results", "next"} from a db cursor a chunk at a time, with optional
+    bbox=x_min,y_min,x_max,y_max and limit/cursor pagination, see streaming.py
     """
-    assets = Asset.objects.filter(marker_id__isnull=False).exclude(marker_id=999)
-    
-    marker_positions = []
-    for asset in assets:
-        marker_positions.append({
-            "id": asset.marker_id,
-            "x": asset.x_pos,
-            "y": asset.y_pos,
-            "rotation": asset.rotation,
-            "asset_name": asset.name,
-            "asset_type": asset.type.type_name if asset.type else None,
-            "icon_path": asset.type.icon_path if asset.type and asset.type.icon_path else None,
-            "physical_width": asset.physical_width,
-            "physical_height": asset.physical_height
-        })
-    
-    return Response(marker_positions, status=status.HTTP_200_OK)
+    live = get_live_state()
+    if wants_stream(request.GET):
+        try:
+            bbox, limit, after = parse_stream_params(request.GET)
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        seq, _ = request_layout_version(request)
+        return StreamingHttpResponse(
+            stream_positions(seq, bbox=bbox, limit=limit, after=after, live=live),
+            content_type='application/json',
+        )
+
+    since = request.GET.get('since')
+    if since is None:
+        if live is not None:
+            return json_response(add_geo(live.snapshot()))
+        # One joined query for only the columns we return, encoded straight to JSON
+        return json_response(add_geo(marker_positions()))
+
+    try:
+        since = int(since)
+    except ValueError:
+        return json_response({"error": "since must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    seq, _ = request_layout_version(request)
+    if delta_available(since, seq):
+        changed, removed = live.since(since) if live is not None else marker_positions_since(since)
+        full = False
+    else:
+        changed, removed = (live.snapshot() if live is not None else marker_positions()), []
+        full = True
+
+    return json_response({"seq": seq, "full": full, "changed": add_geo(changed), "removed": removed})
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def flushMarkerState(request):
+    """
+    Write any marker positions held in the live state to the database right away
+    (call at the end of a session). Does nothing when LIVE_MARKER_STATE is off.
+    """
+    live = get_live_state()
+    flushed = live.flush() if live is not None else 0
+    return Response({"flushed": flushed}, status=status.HTTP_200_OK)
 
 
+@cache_control(no_cache=True)
+@condition(etag_func=map_config_etag, last_modified_func=map_config_last_modified)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def getMapConfig(request):
     """
     Get map configuration including physical dimensions and geographic bounds
+    Revalidates with ETag / If-None-Match based on the map's config_version and updated_at
+    The serialized config is cached per map version, see mapconfig.py
     """
     try:
         # Get the first map (assuming single map for now)
-        map_obj = Map.objects.first()
+        map_config = request_map_config(request)
         
-        if not map_obj:
+        if not map_config:
             return Response(
                 {"error": "No map configuration found"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        serializer = MapConfigSerializer(map_obj)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return HttpResponse(map_config["body"], content_type='application/json')
         
     except Exception as e:
         return Response(
             {"error": str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def replayMarkerHistory(request):
+    """
+    Stream recorded marker positions as NDJSON, one frame per line
+    Query params: start, end (ISO 8601, required), map (id, defaults to the first map),
+    fps (decimate to this many frames per second), speed (pace frames, 1.0 = real time)
+    """
+    start = parse_datetime(request.GET.get('start', ''))
+    end = parse_datetime(request.GET.get('end', ''))
+    if start is None or end is None or start >= end:
+        return Response(
+            {"error": "start and end must be ISO 8601 datetimes with start before end"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+
+    try:
+        fps = float(request.GET['fps']) if 'fps' in request.GET else None
+        speed = float(request.GET['speed']) if 'speed' in request.GET else None
+        map_id = int(request.GET['map']) if 'map' in request.GET else None
+    except ValueError:
+        return Response(
+            {"error": "fps and speed must be numbers, map must be an integer"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if (fps is not None and not 0 < fps <= 120) or (speed is not None and not 0 < speed <= 1000):
+        return Response(
+            {"error": "fps must be in (0, 120] and speed in (0, 1000]"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if map_id is None:
+        map_id = Map.objects.order_by('pk').values_list('pk', flat=True).first()
+
+    response = StreamingHttpResponse(
+        replay_stream(start, end, map_id=map_id, fps=fps, speed=speed),
+        content_type='application/x-ndjson',
+    )
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def nearbyAssets(request):
+    """
+    Placed assets around a point, closest first, each with a "distance"
+    Centre: marker=<marker id> (the marker itself is left out), x & y in map cm, or lat & lng
+    space: "map" (cm) or "geo" (metres on the ground), defaults to geo for lat/lng and map otherwise
+    radius (in the units of the space) and/or k (k nearest) limit the results, type filters by asset type
+    """
+    params = request.GET
+    space = params.get('space', 'geo' if 'lat' in params else 'map')
+    if space not in ('map', 'geo'):
+        return Response({"error": "space must be map or geo"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        radius = float(params['radius']) if 'radius' in params else None
+        k = int(params['k']) if 'k' in params else None
+        marker = int(params['marker']) if 'marker' in params else None
+        if marker is None:
+            x, y = (float(params['lat']), float(params['lng'])) if space == 'geo' else (float(params['x']), float(params['y']))
+    except (KeyError, ValueError):
+        return Response(
+            {"error": "Give marker, x and y (map) or lat and lng (geo) as numbers, radius as a number and k as an integer"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if (radius is None and k is None) or (radius is not None and radius < 0) or (k is not None and not 0 < k <= 1000):
+        return Response(
+            {"error": "Give radius >= 0 and/or k between 1 and 1000"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    index = get_spatial_index()
+    if marker is not None:
+        center = index.position_of(marker, space)
+        if center is None:
+            return Response({"error": f"Marker {marker} is not on the map"}, status=status.HTTP_404_NOT_FOUND)
+        x, y = center
+
+    try:
+        results = index.query(x, y, space=space, radius=radius, k=k, asset_type=params.get('type'), exclude=marker)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+    return json_response({"seq": index.seq, "space": space, "results": results})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getMetrics(request):
+    """Request metrics in the Prometheus text format (needs REQUEST_METRICS=True)"""
+    if not settings.REQUEST_METRICS:
+        return Response({"error": "Request metrics are disabled"}, status=status.HTTP_404_NOT_FOUND)
+    return HttpResponse(get_request_metrics().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getSlowRequests(request):
+    """The most recent slow requests with the stack they were stuck in, newest first"""
+    if not settings.REQUEST_METRICS:
+        return Response({"error": "Request metrics are disabled"}, status=status.HTTP_404_NOT_FOUND)
+    return json_response(list(get_request_metrics().slow_requests)[::-1])
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getAssetCatalog(request):
+    """
+    Every AssetBackground (type_name, icon_path, cost, carbon_emission and the text fields) in one
+    response, with a content hash as ETag. icon_bundle points at the inlined SVGs of all icons.
+    Cacheable for good when requested with ?v=<hash>, see catalog.py
+    """
+    return cached_response(request, get_asset_catalog())
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getAssetIcons(request):
+    """All /asset-images/*.svg inlined as {"hash", "icons": {path: svg}}, so the map needs one request for every icon"""
+    bundle = get_icon_bundle()
+    if bundle is None:
+        return Response({"error": "No icons found"}, status=status.HTTP_404_NOT_FOUND)
+    return cached_response(request, bundle)
+
+
+@csrf_exempt
+@api_view(['GET', 'POST'])
+@permission_classes([AllowAny])
+def layoutSnapshots(request):
+    """
+    GET: saved layout snapshots, newest first
+    POST {"name": "..."}: snapshot every asset's position, rotation and in_map/in_understand as they are now
+    """
+    if request.method == 'GET':
+        return Response(LayoutSnapshotSerializer(LayoutSnapshot.objects.defer('data'), many=True).data)
+
+    name = str(request.data.get('name', '')).strip() if hasattr(request.data, 'get') else ''
+    if not name:
+        return Response({"error": "name is required"}, status=status.HTTP_400_BAD_REQUEST)
+    snapshot = capture_snapshot(name[:200])
+    return Response(LayoutSnapshotSerializer(snapshot).data, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@api_view(['GET', 'DELETE'])
+@permission_classes([AllowAny])
+def layoutSnapshot(request, pk):
+    """GET: the snapshot with every asset it holds, DELETE: remove it"""
+    snapshot = LayoutSnapshot.objects.filter(pk=pk).first()
+    if snapshot is None:
+        return Response({"error": "Snapshot not found"}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'DELETE':
+        snapshot.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return json_response({**LayoutSnapshotSerializer(snapshot).data, "assets": layout_entries(unpack_layout(snapshot.data))})
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def restoreLayoutSnapshot(request, pk):
+    """Move every asset back to where the snapshot has it, one bulk write and one layout version"""
+    snapshot = LayoutSnapshot.objects.filter(pk=pk).first()
+    if snapshot is None:
+        return Response({"error": "Snapshot not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"status": "success", **restore_snapshot(snapshot)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def diffLayoutSnapshot(request, pk):
+    """
+    Asset ids that differ between this snapshot and ?against=<snapshot id> (defaults to the
+    current layout): moved, flags_changed, added (only in against), removed (only in this one)
+    """
+    snapshot = LayoutSnapshot.objects.filter(pk=pk).first()
+    if snapshot is None:
+        return Response({"error": "Snapshot not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    against = request.GET.get('against', 'current')
+    if against == 'current':
+        other = layout_now()
+    else:
+        try:
+            other_snapshot = LayoutSnapshot.objects.filter(pk=int(against)).first()
+        except ValueError:
+            return Response({"error": "against must be a snapshot id or current"}, status=status.HTTP_400_BAD_REQUEST)
+        if other_snapshot is None:
+            return Response({"error": "Snapshot not found"}, status=status.HTTP_404_NOT_FOUND)
+        other = unpack_layout(other_snapshot.data)
+    return json_response({"snapshot": snapshot.pk, "against": against, **diff_layouts(unpack_layout(snapshot.data), other)})
+
+
+@cache_control(no_cache=True)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getScenarioTotals(request):
+    """
+    Totals over the placed assets: asset_count, total_cost, total_carbon_emission and by_type counts.
+    Served from the per-type counts the Asset signals keep up to date, see totals.py
+    """
+    try:
+        map_id = int(request.GET['map']) if 'map' in request.GET else None
+    except ValueError:
+        return Response({"error": "map must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    return json_response(scenario_totals(map_id))
@@ -0,0 +1,113 @@
+import math
+import struct
+
+import numpy as np
+
+# Compact binary format for detector -> backend marker updates.
+# The detector sends it with Content-Type: application/vnd.tangible.markers; anything else is parsed as JSON.
+#
+# Little-endian, no padding:
+#   header   uint32 seq | float64 timestamp (epoch seconds of the captured frame) | uint16 count
+#   record   uint16 marker id | float32 x | float32 y | float32 rotation (NaN = not measured)   x count
+#
+# Frames sent as MARKER_FRAME_CONFIDENCE_CONTENT_TYPE have one more float32 at the end of every
+# record: the detector's confidence in that observation (0-1), used to weight it in fusion.py.
+#
+# Over a socket (manage.py listen_markers) every message is wrapped as
+#   uint8 kind | uint8 source length | source (utf-8, may be empty) | body
+# kind 0 = JSON body, 1 = frame, 2 = frame with confidence. Over TCP each message is preceded
+# by its length as a uint32.
+#
+# opencv/marker_wire.py has the matching encoder for the detector, keep the two in sync.
+
+MARKER_FRAME_CONTENT_TYPE = 'application/vnd.tangible.markers'
+MARKER_FRAME_CONFIDENCE_CONTENT_TYPE = 'application/vnd.tangible.markers-confidence'
+
+FRAME_HEADER = struct.Struct('<IdH')
+RECORD_DTYPE = np.dtype([('id', '<u2'), ('x', '<f4'), ('y', '<f4'), ('rotation', '<f4')])
+CONFIDENCE_RECORD_DTYPE = np.dtype(RECORD_DTYPE.descr + [('confidence', '<f4')])
+
+SOCKET_MESSAGE_HEADER = struct.Struct('<BB')
+SOCKET_LENGTH_PREFIX = struct.Struct('<I')
+SOCKET_KINDS = {0: 'application/json', 1: MARKER_FRAME_CONTENT_TYPE, 2: MARKER_FRAME_CONFIDENCE_CONTENT_TYPE}
+
+
+class MarkerFrameError(ValueError):
+    pass
+
+
+def encode_marker_frame(markers, seq=0, timestamp=0.0, confidence=False):
+    """
+    Pack a list of {"id", "x", "y", "rotation"} dicts (the JSON payload shape) into a frame.
+    With confidence=True each record also gets the marker's "confidence" (1 when missing).
+    """
+    rows = [
+        (marker['id'], marker['x'], marker['y'], np.nan if marker.get('rotation') is None else marker['rotation'])
+        for marker in markers
+    ]
+    if confidence:
+        rows = [row + (marker.get('confidence', 1.0),) for row, marker in zip(rows, markers)]
+    records = np.array(rows, dtype=CONFIDENCE_RECORD_DTYPE if confidence else RECORD_DTYPE)
+    return FRAME_HEADER.pack(seq, timestamp, len(markers)) + records.tobytes()
+
+
+def decode_marker_frame(body, confidence=False):
+    """
+    Unpack a frame into (seq, timestamp, updates, confidences) where updates has the same
+    {marker_id: (x, y, rotation or None)} shape as ingest.parse_marker_updates, and
+    confidences is {marker_id: confidence} for confidence frames, None otherwise.
+    """
+    dtype = CONFIDENCE_RECORD_DTYPE if confidence else RECORD_DTYPE
+    if len(body) < FRAME_HEADER.size:
+        raise MarkerFrameError("Frame is shorter than its header")
+    seq, timestamp, count = FRAME_HEADER.unpack_from(body)
+    if not math.isfinite(timestamp):
+        # Same rule as the JSON envelope, a NaN or infinite timestamp would break sequencing.py's ordering
+        raise MarkerFrameError("Frame timestamp must be finite epoch seconds")
+    expected = FRAME_HEADER.size + count * dtype.itemsize
+    if len(body) != expected:
+        raise MarkerFrameError(f"Frame says {count} records, expected {expected} bytes and got {len(body)}")
+
+    records = np.frombuffer(body, dtype=dtype, count=count, offset=FRAME_HEADER.size)
+    # NaN rotation means not measured, anything else non-finite cannot be stored
+    if not (np.isfinite(records['x']).all() and np.isfinite(records['y']).all()
+            and not np.isinf(records['rotation']).any()):
+        raise MarkerFrameError("Frame has a non-finite x, y or rotation")
+    if confidence and not np.isfinite(records['confidence']).all():
+        raise MarkerFrameError("Frame has a non-finite confidence")
+    ids = records['id'].tolist()
+    xs = records['x'].astype(np.float64).tolist()
+    ys = records['y'].astype(np.float64).tolist()
+    rotations = records['rotation'].astype(np.float64)
+    measured = ~np.isnan(rotations)
+    rotations = [rotation if ok else None for rotation, ok in zip(rotations.tolist(), measured.tolist())]
+
+    confidences = dict(zip(ids, records['confidence'].astype(np.float64).tolist())) if confidence else None
+
+    # Same rule as the JSON path: if a marker shows up twice the last one wins
+    return seq, timestamp, dict(zip(ids, zip(xs, ys, rotations))), confidences
+
+
+def encode_socket_message(body, content_type=MARKER_FRAME_CONTENT_TYPE, source=''):
+    kind = {content: kind for kind, content in SOCKET_KINDS.items()}[content_type]
+    source = source.encode()
+    if len(source) > 255:
+        raise MarkerFrameError("source is longer than 255 bytes")
+    return SOCKET_MESSAGE_HEADER.pack(kind, len(source)) + source + body
+
+
+def decode_socket_message(message):
+    """(content type, source or None, body) of a socket message, for ingest.parse_marker_request"""
+    if len(message) < SOCKET_MESSAGE_HEADER.size:
+        raise MarkerFrameError("Message is shorter than its header")
+    kind, source_length = SOCKET_MESSAGE_HEADER.unpack_from(message)
+    if kind not in SOCKET_KINDS:
+        raise MarkerFrameError(f"Unknown message kind {kind}")
+    start = SOCKET_MESSAGE_HEADER.size
+    if len(message) < start + source_length:
+        raise MarkerFrameError("Message is shorter than its source")
+    try:
+        source = bytes(message[start:start + source_length]).decode()
+    except UnicodeDecodeError:
+        raise MarkerFrameError("source is not valid utf-8")
+    return SOCKET_KINDS[kind], source or None, bytes(message[start + source_length:])
@@ -7,6 +7,7 @@ import { MapContainer, TileLayer, useMap, Marker, Popup } from 'react-leaflet'
 import { LatLngExpression, LatLngTuple } from "leaflet";
 import L from 'leaflet';
 import {physicalToGeographic} from "@/utils/geoCoordinateConverter";
+import { useAssetCatalog } from "@/hooks/useAssetCatalog";
 
 import "leaflet/dist/leaflet.css";
 import "leaflet-defaulticon-compatibility/dist/leaflet-defaulticon-compatibility.css";
@@ -37,9 +38,8 @@ const defaults = {
 };
 
 // Create custom icon based on icon_path from database with rotation support
-function createCustomIcon(iconPath: string | null, rotation: number = 0): L.DivIcon {
-  // Default icon path if none provided
-  const iconUrl = iconPath || '/asset-images/playground.svg';
+// iconUrl is the inlined SVG from the asset catalog's icon bundle when available
+function createCustomIcon(iconPath: string | null, iconUrl: string, rotation: number = 0): L.DivIcon {
   
   return L.divIcon({
     html: `<img src="${iconUrl}" style="width: 32px; height: 32px; transform: rotate(${rotation}deg); transform-origin: center center; transition: all 0.3s ease-in-out; filter: drop-shadow(0 2px 4px rgba(0,0,0,0.3)); cursor: pointer;" onmouseover="this.style.transform='rotate(${rotation}deg) scale(1.2)'; this.style.filter='drop-shadow(0 4px 8px rgba(0,0,0,0.5))';" onmouseout="this.style.transform='rotate(${rotation}deg) scale(1)'; this.style.filter='drop-shadow(0 2px 4px rgba(0,0,0,0.3))';" />`,
@@ -60,6 +60,8 @@ interface BackendAsset {
   icon_path: string | null;
   physical_width: number;
   physical_height: number;
+  lat?: number | null;
+  lng?: number | null;
 }
 
 async function transformBackendAssets(backendAssets: BackendAsset[]): Promise<Asset[]> {
@@ -67,8 +69,10 @@ async function transformBackendAssets(backendAssets: BackendAsset[]): Promise<As
   
   for (const asset of backendAssets) {
     try {
-      // Transform physical coordinates to geographic coordinates
-      const { lat, lng } = await physicalToGeographic(asset.x, asset.y);
+      // The backend sends lat/lng already, only convert here if it could not (map without bounds)
+      const { lat, lng } = asset.lat != null && asset.lng != null
+        ? { lat: asset.lat, lng: asset.lng }
+        : await physicalToGeographic(asset.x, asset.y);
       
       transformedAssets.push({
         id: asset.id,
@@ -104,6 +108,7 @@ function ChangeMapView({ center, zoom }: { center: LatLngExpression; zoom: numbe
 const Map = ({ zoom = defaults.zoom, backendAssets, parkCenter, parkBounds }: MapProps) => {
   const [assets, setAssets] = useState<Asset[]>([]);
   const [loading, setLoading] = useState(false);
+  const { iconUrl } = useAssetCatalog();
 
   useEffect(() => {
     if (backendAssets && backendAssets.length > 0) {
@@ -153,7 +158,7 @@ const Map = ({ zoom = defaults.zoom, backendAssets, parkCenter, parkBounds }: Ma
         <Marker
           key={asset.id}
           position={[asset.lat, asset.lng]}
-          icon={createCustomIcon(asset.icon_path, asset.rotation)}
+          icon={createCustomIcon(asset.icon_path, iconUrl(asset.icon_path), asset.rotation)}
           draggable={false}
         >
           <Popup>
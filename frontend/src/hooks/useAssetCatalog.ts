@@ -0,0 +1,96 @@
+import { useState, useEffect, useCallback } from 'react';
+
+const API_BASE = 'http://localhost:8000';
+
+export interface AssetBackgroundInfo {
+  id: number;
+  type_name: string;
+  icon_path: string;
+  cost: number | null;
+  size: string;
+  carbon_emission: number | null;
+  has_context: boolean;
+  primary_user: string;
+  usage_patterns: string;
+  lighting_noise: string;
+  drainage_maintenance: string;
+  nearby_assets_40_miles: number;
+}
+
+interface AssetCatalog {
+  hash: string;
+  backgrounds: AssetBackgroundInfo[];
+  icon_bundle: { hash: string; url: string } | null;
+}
+
+interface IconBundle {
+  hash: string;
+  icons: Record<string, string>;
+}
+
+// Fetched once per page load and shared by every component using the hook
+let catalogPromise: Promise<{ catalog: AssetCatalog; iconUrls: Record<string, string> }> | null = null;
+
+async function loadCatalog() {
+  // The browser revalidates with the ETag once its copy is older than the backend's max-age
+  const response = await fetch(`${API_BASE}/api/asset-catalog/`);
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+  const catalog: AssetCatalog = await response.json();
+
+  // Every icon in one request, the ?v= URL is cached by the browser until an icon changes
+  const iconUrls: Record<string, string> = {};
+  if (catalog.icon_bundle) {
+    const bundleResponse = await fetch(`${API_BASE}${catalog.icon_bundle.url}`);
+    if (bundleResponse.ok) {
+      const bundle: IconBundle = await bundleResponse.json();
+      for (const [path, svg] of Object.entries(bundle.icons)) {
+        iconUrls[path] = `data:image/svg+xml;charset=utf-8,${encodeURIComponent(svg)}`;
+      }
+    }
+  }
+  return { catalog, iconUrls };
+}
+
+export function useAssetCatalog() {
+  const [backgrounds, setBackgrounds] = useState<AssetBackgroundInfo[]>([]);
+  const [iconUrls, setIconUrls] = useState<Record<string, string>>({});
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    if (!catalogPromise) {
+      catalogPromise = loadCatalog();
+    }
+    let cancelled = false;
+    catalogPromise
+      .then(({ catalog, iconUrls }) => {
+        if (!cancelled) {
+          setBackgrounds(catalog.backgrounds);
+          setIconUrls(iconUrls);
+        }
+      })
+      .catch((err) => {
+        // Try again on the next mount, the map still works with plain icon URLs
+        catalogPromise = null;
+        if (!cancelled) {
+          setError(err instanceof Error ? err.message : 'Failed to fetch asset catalog');
+        }
+        console.error('Error fetching asset catalog:', err);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, []);
+
+  // Inlined icon when the bundle has it, otherwise the plain path (served by Next.js)
+  const iconUrl = useCallback(
+    (iconPath: string | null) => {
+      const path = iconPath || '/asset-images/playground.svg';
+      return iconUrls[path] || path;
+    },
+    [iconUrls]
+  );
+
+  return { backgrounds, iconUrl, error };
+}
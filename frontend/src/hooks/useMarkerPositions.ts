@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 
 interface MarkerPosition {
   id: number;
@@ -10,6 +10,16 @@ interface MarkerPosition {
   icon_path: string | null;
   physical_width: number;
   physical_height: number;
+  // Computed by the backend from the map corners, null if the map has no geographic bounds
+  lat: number | null;
+  lng: number | null;
+}
+
+interface MarkerPositionsDelta {
+  seq: number;
+  full: boolean;
+  changed: MarkerPosition[];
+  removed: number[];
 }
 
 export function useMarkerPositions() {
@@ -17,18 +27,39 @@ export function useMarkerPositions() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
+  // Last layout version we have applied, 0 means nothing loaded yet (backend sends a full snapshot)
+  const seqRef = useRef(0);
+  const markersRef = useRef(new Map<number, MarkerPosition>());
+
+  const applyDelta = (data: MarkerPositionsDelta) => {
+    if (data.full) {
+      markersRef.current = new Map();
+    }
+    data.removed.forEach((id) => markersRef.current.delete(id));
+    data.changed.forEach((marker) => markersRef.current.set(marker.id, marker));
+
+    if (data.full || data.changed.length > 0 || data.removed.length > 0) {
+      setMarkerPositions(Array.from(markersRef.current.values()));
+    }
+    seqRef.current = data.seq;
+  };
+
   const fetchMarkerPositions = async () => {
     try {
       setError(null);
       
-      const response = await fetch('http://localhost:8000/api/get-marker-positions/');
+      // Only ask for what changed since the last poll
+      const response = await fetch(`http://localhost:8000/api/get-marker-positions/?since=${seqRef.current}`);
       
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       
-      const data = await response.json();
-      setMarkerPositions(data);
+      const data: MarkerPositionsDelta = await response.json();
+      // A push may have moved us past this poll's version while it was in flight
+      if (data.full || data.seq >= seqRef.current) {
+        applyDelta(data);
+      }
       setLoading(false);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to fetch marker positions');
@@ -41,11 +72,26 @@ export function useMarkerPositions() {
     // Fetch data immediately when component loads
     fetchMarkerPositions();
     
-    // Set up interval to fetch every 5 seconds
+    // Set up interval to fetch every 5 seconds (catches anything the push stream missed)
     const interval = setInterval(fetchMarkerPositions, 5000);
+
+    // Push stream: each message is the delta for exactly one layout version
+    const socket = new WebSocket('ws://localhost:8000/ws/markers/');
+    socket.onmessage = (event) => {
+      const data: MarkerPositionsDelta = JSON.parse(event.data);
+      if (data.seq === seqRef.current + 1) {
+        applyDelta(data);
+      } else if (data.seq > seqRef.current) {
+        // Missed a version, catch up over HTTP
+        fetchMarkerPositions();
+      }
+    };
     
     // Cleanup function to clear interval when component unmounts
-    return () => clearInterval(interval);
+    return () => {
+      clearInterval(interval);
+      socket.close();
+    };
   }, []);
 
   return { markerPositions, loading, error };
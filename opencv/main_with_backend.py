@@ -1,10 +1,13 @@
 import cv2
 import numpy as np
 import json
+import os
 import requests
+import socket
 import time
 import threading
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 camera_folder = 'camera_1'  # Change as needed
 calib_path = f'{camera_folder}/calibration_data.npz'
@@ -19,10 +22,23 @@ def rvec_to_degrees(rvec):
     R, _ = cv2.Rodrigues(rvec)
     yaw = np.arctan2(R[1, 0], R[0, 0]) * 180 / np.pi
     return yaw
+
+# Pixels of reprojection error at which an observation counts half
+REPROJECTION_ERROR_SCALE = 2.0
+
+def observation_confidence(center_distance, reprojection_error):
+    """
+    0-1 weight for fusing this camera's view of a marker with other cameras in the backend.
+    center_distance is 0 at the image centre and 1 in a corner (lens distortion is worst there).
+    """
+    edge_factor = 1.0 - 0.5 * min(center_distance, 1.0) ** 2
+    return edge_factor / (1.0 + reprojection_error / REPROJECTION_ERROR_SCALE)
+
 # Import ArUco functions at module level
 try:
     from detect_aruco_marker import detect_aruco
     from homography import compute_global_homography
+    from marker_wire import MARKER_FRAME_CONFIDENCE_CONTENT_TYPE, SOCKET_LENGTH_PREFIX, encode_marker_frame, encode_socket_message
 except ImportError as e:
     print(f"Failed to import ArUco modules: {e}")
     print("Make sure detect_aruco_marker.py and homography.py are in the same directory")
@@ -70,55 +86,160 @@ marker_map = {
 }
 corner_ids = {0, 1, 2, 3}
 marker_positions = []
+marker_positions_captured_at = None  # time.time() of the frame marker_positions came from
 marker_dict = {}
 
 # Backend configuration
 BACKEND_URL = "http://localhost:8000/api/update-marker-positions/"
-UPDATE_INTERVAL = 5.0  # Send updates every 5 second
+# Send straight to `manage.py listen_markers` instead of over HTTP, e.g. udp://192.168.1.10:9999 or tcp://...
+# (fine on the same LAN, then updates can go out at frame rate: set DETECTOR_UPDATE_INTERVAL=0.033)
+SOCKET_TARGET = os.environ.get('DETECTOR_SOCKET')
+UPDATE_INTERVAL = float(os.environ.get('DETECTOR_UPDATE_INTERVAL', 5.0))  # Send updates every 5 second
+# Identifies this detector to the backend, which orders updates per source (set it when running several cameras)
+SOURCE_ID = os.environ.get('DETECTOR_SOURCE_ID', f"{socket.gethostname()}-{camera_folder}")
+
+def parse_retry_after(value, default=1.0):
+    """Seconds to wait from a Retry-After header (seconds or an HTTP date)"""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+def binary_unsupported(response):
+    """Whether a response to a binary frame means the backend does not take frames at all"""
+    # Older backends reject the content type (415) or try to parse the frame as JSON (400 with
+    # this error). Any other 400 is about that one frame, keep sending frames
+    if response.status_code == 415:
+        return True
+    if response.status_code != 400:
+        return False
+    try:
+        return response.json().get('error') == 'Invalid JSON format'
+    except ValueError:
+        return False
+
+
+def layout_of(marker_positions):
+    """What a batch says about the layout: id, x, y, rotation per marker"""
+    # Confidence is only a fusion weight and changes with every frame, comparing it would make
+    # an unchanged layout look new and defeat the "only send if data has changed" check
+    return tuple((marker["id"], marker["x"], marker["y"], marker["rotation"]) for marker in marker_positions)
+
 
 class BackendSync:
-    def __init__(self, backend_url):
+    def __init__(self, backend_url, source_id, socket_target=None):
         self.backend_url = backend_url
-        self.last_sent_data = None
+        self.socket_target = socket_target
+        self.sock = None
+        self.source_id = source_id
+        self.last_sent_data = None  # layout_of() the last batch that went out
         self.lock = threading.Lock()
+        # Send packed binary frames until the backend says it doesn't understand them, then stick to JSON
+        self.use_binary = True
+        self.seq = 0
+        # Set from Retry-After when the backend answers 429, nothing is sent before then
+        self.retry_at = 0.0
+    
+    def _post(self, marker_positions, captured_at):
+        # Every batch gets the next sequence number and the capture time of its frame,
+        # so the backend can throw away retries and updates that arrive out of order
+        self.seq += 1
+        if self.use_binary:
+            response = requests.post(
+                self.backend_url,
+                data=encode_marker_frame(marker_positions, self.seq, captured_at, confidence=True),
+                headers={'Content-Type': MARKER_FRAME_CONFIDENCE_CONTENT_TYPE, 'X-Marker-Source': self.source_id},
+                timeout=2.0
+            )
+            if not binary_unsupported(response):
+                return response
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Backend rejected binary frames, falling back to JSON")
+            self.use_binary = False
+        
+        return requests.post(
+            self.backend_url,
+            json={"source": self.source_id, "seq": self.seq, "timestamp": captured_at, "markers": marker_positions},
+            headers={'Content-Type': 'application/json'},
+            timeout=2.0
+        )
     
-    def send_marker_positions(self, marker_positions):
+    def _send_socket(self, marker_positions, captured_at):
+        # One datagram (or length-prefixed message) per batch, no response to wait for
+        self.seq += 1
+        protocol, _, address = self.socket_target.partition('://')
+        host, port = address.rsplit(':', 1)
+        frame = encode_marker_frame(marker_positions, self.seq, captured_at, confidence=True)
+        message = encode_socket_message(frame, MARKER_FRAME_CONFIDENCE_CONTENT_TYPE, self.source_id)
+        try:
+            if protocol == 'tcp':
+                if self.sock is None:
+                    self.sock = socket.create_connection((host, int(port)), timeout=2.0)
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.sock.sendall(SOCKET_LENGTH_PREFIX.pack(len(message)) + message)
+            else:
+                if self.sock is None:
+                    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.sendto(message, (host, int(port)))
+        except OSError:
+            # Reconnect on the next batch
+            if self.sock is not None:
+                self.sock.close()
+            self.sock = None
+            raise
+
+    def send_marker_positions(self, marker_positions, captured_at=None):
         """Send marker positions to backend"""
+        if captured_at is None:
+            captured_at = time.time()
         try:
             with self.lock:
+                if time.monotonic() < self.retry_at:
+                    # Backing off, the next send after that carries the latest positions anyway
+                    return
                 # Only send if data has changed
-                if self.last_sent_data != marker_positions:
-                    response = requests.post(
-                        self.backend_url,
-                        json=marker_positions,
-                        headers={'Content-Type': 'application/json'},
-                        timeout=2.0
-                    )
+                layout = layout_of(marker_positions)
+                if self.last_sent_data != layout and self.socket_target:
+                    self._send_socket(marker_positions, captured_at)
+                    self.last_sent_data = layout
+                elif self.last_sent_data != layout:
+                    response = self._post(marker_positions, captured_at)
                     
-                    if response.status_code == 200:
+                    if response.status_code == 429:
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        self.retry_at = time.monotonic() + retry_after
+                        print(f"[{datetime.now().strftime('%H:%M:%S')}] Backend is busy, backing off for {retry_after:.1f}s")
+                    elif response.status_code == 200:
                         print(f"[{datetime.now().strftime('%H:%M:%S')}] Sent {len(marker_positions)} marker positions to backend")
-                        self.last_sent_data = marker_positions.copy()
+                        self.last_sent_data = layout
                     else:
                         print(f"[{datetime.now().strftime('%H:%M:%S')}] Backend error: {response.status_code} - {response.text}")
                 else:
                     print(f"[{datetime.now().strftime('%H:%M:%S')}] No changes to send")
                     
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, OSError) as e:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Network error: {e}")
         except Exception as e:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Error sending data: {e}")
 
 # Initialize backend sync
-backend_sync = BackendSync(BACKEND_URL)
+backend_sync = BackendSync(BACKEND_URL, SOURCE_ID, SOCKET_TARGET)
 
 def send_to_backend_periodically():
     """Background thread to send data to backend periodically"""
     while True:
         with backend_sync.lock:
             current_positions = marker_positions.copy()
+            captured_at = marker_positions_captured_at
         
         if current_positions:
-            backend_sync.send_marker_positions(current_positions)
+            backend_sync.send_marker_positions(current_positions, captured_at)
         
         time.sleep(UPDATE_INTERVAL)
 
@@ -127,8 +248,9 @@ backend_thread = threading.Thread(target=send_to_backend_periodically, daemon=Tr
 backend_thread.start()
 
 print("Starting ArUco marker detection with backend sync...")
-print(f"Backend URL: {BACKEND_URL}")
+print(f"Backend URL: {SOCKET_TARGET or BACKEND_URL}")
 print(f"Update interval: {UPDATE_INTERVAL}s")
+print(f"Source ID: {SOURCE_ID}")
 
 # Load map configuration from backend
 print("Loading map configuration...")
@@ -154,6 +276,7 @@ while True:
     ret, frame = cap.read()
     if not ret:
         break
+    frame_time = time.time()
 
     # Detect all ArUco markers
     #Undistort the frame
@@ -163,6 +286,7 @@ while True:
 
     rvecs = []
     tvecs = []
+    reprojection_errors = []
     if ids is not None:
         for i, corner in enumerate(corners):
             # Create 3D object points for the marker
@@ -178,9 +302,12 @@ while True:
             if ret:
                 rvecs.append(rvec)
                 tvecs.append(tvec)
+                projected, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+                reprojection_errors.append(float(np.linalg.norm(projected.reshape(-1, 2) - corner[0], axis=1).mean()))
             else:
                 rvecs.append(None)
                 tvecs.append(None)
+                reprojection_errors.append(None)
     
     # Compute homography from camera to map if corner markers are detected
     H = compute_global_homography(corners, ids, marker_map)
@@ -200,21 +327,29 @@ while True:
             if i < len(rvecs) and rvecs[i] is not None:
                 rotation = rvec_to_degrees(rvecs[i])
 
+            # How much the backend should trust this camera's view of the marker when fusing cameras
+            pixel = center[0][0]
+            center_distance = float(np.hypot(pixel[0] - w / 2, pixel[1] - h / 2) / np.hypot(w / 2, h / 2))
+            reprojection_error = reprojection_errors[i] if i < len(reprojection_errors) and reprojection_errors[i] is not None else REPROJECTION_ERROR_SCALE
+
             # Draw transformed (map) coordinates on screen
             if (0 <= map_x <= MAP_WIDTH and 0 <= map_y <= MAP_LENGTH):
                 marker_dict[int(marker_id)] = {
                     "x": float(map_x),
                     "y": float(map_y),
-                    "rotation": float(rotation)
+                    "rotation": float(rotation),
+                    "confidence": observation_confidence(center_distance, reprojection_error)
                 }
             else:
                 marker_dict.pop(int(marker_id), None)
 
         # Update marker positions list
         marker_positions = [
-            {"id": marker_id, "x": marker_data["x"], "y": marker_data["y"], "rotation": marker_data["rotation"]}
+            {"id": marker_id, "x": marker_data["x"], "y": marker_data["y"], "rotation": marker_data["rotation"],
+             "confidence": marker_data["confidence"]}
             for marker_id, marker_data in sorted(marker_dict.items())
         ]
+        marker_positions_captured_at = frame_time
 
     # Still save to local JSON file for backup/debugging
     with open("marker_positions.json", "w") as f:
@@ -0,0 +1,40 @@
+import struct
+
+# Detector side of the binary marker update format, see backend/ideas/wire.py for the layout.
+# Kept as a plain struct encoder so the detector does not import anything from the backend.
+
+MARKER_FRAME_CONTENT_TYPE = 'application/vnd.tangible.markers'
+MARKER_FRAME_CONFIDENCE_CONTENT_TYPE = 'application/vnd.tangible.markers-confidence'
+
+FRAME_HEADER = struct.Struct('<IdH')
+RECORD = struct.Struct('<Hfff')
+CONFIDENCE_RECORD = struct.Struct('<Hffff')
+
+# Wrapper for sending bodies over UDP/TCP to manage.py listen_markers (TCP adds the length prefix)
+SOCKET_MESSAGE_HEADER = struct.Struct('<BB')
+SOCKET_LENGTH_PREFIX = struct.Struct('<I')
+SOCKET_KINDS = {'application/json': 0, MARKER_FRAME_CONTENT_TYPE: 1, MARKER_FRAME_CONFIDENCE_CONTENT_TYPE: 2}
+
+
+def encode_marker_frame(marker_positions, seq, timestamp, confidence=False):
+    """
+    Pack [{"id", "x", "y", "rotation"}, ...] into one frame. With confidence=True every record
+    also carries the marker's "confidence" and the frame goes out as MARKER_FRAME_CONFIDENCE_CONTENT_TYPE.
+    """
+    record = CONFIDENCE_RECORD if confidence else RECORD
+    records = b''.join(
+        record.pack(
+            marker["id"],
+            marker["x"],
+            marker["y"],
+            float('nan') if marker.get("rotation") is None else marker["rotation"],
+            *((marker.get("confidence", 1.0),) if confidence else ()),
+        )
+        for marker in marker_positions
+    )
+    return FRAME_HEADER.pack(seq & 0xFFFFFFFF, timestamp, len(marker_positions)) + records
+
+
+def encode_socket_message(body, content_type, source=''):
+    source = source.encode()[:255]
+    return SOCKET_MESSAGE_HEADER.pack(SOCKET_KINDS[content_type], len(source)) + source + body